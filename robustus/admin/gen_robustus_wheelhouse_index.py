@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+"""
+Generate remote index (robustus-index.json) of a robustus remote cache.
+
+Remote cache directory layout:
+    ROOT_DIR/python-wheels/*.whl           wheels
+    ROOT_DIR/*.compiled.{tar.gz,tar.bz2,zip}  compiled archives
+    ROOT_DIR/*.{tar.gz,tar.bz2,zip}        source archives
+
+Manifest is updated incrementally: digests are recomputed only for new or modified files.
+"""
+
+import argparse
+import logging
+import sys
+from robustus.detail.remote_index import update_manifest, MANIFEST_NAME
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Generate %s for robustus remote cache' % MANIFEST_NAME)
+    parser.add_argument('root_dir', help='remote cache directory')
+    parser.add_argument('--wheels-dir',
+                        default='python-wheels',
+                        help='subdirectory of ROOT_DIR containing wheels')
+    args = parser.parse_args(argv)
+
+    manifest = update_manifest(args.root_dir, args.wheels_dir)
+    logging.info('Found %d artifact(s) in directory "%s"' % (len(manifest['artifacts']), args.root_dir))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format="%(message)s", level=logging.INFO)
+    main(sys.argv[1:])
@@ -0,0 +1,52 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+import json
+import os
+import pytest
+import robustus.admin.gen_robustus_wheelhouse_index as gen_index
+from robustus.detail.remote_index import MANIFEST_NAME
+
+
+def test_gen_robustus_wheelhouse_index(tmpdir):
+    root_dir = str(tmpdir.mkdir('remote_cache'))
+    wheels_dir = os.path.join(root_dir, 'python-wheels')
+    os.mkdir(wheels_dir)
+
+    files = [os.path.join(wheels_dir, 'A_PKG-0-py27-none-any.whl'),
+             os.path.join(root_dir, 'OpenCV-2.4.8-x86_64.compiled.tar.gz'),
+             os.path.join(root_dir, 'bullet-2.81.tar.bz2'),
+             os.path.join(root_dir, 'index.html')]
+    for filename in files:
+        with open(filename, 'w') as f:
+            f.write(os.path.basename(filename))
+
+    gen_index.main([root_dir])
+    with open(os.path.join(root_dir, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+
+    artifacts = dict((a['url'], a) for a in manifest['artifacts'])
+    assert sorted(artifacts.keys()) == ['OpenCV-2.4.8-x86_64.compiled.tar.gz',
+                                        'bullet-2.81.tar.bz2',
+                                        'python-wheels/A_PKG-0-py27-none-any.whl']
+    wheel = artifacts['python-wheels/A_PKG-0-py27-none-any.whl']
+    assert (wheel['kind'], wheel['name'], wheel['version'], wheel['platform']) == ('wheel', 'A_PKG', '0', 'any')
+    assert wheel['size'] == len('A_PKG-0-py27-none-any.whl')
+    compiled = artifacts['OpenCV-2.4.8-x86_64.compiled.tar.gz']
+    assert (compiled['kind'], compiled['name'], compiled['version'], compiled['platform']) == \
+        ('compiled', 'OpenCV', '2.4.8', 'x86_64')
+
+    # unchanged files keep their digests, modified ones are rehashed
+    with open(files[2], 'w') as f:
+        f.write('modified bullet archive')
+    gen_index.main([root_dir])
+    with open(os.path.join(root_dir, MANIFEST_NAME)) as f:
+        updated = dict((a['url'], a) for a in json.load(f)['artifacts'])
+    assert updated['OpenCV-2.4.8-x86_64.compiled.tar.gz'] == compiled
+    assert updated['bullet-2.81.tar.bz2']['sha256'] != artifacts['bullet-2.81.tar.bz2']['sha256']
+
+
+if __name__ == '__main__':
+    pytest.main('-s %s -n0' % __file__)
@@ -0,0 +1,124 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+"""
+Persistent per-package build logs.
+
+Output of shell commands run while a build log is active is written to a gzip compressed
+log file, so that it is available for diagnosis after the install. Previous logs of the
+same package are rotated. Only a bounded tail of the output is kept in memory.
+"""
+
+import collections
+import contextlib
+import gzip
+import os
+import threading
+
+
+# number of logs of the same package kept, including the current one
+KEEP_LOGS = 5
+# bytes of command output kept in memory to print on failure
+TAIL_SIZE = 64 * 1024
+
+_active = []
+_lock = threading.Lock()
+
+
+class OutputTail(object):
+    """
+    Ring buffer keeping the last size bytes written to it.
+    >>> tail = OutputTail(8)
+    >>> tail.write('0123')
+    >>> tail.write('456789')
+    >>> tail.getvalue()
+    '23456789'
+    """
+    def __init__(self, size=TAIL_SIZE):
+        self.size = size
+        self._chunks = collections.deque()
+        self._length = 0
+
+    def write(self, data):
+        self._chunks.append(data)
+        self._length += len(data)
+        while self._length - len(self._chunks[0]) >= self.size:
+            self._length -= len(self._chunks.popleft())
+
+    def truncated(self):
+        """
+        :return: True if some of the output written doesn't fit into the buffer
+        """
+        return self._length > self.size
+
+    def getvalue(self):
+        return ''.join(self._chunks)[-self.size:]
+
+
+class BuildLog(object):
+    def __init__(self, log_dir, name, keep=KEEP_LOGS):
+        """
+        Open new log, rotating previous logs <name>.log.gz -> <name>.1.log.gz -> ... so that
+        at most keep logs of the package are left.
+        :param log_dir: directory to keep logs in
+        :param name: name of the log, usually package name and version
+        """
+        if not os.path.isdir(log_dir):
+            try:
+                os.makedirs(log_dir)
+            except OSError:
+                if not os.path.isdir(log_dir):
+                    raise
+        self.path = os.path.join(log_dir, name + '.log.gz')
+        for i in reversed(range(keep)):
+            older = self._rotated_path(log_dir, name, i)
+            if os.path.isfile(older):
+                if i + 1 < keep:
+                    os.rename(older, self._rotated_path(log_dir, name, i + 1))
+                else:
+                    os.remove(older)
+        self._file = gzip.open(self.path, 'wb')
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _rotated_path(log_dir, name, i):
+        return os.path.join(log_dir, '%s.log.gz' % name if i == 0 else '%s.%d.log.gz' % (name, i))
+
+    def write(self, data):
+        with self._lock:
+            if self._file is not None:
+                self._file.write(data)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+@contextlib.contextmanager
+def build_log(log_dir, name, keep=KEEP_LOGS):
+    """
+    Collect output of shell commands run in the context into new build log.
+    Logs of nested contexts (e.g. package installing its dependencies) are separate.
+    :return: BuildLog
+    """
+    log = BuildLog(log_dir, name, keep)
+    with _lock:
+        _active.append(log)
+    try:
+        yield log
+    finally:
+        with _lock:
+            _active.remove(log)
+        log.close()
+
+
+def current():
+    """
+    :return: BuildLog of the innermost active build_log context or None
+    """
+    with _lock:
+        return _active[-1] if len(_active) > 0 else None
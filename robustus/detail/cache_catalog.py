@@ -0,0 +1,106 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+"""
+Catalog of verified files in robustus cache.
+
+Digest of every file robustus downloads into the cache is computed during transfer and
+recorded together with size and modification time of the file. Later the file is trusted
+as long as its size and modification time are unchanged, without reading it again.
+"""
+
+import logging
+import os
+import time
+from utility import read_json, write_json, file_sha256
+
+
+class CacheCatalog(object):
+    def __init__(self, root_dir, filename):
+        """
+        :param root_dir: cache directory, only files inside it are cataloged
+        :param filename: file to persist catalog in
+        """
+        self.root_dir = os.path.abspath(root_dir)
+        self.filename = filename
+        self.entries = read_json(filename, {})
+        # forget files removed from cache
+        for key in self.entries.keys():
+            if not os.path.isfile(os.path.join(self.root_dir, key)):
+                del self.entries[key]
+
+    def _key(self, path):
+        path = os.path.abspath(path)
+        if not path.startswith(self.root_dir + os.sep):
+            return None
+        return os.path.relpath(path, self.root_dir)
+
+    def contains(self, path):
+        """
+        :return: True if path is inside cache directory and thus can be cataloged
+        """
+        return self._key(path) is not None
+
+    def record(self, path, sha256, url=None):
+        """
+        Record digest of file just downloaded or verified.
+        :param path: path to file in cache, files outside of cache are ignored
+        :param sha256: sha256 hex digest of the file
+        :param url: where the file was downloaded from
+        """
+        key = self._key(path)
+        if key is None:
+            return
+        st = os.stat(path)
+        self.entries[key] = {'sha256': sha256,
+                             'size': st.st_size,
+                             'mtime': st.st_mtime,
+                             'url': url,
+                             'recorded': time.time()}
+        self._save()
+
+    def digest(self, path):
+        """
+        :return: recorded sha256 digest of the file if file is unchanged since it was recorded, None otherwise
+        """
+        key = self._key(path)
+        entry = self.entries.get(key) if key is not None else None
+        if entry is None or not os.path.isfile(path):
+            return None
+        st = os.stat(path)
+        if st.st_size != entry['size'] or st.st_mtime != entry['mtime']:
+            return None
+        return entry['sha256']
+
+    def is_intact(self, path):
+        """
+        Check that cached file matches recorded digest. Unchanged files are trusted without reading,
+        files touched since they were recorded are rehashed. Files never recorded are considered intact.
+        :return: False if file is corrupt
+        """
+        key = self._key(path)
+        if key is None or key not in self.entries:
+            return True
+        if self.digest(path) is not None:
+            return True
+        entry = self.entries[key]
+        digest = file_sha256(path)
+        if digest != entry['sha256']:
+            logging.warn('Cached file %s is corrupt: sha256 %s, expected %s' % (path, digest, entry['sha256']))
+            return False
+        # file was touched, but content is the same
+        self.record(path, digest, entry['url'])
+        return True
+
+    def forget(self, path):
+        key = self._key(path)
+        if key is not None and self.entries.pop(key, None) is not None:
+            self._save()
+
+    def _save(self):
+        try:
+            write_json(self.filename, self.entries)
+        except (IOError, OSError) as e:
+            logging.info('Failed to save cache catalog to %s: %s' % (self.filename, e))
@@ -0,0 +1,169 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+"""
+Compiler cache shared by native builds.
+
+Robustus runs compilers of the builds it drives (recipes, makepanda, catkin, pip wheel) through
+ccache. Compiled objects are stored in <cache>/.robustus/ccache, so rebuilding a package with slightly
+changed options, or for another environment using the same cache, reuses the objects which didn't
+change. ccache is taken from PATH or installed into environment on first native build, builds of
+wheels only use ccache which is already there and nothing is installed in offline mode.
+
+Builds get a directory with symlinks named after compilers (gcc, g++, cc, ...) pointing to ccache
+prepended to their PATH, this way ccache is used by any build system without touching its options.
+"""
+
+import contextlib
+import distutils.spawn
+import logging
+import os
+import re
+import subprocess
+from utility import ln
+
+
+CCACHE_VERSION = '3.7.12'
+# maximal size of objects kept in the store, least recently used objects are removed
+DEFAULT_CACHE_SIZE = '5G'
+# compilers masqueraded by ccache
+COMPILERS = ['cc', 'c++', 'gcc', 'g++', 'clang', 'clang++']
+
+
+def _stats_field(output, name):
+    match = re.search(r'^%s\s+(\d+)\s*$' % re.escape(name), output, re.MULTILINE)
+    return int(match.group(1)) if match is not None else 0
+
+
+def parse_stats(output):
+    """
+    Parse statistics printed by "ccache --print-stats" (ccache 4) or "ccache -s" (ccache 3).
+    :return: tuple (hits, misses)
+    """
+    if 'direct_cache_hit' in output:
+        hits = _stats_field(output, 'direct_cache_hit') + _stats_field(output, 'preprocessed_cache_hit')
+        return hits, _stats_field(output, 'cache_miss')
+    hits = _stats_field(output, 'cache hit (direct)') + _stats_field(output, 'cache hit (preprocessed)')
+    return hits, _stats_field(output, 'cache miss')
+
+
+class CompilerCache(object):
+    def __init__(self, robustus):
+        self.robustus = robustus
+        self.store = os.path.join(robustus.cache_info_dir, 'ccache')
+        self.masquerade_dir = os.path.join(robustus.env, 'lib/ccache')
+        self._executable = None
+
+    @property
+    def enabled(self):
+        return self.robustus.settings.get('compiler_cache', True)
+
+    def executable(self, install=True):
+        """
+        :param install: install ccache into environment if it isn't found
+        :return: path to ccache, None if ccache is unavailable
+        """
+        if self._executable is None:
+            found = self._find()
+            if found is None and not install:
+                return None
+            # set before install, build of ccache itself runs without it
+            self._executable = ''
+            self._executable = found or self._install() or ''
+        return self._executable or None
+
+    def _find(self):
+        env_ccache = os.path.join(self.robustus.env, 'bin/ccache')
+        if os.path.isfile(env_ccache):
+            return env_ccache
+        return distutils.spawn.find_executable('ccache')
+
+    def _install(self):
+        # import here to avoid circular dependency
+        from requirement import RequirementSpecifier
+        if self.robustus.settings.get('offline'):
+            logging.info('ccache is not installed, building without compiler cache in offline mode')
+            return None
+        logging.info('ccache is not installed. Installing')
+        self.robustus.install_requirement(RequirementSpecifier(name='ccache', version=CCACHE_VERSION),
+                                          ignore_index=False, tag=None)
+        env_ccache = os.path.join(self.robustus.env, 'bin/ccache')
+        if not os.path.isfile(env_ccache):
+            logging.warn('Failed to install ccache, building without compiler cache')
+            return None
+        return env_ccache
+
+    def _masquerade(self, executable):
+        """
+        Make directory of symlinks to ccache named after compilers.
+        """
+        if not os.path.isdir(self.masquerade_dir):
+            os.makedirs(self.masquerade_dir)
+        for compiler in COMPILERS:
+            link = os.path.join(self.masquerade_dir, compiler)
+            if os.path.realpath(link) != os.path.realpath(executable):
+                ln(executable, link, force=True)
+
+    def environ(self, env=None, install=True):
+        """
+        :param env: environment of build, os.environ by default
+        :param install: install ccache into environment if it isn't found
+        :return: copy of env making compilers run through ccache
+        """
+        env = dict(os.environ if env is None else env)
+        if not self.enabled:
+            return env
+        executable = self.executable(install)
+        if executable is None:
+            return env
+        self._masquerade(executable)
+        path = [p for p in env.get('PATH', os.defpath).split(os.pathsep) if p != self.masquerade_dir]
+        env['PATH'] = os.pathsep.join([self.masquerade_dir] + path)
+        env['CCACHE_DIR'] = self.store
+        env['CCACHE_MAXSIZE'] = self.robustus.settings.get('compiler_cache_size') or DEFAULT_CACHE_SIZE
+        # builds run in the scratch area, paths inside it are hashed relative to working directory and
+        # working directory isn't hashed, so that package built in another build directory (e.g. for
+        # another environment) shares objects unless its compiler options contain paths of environment
+        env['CCACHE_BASEDIR'] = os.path.abspath(self.robustus.build_root)
+        env['CCACHE_NOHASHDIR'] = '1'
+        return env
+
+    def stats(self):
+        """
+        :return: tuple (hits, misses) counted by the store so far or None if ccache isn't used
+        """
+        if not self.enabled or not self._executable or not os.path.isdir(self.store):
+            return None
+        env = dict(os.environ)
+        env['CCACHE_DIR'] = self.store
+        for option in ['--print-stats', '-s']:
+            p = subprocess.Popen([self._executable, option], env=env,
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            output = p.communicate()[0]
+            if p.returncode == 0:
+                return parse_stats(output)
+        return None
+
+    @contextlib.contextmanager
+    def build(self, name, env=None, install=True):
+        """
+        Context of a build compiling through the cache, hit rate of the cache is logged afterwards.
+        Compilations of builds running concurrently with the same store are counted as well.
+        :param env: environment of build, os.environ by default
+        :param install: install ccache into environment if it isn't found, builds which may not compile
+        anything (e.g. of wheels) shouldn't do it
+        :return: environment build commands have to run in
+        """
+        env = self.environ(env, install)
+        before = self.stats() or (0, 0)
+        try:
+            yield env
+        finally:
+            after = self.stats()
+            if after is not None:
+                hits, misses = after[0] - before[0], after[1] - before[1]
+                if hits + misses > 0:
+                    logging.info('Compiler cache of %s build: %d hits, %d misses (%d%% hit rate)'
+                                 % (name, hits, misses, 100 * hits / (hits + misses)))
@@ -0,0 +1,230 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+"""
+Graph of requirements inclusion, built from requirements files read during resolution.
+
+Nodes are requirements files and requirements (identified by their freeze() string), edges
+go from requirements file or editable requirement to requirements and files (-r or -c) listed
+in it. Requirements given on command line are included from COMMAND_LINE node. Pins in
+constraints files are not requirements, so constraints files have no children, graph keeps the
+pins applied to requirements separately.
+"""
+
+import json
+from collections import OrderedDict, deque
+from requirement import RequirementSpecifier, RequirementException, _parse_requirements_lines
+from remote_index import normalize_name
+
+
+COMMAND_LINE = '<command line>'
+
+
+class DependencyGraph(object):
+    def __init__(self):
+        # node id -> dict(name, version), name is None for requirements files
+        self.nodes = OrderedDict()
+        # node id -> list of node ids it includes
+        self.children = OrderedDict()
+        # node id -> list of node ids including it
+        self.parents = OrderedDict()
+        self.selected = set()
+        # normalized package name -> constraint replacing every pin of the package
+        self.constraints = OrderedDict()
+
+    @staticmethod
+    def from_visited(visited_sites, specifiers=None, selected_requirements=None, constraints=None):
+        """
+        :param visited_sites: visited_sites filled by expand_requirements_specifiers/read_requirement_file
+        :param specifiers: requirements given on command line
+        :param selected_requirements: requirements robustus is going to install
+        :param constraints: constraints filled by expand_requirements_specifiers
+        :return: DependencyGraph
+        >>> graph = DependencyGraph.from_visited({'requirements.txt': ['numpy==1.7.2', 'scipy==0.13.3']},
+        ...                                      ['numpy==1.8.0'])
+        >>> graph.children[COMMAND_LINE]
+        ['numpy==1.8.0']
+        >>> graph.parents['numpy==1.7.2']
+        ['requirements.txt']
+        """
+        graph = DependencyGraph()
+        if specifiers:
+            graph._add_includes(COMMAND_LINE, specifiers)
+        constraints_files = set(value for lines in visited_sites.values()
+                                for option, value in _parse_requirements_lines(lines or []) if option == '-c')
+        for node, lines in visited_sites.items():
+            graph._add_includes(node, lines if lines and node not in constraints_files else [])
+        for r in selected_requirements or []:
+            graph.selected.add(r.freeze())
+        for name, c in (constraints or {}).items():
+            # constraints without version or url don't replace pins
+            if c.version is not None or c.url is not None:
+                graph.constraints[normalize_name(name)] = c.freeze()
+        return graph
+
+    def _add_node(self, node, name=None, version=None):
+        if node not in self.nodes:
+            self.nodes[node] = {'name': name, 'version': version}
+            self.children[node] = []
+            self.parents[node] = []
+        elif name is not None:
+            self.nodes[node] = {'name': name, 'version': version}
+
+    def _add_includes(self, node, lines):
+        self._add_node(node)
+        for option, line in _parse_requirements_lines(lines):
+            if option is not None:
+                # included requirements or constraints file
+                self._add_node(line)
+                if line not in self.children[node]:
+                    self.children[node].append(line)
+                    self.parents[line].append(node)
+                continue
+            try:
+                r = RequirementSpecifier(specifier=line)
+            except RequirementException:
+                continue
+            child = r.freeze()
+            name = r.name if r.name is not None else r.base_name()
+            self._add_node(child, name, r.version)
+            if child not in self.children[node]:
+                self.children[node].append(child)
+                self.parents[child].append(node)
+
+    def roots(self):
+        return [n for n in self.nodes if len(self.parents[n]) == 0]
+
+    def find(self, name):
+        """
+        :return: ids of requirement nodes with given package name
+        """
+        name = normalize_name(name)
+        return [n for n, info in self.nodes.items() if info['name'] is not None and normalize_name(info['name']) == name]
+
+    def _shortest_path(self, node):
+        """
+        :return: the shortest inclusion path from a root to node, list of node ids
+        """
+        # breadth first search from node towards roots, every node remembers its child on the shortest path
+        next_hop = {node: None}
+        queue = deque([node])
+        while len(queue) > 0:
+            n = queue.popleft()
+            if len(self.parents[n]) == 0:
+                path = [n]
+                while path[-1] != node:
+                    path.append(next_hop[path[-1]])
+                return path
+            for parent in self.parents[n]:
+                if parent not in next_hop:
+                    next_hop[parent] = n
+                    queue.append(parent)
+        # node is only included from a cycle
+        return [node]
+
+    def paths_to(self, node):
+        """
+        :return: list of the shortest inclusion paths through every node directly including node, each
+        path is a list of node ids
+        """
+        if len(self.parents[node]) == 0:
+            return [[node]]
+        return [self._shortest_path(parent) + [node] for parent in self.parents[node]]
+
+    def why(self, name):
+        """
+        :return: text describing every version of package and all the ways it was included
+        """
+        nodes = self.find(name)
+        if len(nodes) == 0:
+            return '%s is not required\n' % name
+        result = ''
+        for node in nodes:
+            result += '%s%s\n' % (node, ' [to be installed]' if node in self.selected else '')
+            for path in self.paths_to(node):
+                result += '    %s\n' % ' -> '.join(path)
+        return result
+
+    def conflicts(self):
+        """
+        Packages pinned to different versions (or different urls) by different requirements files,
+        packages pinned by constraints are not conflicting since the constraint replaces all pins.
+        :return: OrderedDict package name -> list of conflicting requirement node ids
+        >>> graph = DependencyGraph.from_visited({'a.txt': ['numpy==1.7.2', 'scipy'], 'b.txt': ['NumPy==1.8.0', 'scipy'],
+        ...                                       'c.txt': ['numpy==1.7.2', 'scipy==0.13.3']})
+        >>> graph.conflicts().items()
+        [('numpy', ['numpy==1.7.2', 'NumPy==1.8.0'])]
+        """
+        pins = OrderedDict()
+        for n, info in self.nodes.items():
+            if info['name'] is None or info['name'] == 'ros_overlay':
+                continue
+            if normalize_name(info['name']) in self.constraints:
+                continue
+            # unpinned requirement is satisfied by any version
+            if info['version'] is None and n in (info['name'], '-e ' + info['name']):
+                continue
+            pins.setdefault(normalize_name(info['name']), []).append(n)
+        return OrderedDict((name, nodes) for name, nodes in pins.items() if len(nodes) > 1)
+
+    def describe_conflicts(self):
+        """
+        :return: text listing every conflicting pin with requirements files including it
+        """
+        result = ''
+        for name, nodes in self.conflicts().items():
+            result += '%s is required in different versions:\n' % name
+            for node in nodes:
+                result += '    %s%s, included from:\n' % (node, ' [to be installed]' if node in self.selected else '')
+                for parent in self.parents[node]:
+                    result += '        %s\n' % parent
+        return result
+
+    def to_json(self):
+        return json.dumps({'nodes': [dict(id=n, selected=n in self.selected, **info) for n, info in self.nodes.items()],
+                           'edges': [[n, c] for n in self.nodes for c in self.children[n]],
+                           'constraints': self.constraints},
+                          indent=2)
+
+    @staticmethod
+    def from_json(data):
+        data = json.loads(data)
+        graph = DependencyGraph()
+        for node in data['nodes']:
+            graph._add_node(node['id'], node['name'], node['version'])
+            if node['selected']:
+                graph.selected.add(node['id'])
+        for parent, child in data['edges']:
+            graph.children[parent].append(child)
+            graph.parents[child].append(parent)
+        # graphs saved before constraints were kept have none
+        graph.constraints.update(data.get('constraints', {}))
+        return graph
+
+    def to_dot(self):
+        """
+        >>> print DependencyGraph.from_visited({}, ['numpy==1.8.0'], [RequirementSpecifier(specifier='numpy==1.8.0')]).to_dot()
+        digraph requirements {
+            "<command line>" [shape=box];
+            "numpy==1.8.0" [style=bold];
+            "<command line>" -> "numpy==1.8.0";
+        }
+        """
+        def quote(s):
+            return '"%s"' % s.replace('\\', '\\\\').replace('"', '\\"')
+
+        lines = ['digraph requirements {']
+        for n, info in self.nodes.items():
+            if info['name'] is None:
+                lines.append('    %s [shape=box];' % quote(n))
+            elif n in self.selected:
+                lines.append('    %s [style=bold];' % quote(n))
+            else:
+                lines.append('    %s;' % quote(n))
+        for n in self.nodes:
+            for c in self.children[n]:
+                lines.append('    %s -> %s;' % (quote(n), quote(c)))
+        lines.append('}')
+        return '\n'.join(lines)
@@ -0,0 +1,330 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+"""
+Reading and editing rpath of ELF executables and shared libraries.
+
+Rpath (DT_RPATH or DT_RUNPATH entry of dynamic section) is a string in the dynamic string
+table. If the new rpath fits into the space of the old one, the string is overwritten in place,
+rpaths which need more space are left to patchelf.
+
+Growing string table of shared library without patchelf is available on request (grow=True): extended
+copy of string table (and of dynamic section if new entry is needed) is appended to the file in a new
+loadable segment together with program headers, the way patchelf does it. Executables are never grown.
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+
+
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_STRSZ = 10
+DT_SONAME = 14
+DT_RPATH = 15
+DT_RUNPATH = 29
+# dynamic entries which values are offsets in the string table
+_STRING_TAGS = (DT_NEEDED, DT_SONAME, DT_RPATH, DT_RUNPATH)
+
+ET_DYN = 3
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+PT_PHDR = 6
+PF_W = 2
+PF_R = 4
+SHT_STRTAB = 3
+SHT_DYNAMIC = 6
+
+_HEADER_FIELDS = ('type', 'machine', 'version', 'entry', 'phoff', 'shoff', 'flags', 'ehsize',
+                  'phentsize', 'phnum', 'shentsize', 'shnum', 'shstrndx')
+_SEGMENT_FIELDS = {True: ('type', 'flags', 'offset', 'vaddr', 'paddr', 'filesz', 'memsz', 'align'),
+                   False: ('type', 'offset', 'vaddr', 'paddr', 'filesz', 'memsz', 'flags', 'align')}
+_SEGMENT_FORMAT = {True: 'IIQQQQQQ', False: 'IIIIIIII'}
+_SECTION_FIELDS = ('name', 'type', 'flags', 'addr', 'offset', 'size', 'link', 'info', 'addralign', 'entsize')
+_SECTION_FORMAT = {True: 'IIQQQQIIQQ', False: 'IIIIIIIIII'}
+_DYNAMIC_FORMAT = {True: 'qQ', False: 'iI'}
+
+
+class ElfError(Exception):
+    pass
+
+
+def is_elf(path):
+    with open(path, 'rb') as f:
+        return f.read(4) == '\x7fELF'
+
+
+def _align(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+
+class ElfFile(object):
+    def __init__(self, path):
+        """
+        Read headers and dynamic section of ELF file.
+        :param path: path to executable or shared library
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._data = f.read()
+        ident = self._data[:16]
+        if len(ident) < 16 or ident[:4] != '\x7fELF':
+            raise ElfError('%s is not an ELF file' % path)
+        if ident[4] not in '\x01\x02' or ident[5] not in '\x01\x02':
+            raise ElfError('%s has unknown ELF class or data encoding' % path)
+        self._is64 = ident[4] == '\x02'
+        self._endian = '<' if ident[5] == '\x01' else '>'
+        address = 'Q' if self._is64 else 'I'
+        self._header_format = 'HHI%s%s%sIHHHHHH' % (address, address, address)
+        self.header = dict(zip(_HEADER_FIELDS, self._unpack(self._header_format, 16)))
+        self.segments = [self._read_struct(_SEGMENT_FIELDS[self._is64], _SEGMENT_FORMAT[self._is64],
+                                           self.header['phoff'] + i * self.header['phentsize'])
+                         for i in range(self.header['phnum'])]
+        self.sections = []
+        if self.header['shoff'] != 0:
+            self.sections = [self._read_struct(_SECTION_FIELDS, _SECTION_FORMAT[self._is64],
+                                               self.header['shoff'] + i * self.header['shentsize'])
+                             for i in range(self.header['shnum'])]
+        self._read_dynamic()
+
+    def _unpack(self, fmt, offset):
+        fmt = self._endian + fmt
+        size = struct.calcsize(fmt)
+        if offset < 0 or offset + size > len(self._data):
+            raise ElfError('%s is truncated' % self.path)
+        return struct.unpack_from(fmt, self._data, offset)
+
+    def _pack(self, fmt, *values):
+        return struct.pack(self._endian + fmt, *values)
+
+    def _read_struct(self, fields, fmt, offset):
+        return dict(zip(fields, self._unpack(fmt, offset)))
+
+    def _pack_struct(self, fields, fmt, values):
+        return self._pack(fmt, *[values[f] for f in fields])
+
+    def _segments(self, segment_type):
+        return [s for s in self.segments if s['type'] == segment_type]
+
+    def _offset(self, address):
+        """
+        :return: file offset of virtual address
+        """
+        for s in self._segments(PT_LOAD):
+            if s['vaddr'] <= address < s['vaddr'] + s['filesz']:
+                return address - s['vaddr'] + s['offset']
+        raise ElfError('address %x is not mapped from file %s' % (address, self.path))
+
+    def _read_dynamic(self):
+        # list of [tag, value], without terminating DT_NULL
+        self.dynamic = []
+        dynamic = self._segments(PT_DYNAMIC)
+        if len(dynamic) == 0:
+            # statically linked
+            return
+        entry_size = struct.calcsize(_DYNAMIC_FORMAT[self._is64])
+        start, end = dynamic[0]['offset'], dynamic[0]['offset'] + dynamic[0]['filesz']
+        for entry_offset in range(start, end - entry_size + 1, entry_size):
+            tag, value = self._unpack(_DYNAMIC_FORMAT[self._is64], entry_offset)
+            if tag == DT_NULL:
+                break
+            self.dynamic.append([tag, value])
+
+    def _value(self, tag):
+        values = [value for t, value in self.dynamic if t == tag]
+        return values[0] if len(values) > 0 else None
+
+    def _strtab(self):
+        strtab = self._value(DT_STRTAB)
+        if strtab is None:
+            raise ElfError('%s has no dynamic string table' % self.path)
+        return self._offset(strtab)
+
+    def _string(self, offset):
+        start = self._strtab() + offset
+        end = self._data.find('\0', start)
+        if end < 0:
+            raise ElfError('string table of %s is truncated' % self.path)
+        return self._data[start:end]
+
+    def rpath_entry(self):
+        """
+        :return: (tag, offset in string table) of DT_RUNPATH or DT_RPATH entry, None if there is none
+        """
+        for tag in (DT_RUNPATH, DT_RPATH):
+            value = self._value(tag)
+            if value is not None:
+                return tag, value
+        return None
+
+    def rpath(self):
+        """
+        :return: rpath string, empty if file has no rpath
+        """
+        entry = self.rpath_entry()
+        return self._string(entry[1]) if entry is not None else ''
+
+    def needed(self):
+        """
+        :return: list of libraries file depends on
+        """
+        return [self._string(value) for tag, value in self.dynamic if tag == DT_NEEDED]
+
+    def _fits(self, rpath):
+        entry = self.rpath_entry()
+        if entry is None:
+            return False
+        old_rpath = self._string(entry[1])
+        if len(rpath) > len(old_rpath):
+            return False
+        # linkers may merge string with a suffix of another one, other dynamic entries pointing
+        # into the old string would change as well
+        start, end = entry[1], entry[1] + len(old_rpath)
+        for tag, value in self.dynamic:
+            if tag in _STRING_TAGS and value != start and start <= value <= end:
+                return False
+        return True
+
+    def _can_grow(self):
+        # kernel maps program headers of executables, moving them is left to patchelf
+        return (self.header['type'] == ET_DYN and len(self._segments(PT_INTERP)) == 0 and
+                len(self._segments(PT_DYNAMIC)) == 1 and self._value(DT_STRSZ) is not None)
+
+    def can_set_rpath(self, rpath, grow=False):
+        """
+        :param grow: allow growing string table of shared library
+        :return: True if rpath can be set without patchelf
+        """
+        return self._fits(rpath) or (grow and self._can_grow())
+
+    def set_rpath(self, rpath, grow=False):
+        """
+        Set rpath, overwriting the old string in place if the new one fits.
+        :param grow: grow string table of shared library if the new rpath doesn't fit
+        """
+        if self._fits(rpath):
+            self._set_rpath_in_place(rpath)
+        elif grow and self._can_grow():
+            self._set_rpath_growing(rpath)
+        else:
+            raise ElfError('rpath of %s can\'t be set to %s without patchelf' % (self.path, rpath))
+
+    def _set_rpath_in_place(self, rpath):
+        _, offset = self.rpath_entry()
+        old_rpath = self._string(offset)
+        file_offset = self._strtab() + offset
+        with open(self.path, 'r+b') as f:
+            f.seek(file_offset)
+            f.write(rpath.ljust(len(old_rpath), '\0'))
+        self._data = self._data[:file_offset] + rpath.ljust(len(old_rpath), '\0') + \
+            self._data[file_offset + len(old_rpath):]
+
+    def _set_rpath_growing(self, rpath):
+        loads = self._segments(PT_LOAD)
+        page = min(max([s['align'] for s in loads] + [0x1000]), 0x10000)
+        # new segment goes after everything mapped, its address is congruent to file offset modulo page
+        offset = _align(len(self._data), 8)
+        vaddr = _align(max(s['vaddr'] + s['memsz'] for s in loads), page) + offset % page
+
+        old_strtab, strsz = self._strtab(), self._value(DT_STRSZ)
+        strtab = self._data[old_strtab:old_strtab + strsz] + rpath + '\0'
+        dynamic = [list(entry) for entry in self.dynamic]
+        rpath_entries = [entry for entry in dynamic if entry[0] in (DT_RPATH, DT_RUNPATH)]
+        move_dynamic = len(rpath_entries) == 0
+        if move_dynamic:
+            # robustus always used DT_RPATH, which also applies to dependencies of the library
+            dynamic.append([DT_RPATH, strsz])
+        for entry in rpath_entries:
+            entry[1] = strsz
+
+        # layout of new segment: program headers, dynamic section (if moved), string table
+        segments = [dict(s) for s in self.segments]
+        new_segment = {'type': PT_LOAD, 'flags': PF_R | PF_W, 'offset': offset, 'vaddr': vaddr, 'paddr': vaddr,
+                       'filesz': 0, 'memsz': 0, 'align': page}
+        last_load = max(i for i, s in enumerate(segments) if s['type'] == PT_LOAD)
+        segments.insert(last_load + 1, new_segment)
+        phdrs_size = len(segments) * self.header['phentsize']
+        dynamic_offset = offset + _align(phdrs_size, 8)
+        entry_size = struct.calcsize(_DYNAMIC_FORMAT[self._is64])
+        dynamic_size = (len(dynamic) + 1) * entry_size if move_dynamic else 0
+        strtab_offset = dynamic_offset + dynamic_size
+        new_segment['filesz'] = new_segment['memsz'] = strtab_offset + len(strtab) - offset
+
+        def address(file_offset):
+            return file_offset - offset + vaddr
+
+        for entry in dynamic:
+            if entry[0] == DT_STRTAB:
+                entry[1] = address(strtab_offset)
+            elif entry[0] == DT_STRSZ:
+                entry[1] = len(strtab)
+        for s in segments:
+            if s['type'] == PT_PHDR:
+                s['offset'], s['vaddr'], s['paddr'] = offset, vaddr, vaddr
+                s['filesz'] = s['memsz'] = phdrs_size
+            elif s['type'] == PT_DYNAMIC and move_dynamic:
+                s['offset'], s['vaddr'], s['paddr'] = dynamic_offset, address(dynamic_offset), address(dynamic_offset)
+                s['filesz'] = s['memsz'] = dynamic_size
+
+        header = dict(self.header, phoff=offset, phnum=len(segments))
+        sections = [dict(s) for s in self.sections]
+        for s in sections:
+            if s['type'] == SHT_STRTAB and s['addr'] == self._value(DT_STRTAB) and s['addr'] != 0:
+                s['addr'], s['offset'], s['size'] = address(strtab_offset), strtab_offset, len(strtab)
+            elif s['type'] == SHT_DYNAMIC and move_dynamic:
+                s['addr'], s['offset'], s['size'] = address(dynamic_offset), dynamic_offset, dynamic_size
+
+        data = bytearray(self._data)
+        data[16:16 + struct.calcsize(self._endian + self._header_format)] = \
+            self._pack_struct(_HEADER_FIELDS, self._header_format, header)
+        for i, s in enumerate(sections):
+            section_offset = self.header['shoff'] + i * self.header['shentsize']
+            packed = self._pack_struct(_SECTION_FIELDS, _SECTION_FORMAT[self._is64], s)
+            data[section_offset:section_offset + len(packed)] = packed
+        if not move_dynamic:
+            # entries are only changed, the old dynamic section keeps its size
+            dynamic_segment = self._segments(PT_DYNAMIC)[0]
+            packed = ''.join(self._pack(_DYNAMIC_FORMAT[self._is64], *entry) for entry in dynamic)
+            data[dynamic_segment['offset']:dynamic_segment['offset'] + len(packed)] = packed
+        data += '\0' * (offset - len(data))
+        phdrs = ''.join(self._pack_struct(_SEGMENT_FIELDS[self._is64], _SEGMENT_FORMAT[self._is64], s)
+                        for s in segments)
+        data += phdrs.ljust(dynamic_offset - offset, '\0')
+        if move_dynamic:
+            data += ''.join(self._pack(_DYNAMIC_FORMAT[self._is64], *entry) for entry in dynamic + [[DT_NULL, 0]])
+        data += strtab
+
+        # replace file atomically, so that interrupted install doesn't leave broken library
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            shutil.copymode(self.path, temp_path)
+            os.rename(temp_path, self.path)
+        except:
+            os.remove(temp_path)
+            raise
+        self.__init__(self.path)
+
+
+def add_rpath(path, rpath, grow=False):
+    """
+    Append directory to rpath of ELF file unless it is already there.
+    :param grow: grow string table of shared library if the new rpath doesn't fit into the old one
+    :return: True if rpath contains directory, False if rpath has to be changed by patchelf
+    """
+    elf = ElfFile(path)
+    directories = [d for d in elf.rpath().split(':') if len(d) > 0]
+    if rpath in directories:
+        return True
+    new_rpath = ':'.join(directories + [rpath])
+    if not elf.can_set_rpath(new_rpath, grow):
+        return False
+    elf.set_rpath(new_rpath, grow)
+    return True
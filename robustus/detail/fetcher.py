@@ -0,0 +1,194 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+"""
+Single entry point for install scripts to fetch sources from network.
+
+Downloaded files are kept in downloads folder of robustus cache and verified with the cache
+catalog, interrupted downloads are resumed, files are looked up on remote caches (find_links)
+before their original location. Git repositories are cloned from local mirrors.
+"""
+
+import logging
+import os
+import socket
+import subprocess
+import urllib2
+from collections import OrderedDict
+from git_mirror import GitMirrorStore
+from requirement import RequirementException
+from utility import download, run_shell, safe_remove, DownloadError, file_sha256
+
+
+class Fetcher(object):
+    def __init__(self, robustus):
+        self.robustus = robustus
+        self.downloads_dir = os.path.join(robustus.cache, 'downloads')
+        self.git_mirrors = GitMirrorStore(os.path.join(robustus.cache_info_dir, 'git'),
+                                          verbose=robustus.settings['verbosity'] >= 1)
+
+    @property
+    def offline(self):
+        return self.robustus.settings.get('offline', False)
+
+    def _verbose(self):
+        return self.robustus.settings['verbosity'] >= 1
+
+    def _cached(self, path, sha256):
+        if not os.path.isfile(path) or not self.robustus.cache_catalog.is_intact(path):
+            return False
+        if sha256 is None:
+            return True
+        digest = self.robustus.cache_catalog.digest(path)
+        return (digest if digest is not None else file_sha256(path)) == sha256
+
+    def fetch_url(self, url, filename=None, sha256=None, use_mirrors=True):
+        """
+        Fetch file into downloads cache, unless it's already there.
+        :param url: original location of the file
+        :param filename: name to store file under, by default taken from url. Remote caches are searched
+        for file of this name, so it should be unique (e.g. contain package name and version)
+        :param sha256: expected sha256 hex digest of the file
+        :param use_mirrors: look for file on remote caches (find_links) first
+        :return: path to the file
+        """
+        if filename is None:
+            filename = url.split('/')[-1]
+        path = os.path.join(self.downloads_dir, filename)
+        if self._cached(path, sha256):
+            logging.info('Using cached %s' % filename)
+            return path
+        safe_remove(path)
+
+        if self.offline:
+            raise RequirementException('%s is not cached and can\'t be downloaded in offline mode' % filename)
+
+        if not os.path.isdir(self.downloads_dir):
+            os.makedirs(self.downloads_dir)
+
+        if use_mirrors and not self.robustus.settings.get('no_remote_cache', False):
+            archive = self.robustus._download_archive([filename], dest_dir=self.downloads_dir)
+            if archive is not None:
+                if sha256 is None or self._cached(archive, sha256):
+                    return archive
+                logging.warn('%s found on remote cache doesn\'t match expected digest' % filename)
+                safe_remove(archive)
+
+        governor = self.robustus.governor
+        try:
+            with governor.slot():
+                _, digest = download(url, path, verbose=self.robustus.settings['verbosity'] >= 2,
+                                     expected_digest=sha256, return_digest=True, throttle=governor.throttle(url),
+                                     resume=True, timeout=self.robustus.settings.get('mirror_timeout'))
+        except (urllib2.URLError, socket.error, DownloadError) as e:
+            raise RequirementException('Failed to download %s: %s' % (url, e))
+        self.robustus.cache_catalog.record(path, digest, url)
+        return path
+
+    def _clone_direct(self, url, dest, branch):
+        """
+        Clone straight from url when it can't be mirrored. Only the requested branch or tag is fetched
+        if possible, since such clone is not reused.
+        """
+        logging.warn('Failed to mirror %s, cloning directly' % url)
+        if branch is not None:
+            retcode = run_shell(['git', 'clone', '--depth', '1', '--branch', branch, url, dest],
+                                verbose=self._verbose())
+            if retcode == 0:
+                return
+            # branch may be a commit, which can't be fetched shallowly
+            safe_remove(dest)
+        retcode = run_shell(['git', 'clone', url, dest], verbose=self._verbose())
+        if retcode != 0:
+            raise RequirementException('Failed to clone %s' % url)
+        if branch is not None:
+            retcode = run_shell(['git', 'checkout', branch], cwd=dest, verbose=self._verbose())
+            if retcode != 0:
+                raise RequirementException('Failed to checkout %s in %s' % (branch, url))
+
+    def _update_submodules(self, url, dest):
+        """
+        Initialize submodules of working copy, serving them from local mirrors too.
+        """
+        try:
+            output = subprocess.check_output(['git', 'config', '-f', '.gitmodules', '--get-regexp',
+                                              r'^submodule\..*\.(url|path)$'], cwd=dest)
+        except subprocess.CalledProcessError:
+            # no submodules
+            output = ''
+        # submodule name -> {'url': url, 'path': path}
+        submodules = OrderedDict()
+        for line in output.splitlines():
+            if len(line.split()) == 2:
+                key, value = line.split()
+                name, option = key[len('submodule.'):].rsplit('.', 1)
+                submodules.setdefault(name, {})[option] = value
+        # git doesn't let submodules be cloned from local paths unless allowed explicitly
+        config = ['-c', 'protocol.file.allow=always']
+        for submodule in submodules.values():
+            submodule_url = submodule.get('url')
+            if submodule_url is None or submodule_url.startswith('.'):
+                # relative to superproject url, can't be redirected
+                continue
+            try:
+                # commit superproject pins submodule to
+                with open(os.devnull, 'w') as devnull:
+                    commit = subprocess.check_output(['git', 'rev-parse', 'HEAD:%s' % submodule.get('path')],
+                                                     cwd=dest, stderr=devnull).strip()
+            except subprocess.CalledProcessError:
+                continue
+            mirror = self.git_mirrors.update(submodule_url, commit)
+            if mirror is None:
+                if self.offline:
+                    logging.warn('Submodule %s is not mirrored, submodules of %s are not updated' % (submodule_url, url))
+                    return
+                continue
+            self.git_mirrors.fetch_blobs(submodule_url, commit)
+            config += ['-c', 'url.%s.insteadOf=%s' % (mirror, submodule_url)]
+        retcode = run_shell(['git'] + config + ['submodule', 'update', '--init'], cwd=dest, verbose=self._verbose())
+        if retcode != 0:
+            logging.warn('Failed to update submodules of %s' % url)
+
+    def clone(self, url, dest, branch=None, submodules=False, paths=None):
+        """
+        Clone git repository from local mirror. Working copy looks like cloned from url.
+        :param url: repository url
+        :param dest: directory to clone into
+        :param branch: branch, tag or commit to checkout, None for default branch
+        :param submodules: initialize submodules
+        :param paths: list of folders of repository to checkout (sparse checkout), None for whole repository.
+        Whole repository may be checked out if it can't be mirrored.
+        :return: dest
+        """
+        self.git_mirrors.offline = self.offline
+        mirror = self.git_mirrors.update(url, branch)
+        if mirror is None:
+            if self.offline:
+                raise RequirementException('%s is not mirrored and can\'t be cloned in offline mode' % url)
+            self._clone_direct(url, dest, branch)
+        else:
+            if not self.git_mirrors.fetch_blobs(url, branch if branch is not None else 'HEAD'):
+                logging.warn('Files of %s at %s are not in local mirror' % (url, branch or 'HEAD'))
+            # local clone hardlinks objects of the mirror, nothing is copied
+            retcode = run_shell(['git', 'clone', '--no-checkout', mirror, dest], verbose=self._verbose())
+            if retcode != 0:
+                raise RequirementException('Failed to clone %s from local mirror %s' % (url, mirror))
+            run_shell(['git', 'remote', 'set-url', 'origin', url], cwd=dest, verbose=self._verbose())
+            if self.git_mirrors.is_partial(url):
+                # files of other commits are fetched from origin on demand, like in the mirror
+                for key, value in [('remote.origin.promisor', 'true'), ('remote.origin.partialclonefilter', 'blob:none')]:
+                    run_shell(['git', 'config', key, value], cwd=dest, verbose=self._verbose())
+            if paths is not None:
+                run_shell(['git', 'config', 'core.sparseCheckout', 'true'], cwd=dest, verbose=self._verbose())
+                with open(os.path.join(dest, '.git', 'info', 'sparse-checkout'), 'w') as f:
+                    f.write(''.join('/%s/\n' % p.strip('/') for p in paths))
+            retcode = run_shell(['git', 'checkout', '-f', branch if branch is not None else 'HEAD'],
+                                cwd=dest, verbose=self._verbose())
+            if retcode != 0:
+                raise RequirementException('Failed to checkout %s in %s' % (branch, url))
+
+        if submodules:
+            self._update_submodules(url, dest)
+        return dest
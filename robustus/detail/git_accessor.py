@@ -3,6 +3,7 @@
 # License under MIT license (see LICENSE file)
 # =============================================================================
 
+import errno
 import tempfile
 import shutil
 import os
@@ -12,6 +13,41 @@ import logging
 
 
 class GitAccessor(object):
+    def __init__(self, mirrors=None):
+        '''
+        @mirrors: GitMirrorStore to read files from, fetched once per run. Without it
+        repository is cloned into temporary folder on every access.
+        '''
+        self.mirrors = mirrors
+        self._contents = {}
+
+    def _commit(self, git_dir, ref):
+        '''
+        @return: commit ref points to in repository or None if there is no such ref
+        '''
+        try:
+            with open(os.devnull, 'w') as devnull:
+                return subprocess.check_output(['git', '--git-dir', git_dir, 'rev-parse', '--verify', '-q',
+                                                ref + '^{commit}'], stderr=devnull).strip()
+        except subprocess.CalledProcessError:
+            return None
+
+    def _show(self, git_dir, commit, path_to_file):
+        '''
+        Read file without checkout, content is cached per repository and commit.
+        @return: file content or None if there is no such file
+        '''
+        key = (git_dir, commit, path_to_file)
+        if key not in self._contents:
+            try:
+                with open(os.devnull, 'w') as devnull:
+                    content = subprocess.check_output(['git', '--git-dir', git_dir, 'show',
+                                                       '%s:%s' % (commit, path_to_file)], stderr=devnull)
+                self._contents[key] = content.splitlines(True)
+            except subprocess.CalledProcessError:
+                self._contents[key] = None
+        return self._contents[key]
+
     def access(self, repo_link, tag, path_to_file, ignore_missing_refs = False):
         '''
         Checkout a single file from git repo specified
@@ -19,6 +55,25 @@ class GitAccessor(object):
         ignore_missing_refs: use default branch and don't error if tag is non-existent.
         @return: file content 
         '''
+        if self.mirrors is None:
+            return self._access_clone(repo_link, tag, path_to_file, ignore_missing_refs)
+
+        git_dir = self.mirrors.update(repo_link, tag)
+        if git_dir is None:
+            raise subprocess.CalledProcessError(1, ['git', 'fetch', repo_link, tag or 'HEAD'])
+        commit = self._commit(git_dir, tag if tag is not None else 'HEAD')
+        if commit is None:
+            if tag is None or not ignore_missing_refs:
+                raise subprocess.CalledProcessError(1, ['git', 'rev-parse', '--verify', tag or 'HEAD'])
+            logging.info('Ignoring missing refs %s on %s' % (repo_link, tag))
+            self.mirrors.update(repo_link)
+            commit = self._commit(git_dir, 'HEAD')
+        lines = self._show(git_dir, commit, path_to_file)
+        if lines is None:
+            raise IOError(errno.ENOENT, 'No such file in %s at %s' % (repo_link, commit), path_to_file)
+        return lines
+
+    def _access_clone(self, repo_link, tag, path_to_file, ignore_missing_refs):
         tmp_dir = tempfile.mkdtemp()
         if tag is not None:
             check_run_shell(['git', 'clone', repo_link, tmp_dir], shell=False)
@@ -36,3 +91,62 @@ class GitAccessor(object):
             lines = file.readlines()
         shutil.rmtree(tmp_dir)
         return lines
+
+
+class OfflineGitAccessor(GitAccessor):
+    '''
+    Read files from local git mirrors and working copies of editable requirements, never access network.
+    Repositories that are not available locally are recorded in 'missing' and treated as having empty file.
+    '''
+    def __init__(self, mirrors, src_dir):
+        '''
+        @mirrors: GitMirrorStore
+        @src_dir: directory editable requirements are cloned into (<env>/src)
+        '''
+        GitAccessor.__init__(self, mirrors)
+        self.src_dir = src_dir
+        self.missing = []
+
+    def _git_dirs(self, repo_link):
+        git_dirs = []
+        if self.mirrors.has(repo_link):
+            git_dirs.append(self.mirrors.path(repo_link))
+        if os.path.isdir(self.src_dir):
+            for d in sorted(os.listdir(self.src_dir)):
+                git_dir = os.path.join(self.src_dir, d, '.git')
+                if not os.path.isdir(git_dir):
+                    continue
+                try:
+                    origin = subprocess.check_output(['git', '--git-dir', git_dir, 'config', '--get',
+                                                      'remote.origin.url']).strip()
+                except subprocess.CalledProcessError:
+                    continue
+                if origin == repo_link:
+                    git_dirs.append(git_dir)
+        return git_dirs
+
+    def _read(self, git_dirs, refs, path_to_file):
+        for git_dir in git_dirs:
+            for ref in refs:
+                commit = self._commit(git_dir, ref)
+                if commit is not None:
+                    lines = self._show(git_dir, commit, path_to_file)
+                    if lines is not None:
+                        return lines
+        return None
+
+    def access(self, repo_link, tag, path_to_file, ignore_missing_refs = False):
+        git_dirs = self._git_dirs(repo_link)
+        if len(git_dirs) == 0:
+            logging.info('%s is not available locally' % repo_link)
+            self.missing.append(repo_link)
+            return []
+
+        lines = self._read(git_dirs, [tag, 'origin/' + tag] if tag is not None else ['HEAD'], path_to_file)
+        if lines is None and tag is not None and ignore_missing_refs:
+            logging.info('Ignoring missing refs %s on %s' % (repo_link, tag))
+            lines = self._read(git_dirs, ['HEAD'], path_to_file)
+        if lines is None:
+            self.missing.append('%s (%s:%s)' % (repo_link, tag or 'HEAD', path_to_file))
+            return []
+        return lines
@@ -0,0 +1,181 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+"""
+Store of bare mirrors of git repositories robustus clones.
+
+Every repository is mirrored from network once per machine and only fetched (at most once
+per ref and robustus run) afterwards. Working copies are cloned from the local mirror, requirements
+files of editable packages are read from it without checkout.
+
+Mirrors are partial: only the branches and tags robustus asked for are fetched, without file
+contents (blobs), which git fetches on demand when a file is read. Blobs of a commit are fetched
+in one request before working copy is cloned (see fetch_blobs), so it can be checked out from
+the mirror. Mirrors are not shallow, git can't clone working copies from a shallow partial mirror.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+from utility import run_shell
+
+
+class GitMirrorStore(object):
+    def __init__(self, root_dir, offline=False, verbose=False):
+        """
+        :param root_dir: directory to keep mirrors in
+        :param offline: never access network, use mirrors as they are
+        """
+        self.root_dir = root_dir
+        self.offline = offline
+        self.verbose = verbose
+        # (url, ref) fetched in this run
+        self._fetched = set()
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def path(self, url):
+        """
+        :return: path to bare mirror of repository (may not exist yet)
+        """
+        return os.path.join(self.root_dir, hashlib.sha1(url).hexdigest() + '.git')
+
+    def has(self, url):
+        return os.path.isdir(self.path(url))
+
+    def is_partial(self, url):
+        """
+        :return: True if file contents of mirror are fetched on demand (server supports it)
+        """
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(['git', '--git-dir', self.path(url), 'config', '--get', 'remote.origin.promisor'],
+                                   stdout=devnull, stderr=devnull) == 0
+
+    def update(self, url, ref=None):
+        """
+        Create mirror of repository or fetch new commits of ref into it, once per run.
+        If mirror exists but can't be fetched, it's used as is. Thread safe.
+        :param ref: branch, tag or commit, None for default branch
+        :return: path to mirror or None if mirror doesn't exist and can't be created
+        """
+        with self._url_lock(url):
+            return self._update(url, ref)
+
+    def _url_lock(self, url):
+        with self._lock:
+            return self._locks.setdefault(url, threading.Lock())
+
+    def _update(self, url, ref):
+        mirror = self.path(url)
+        if (url, ref) in self._fetched or (self.offline and os.path.isdir(mirror)):
+            return mirror
+        if self.offline:
+            return None
+
+        if os.path.isdir(mirror):
+            logging.info('Fetching %s of %s into local mirror' % (ref or 'HEAD', url))
+            if not self._fetch(mirror, ref):
+                logging.warn('Failed to fetch %s, using local mirror as is' % url)
+        else:
+            logging.info('Mirroring %s of %s' % (ref or 'HEAD', url))
+            try:
+                os.makedirs(self.root_dir)
+            except OSError:
+                # already exists, possibly created by another thread
+                if not os.path.isdir(self.root_dir):
+                    raise
+            tmp_dir = tempfile.mkdtemp(dir=self.root_dir, prefix='.tmp-')
+            if run_shell(['git', 'init', '-q', '--bare', tmp_dir], verbose=self.verbose) != 0 or \
+                    run_shell(['git', '--git-dir', tmp_dir, 'config', 'remote.origin.url', url],
+                              verbose=self.verbose) != 0 or \
+                    not self._fetch(tmp_dir, ref):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return None
+            os.rename(tmp_dir, mirror)
+        self._fetched.add((url, ref))
+        return mirror
+
+    def _remote_refs(self, git_dir, ref):
+        """
+        :return: (list of full names of remote branches and tags named ref, branch remote HEAD points to
+        if ref is None) or None if remote can't be listed
+        """
+        retcode, output = run_shell(['git', '--git-dir', git_dir, 'ls-remote', '--symref', 'origin', ref or 'HEAD'],
+                                    verbose=self.verbose, return_output=True)
+        if retcode != 0:
+            return None
+        names = []
+        head = None
+        for line in output.splitlines():
+            mo = re.match(r'^ref: (refs/heads/\S+)\tHEAD$', line)
+            if mo is not None:
+                head = mo.group(1)
+                names.append(head)
+                continue
+            mo = re.match(r'^[0-9a-f]{40}\t(refs/(heads|tags)/\S+)$', line)
+            if mo is not None and ref is not None and mo.group(1) in (ref, 'refs/heads/' + ref, 'refs/tags/' + ref):
+                names.append(mo.group(1))
+        return names, head
+
+    def _fetch(self, git_dir, ref):
+        """
+        Fetch ref into mirror without blobs. Only when ref is not a branch or tag (e.g. commit hash), and remote
+        doesn't serve the commit directly, all branches and tags are fetched.
+        :return: True on success
+        """
+        remote_refs = self._remote_refs(git_dir, ref)
+        if remote_refs is None:
+            return False
+        names, head = remote_refs
+        fetch = ['git', '--git-dir', git_dir, 'fetch', '--filter=blob:none']
+        if len(names) > 0:
+            if run_shell(fetch + ['--no-tags', 'origin'] + ['+%s:%s' % (name, name) for name in names],
+                         verbose=self.verbose) != 0:
+                return False
+            if head is not None:
+                run_shell(['git', '--git-dir', git_dir, 'symbolic-ref', 'HEAD', head], verbose=self.verbose)
+            return True
+        if ref is not None and re.match(r'^[0-9a-f]{4,40}$', ref) is None:
+            # there is no such branch or tag, nothing to fetch
+            return True
+        if ref is not None and len(ref) == 40 and run_shell(fetch + ['--no-tags', 'origin', ref], verbose=self.verbose) == 0:
+            return True
+        return run_shell(fetch + ['--prune', 'origin', '+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*'],
+                         verbose=self.verbose) == 0
+
+    def fetch_blobs(self, url, ref):
+        """
+        Fetch contents of all files of ref missing in mirror in one request, so working copy can be checked out
+        from the mirror.
+        :return: True if mirror has all files of ref
+        """
+        with self._url_lock(url):
+            return self._fetch_blobs(url, ref)
+
+    def _fetch_blobs(self, url, ref):
+        mirror = self.path(url)
+        try:
+            with open(os.devnull, 'w') as devnull:
+                objects = subprocess.check_output(['git', '--git-dir', mirror, 'rev-list', '--objects',
+                                                   '--missing=print', '--no-walk', ref], stderr=devnull)
+        except subprocess.CalledProcessError:
+            return False
+        missing = [line[1:] for line in objects.splitlines() if line.startswith('?')]
+        if len(missing) == 0:
+            return True
+        if self.offline:
+            return False
+        logging.info('Fetching %d files of %s at %s into local mirror' % (len(missing), url, ref))
+        with tempfile.TemporaryFile() as oids:
+            oids.write('\n'.join(missing) + '\n')
+            oids.seek(0)
+            return run_shell(['git', '--git-dir', mirror, '-c', 'fetch.negotiationAlgorithm=noop', 'fetch', '-q',
+                              '--no-tags', '--no-write-fetch-head', '--filter=blob:none', '--stdin', 'origin'],
+                             stdin=oids, verbose=self.verbose) == 0
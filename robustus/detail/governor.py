@@ -0,0 +1,175 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+"""
+Bandwidth and concurrency governor for network transfers.
+
+Robots often share a cellular or Wi-Fi link with their teleop and telemetry traffic, so
+robustus can cap bandwidth globally and per host, limit number of concurrent transfers and
+run transfers in low priority background mode. Transfers made by robustus itself are
+throttled with token buckets, external tools (rsync) get equivalent command line options.
+"""
+
+import contextlib
+import logging
+import os
+import threading
+import time
+import urlparse
+from utility import which
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket, tokens are bytes.
+    """
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: bytes per second
+        :param burst: max bytes that may be consumed at once without waiting, one second of traffic by default
+        """
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.tokens = self.burst
+        self.last = time.time()
+        self._lock = threading.Lock()
+
+    def _delay(self, amount):
+        """
+        Take amount of tokens, possibly going into debt.
+        :return: seconds to wait until debt is paid off
+        """
+        with self._lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.
+            return -self.tokens / self.rate
+
+    def consume(self, amount):
+        """
+        Block until amount of bytes may be transferred.
+        """
+        delay = self._delay(amount)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _host(url):
+    """
+    >>> _host('http://thirdparty-packages.braincorporation.net/python-wheels/index.html')
+    'thirdparty-packages.braincorporation.net'
+    >>> _host('user@server:/var/cache/wheelhouse')
+    'server'
+    >>> _host('server:/var/cache/wheelhouse')
+    'server'
+    >>> _host('/var/cache/wheelhouse') is None
+    True
+    >>> _host('file:///var/cache/wheelhouse') is None
+    True
+    """
+    if '://' in url:
+        return urlparse.urlparse(url).hostname
+    # rsync/scp style [user@]host:path
+    if not url.startswith('/') and not url.startswith('file:') and ':' in url.split('/')[0]:
+        return url.split(':')[0].split('@')[-1]
+    return None
+
+
+def parse_host_limits(specs):
+    """
+    Parse per host bandwidth limits given on command line.
+    :param specs: list of 'host=KBPS' strings
+    :return: dict host -> KBPS
+    >>> parse_host_limits(['s3.amazonaws.com=100', 'mirror.lan=2000'])
+    {'s3.amazonaws.com': 100.0, 'mirror.lan': 2000.0}
+    """
+    limits = {}
+    for spec in specs or []:
+        host, sep, kbps = spec.rpartition('=')
+        if not sep or not host:
+            raise ValueError('bad host bandwidth limit "%s", expected host=KBPS' % spec)
+        limits[host] = float(kbps)
+    return limits
+
+
+class Governor(object):
+    """
+    Bandwidth limits are in KBPS (units of 1024 bytes per second) like rsync --bwlimit.
+    """
+    def __init__(self, bwlimit=None, host_bwlimits=None, max_transfers=None, background=False):
+        """
+        :param bwlimit: global bandwidth limit, None for unlimited
+        :param host_bwlimits: dict host -> bandwidth limit
+        :param max_transfers: max number of concurrent transfers, None for unlimited
+        :param background: run transfers one at a time, external tools with low CPU and IO priority
+        """
+        self.bwlimit = bwlimit
+        self.host_bwlimits = host_bwlimits or {}
+        self.background = background
+        if background and max_transfers is None:
+            max_transfers = 1
+        self.max_transfers = max_transfers
+        self._global_bucket = TokenBucket(bwlimit * 1024) if bwlimit else None
+        self._host_buckets = dict((host, TokenBucket(kbps * 1024))
+                                  for host, kbps in self.host_bwlimits.items() if kbps)
+        self._slots = threading.BoundedSemaphore(max_transfers) if max_transfers else None
+
+    def host_bwlimit(self, url):
+        """
+        :return: effective bandwidth limit for transfers from/to url or None if unlimited
+        """
+        limits = [l for l in [self.bwlimit, self.host_bwlimits.get(_host(url))] if l]
+        return min(limits) if len(limits) > 0 else None
+
+    @contextlib.contextmanager
+    def slot(self):
+        """
+        Context of a single transfer, blocks while max number of transfers are in progress.
+        """
+        if self._slots is None:
+            yield
+            return
+        if not self._slots.acquire(False):
+            logging.info('Waiting for one of %d transfers in progress to finish' % self.max_transfers)
+            self._slots.acquire()
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def throttle(self, url):
+        """
+        :return: function to be called with number of bytes after each block transferred from/to url,
+        it sleeps as long as necessary to keep transfer within limits, or None if transfer is unlimited
+        """
+        buckets = [b for b in [self._global_bucket, self._host_buckets.get(_host(url))] if b is not None]
+        if len(buckets) == 0:
+            return None
+
+        def consume(amount):
+            for bucket in buckets:
+                bucket.consume(amount)
+        return consume
+
+    def command(self, cmd, url=None):
+        """
+        Adjust command of external transfer tool to limits of the governor.
+        :param cmd: command as a list, rsync commands get --bwlimit option
+        :param url: remote location command transfers from/to
+        :return: new command list
+        """
+        cmd = list(cmd)
+        if os.path.basename(cmd[0]) == 'rsync':
+            bwlimit = self.host_bwlimit(url) if url is not None else self.bwlimit
+            if bwlimit:
+                cmd.insert(1, '--bwlimit=%d' % max(int(bwlimit), 1))
+        if self.background:
+            if which('ionice') is not None:
+                cmd = ['ionice', '-c3'] + cmd
+            cmd = ['nice', '-n', '19'] + cmd
+        return cmd
@@ -4,7 +4,8 @@
 # =============================================================================
 import sys
 import os
-from robustus.detail import run_shell, RequirementException, fix_rpath
+import tempfile
+from robustus.detail import run_shell, RequirementException, fix_rpath, safe_remove
 
 
 def install(robustus, requirement_specifier, rob_file, ignore_index):
@@ -14,15 +15,18 @@ def install(robustus, requirement_specifier, rob_file, ignore_index):
                          '-DCMAKE_CXX_COMPILER=/usr/bin/g++-4.9',
                          '-DBRAINOS_BUILD_NODES=OFF']
 
+    clone_url = 'git@github.com:braincorp/brainos_core.git'
     robustus.install_cmake_package(requirement_specifier,
                                    cmake_options,
                                    ignore_index,
-                                   clone_url='git@github.com:braincorp/brainos_core.git')
+                                   clone_url=clone_url)
 
-    # install python part of brainos_core
-    url = 'git+ssh://git@github.com/braincorp/brainos_core.git'
-    if requirement_specifier.version is not None:
-        url += '@' + requirement_specifier.version
-    retcode = run_shell([robustus.pip_executable, 'install', url])
-    if retcode != 0:
-        raise RequirementException('Failed to install python part of brainos2_core')
+    # install python part of brainos_core from the same local mirror
+    src_dir = os.path.join(tempfile.mkdtemp(), 'brainos_core')
+    try:
+        robustus.fetcher.clone(clone_url, src_dir, branch=requirement_specifier.version)
+        retcode = run_shell([robustus.pip_executable, 'install', src_dir])
+        if retcode != 0:
+            raise RequirementException('Failed to install python part of brainos2_core')
+    finally:
+        safe_remove(os.path.dirname(src_dir))
@@ -0,0 +1,19 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+from recipe import Recipe, Archive, Autotools, Copy
+
+
+recipe = Recipe('ccache',
+                source=Archive(url='https://github.com/ccache/ccache/releases/download/v%(version)s/'
+                                   'ccache-%(version)s.tar.gz'),
+                build=Autotools(),
+                outputs=['bin/ccache'],
+                runtime=[Copy('bin/ccache', 'bin')],
+                compiler_cache=False)
+
+
+def install(robustus, requirement_specifier, rob_file, ignore_index):
+    recipe.install(robustus, requirement_specifier, ignore_index)
@@ -6,7 +6,7 @@
 import logging
 import os
 from detail import RequirementException
-import subprocess
+from utility import unpack, run_shell
 import sys
 
 
@@ -20,16 +20,16 @@ def install(robustus, requirement_specifier, rob_file, ignore_index):
         logging.info('Downloading cudamat')
         cwd = os.getcwd()
         url = 'https://s3.amazonaws.com/thirdparty-packages.braincorporation.net/cudamat-01-15-2010.tar.gz'
-        subprocess.call(['wget', '-c', url, '-P', robustus.cache])
+        cudamat_tar = robustus.fetcher.fetch_url(url)
 
         logging.info('Unpacking cudamat')
         os.chdir(robustus.cache)
-        cudamat_tar = 'cudamat-01-15-2010.tar.gz'
-        subprocess.call(['tar', 'xzvf', cudamat_tar])
+        unpack(cudamat_tar)
 
         logging.info('Building cudamat')
         os.chdir(cudamat_install_dir)
-        subprocess.call(['make'])
+        with robustus.jobserver.slots():
+            run_shell(['make'], verbose=robustus.settings['verbosity'] >= 1, env=robustus.jobserver.environ())
         os.chdir(cwd)
 
     if in_cache():
@@ -5,7 +5,7 @@
 
 import glob
 import os
-from utility import fix_rpath, ln
+from utility import fix_rpaths, ln
 
 
 def install(robustus, requirement_specifier, rob_file, ignore_index):
@@ -21,9 +21,9 @@ def install(robustus, requirement_specifier, rob_file, ignore_index):
     binaries = glob.glob(os.path.join(install_dir, 'lib/*.so*'))
     for executable in executables:
         binaries += glob.glob(os.path.join(install_dir, 'bin/' + executable + '*'))
-    for binary in binaries:
-        if os.path.isfile(binary) and not os.path.islink(binary):
-            fix_rpath(robustus, robustus.env, binary, lib_dir)
+    fix_rpaths(robustus, robustus.env,
+               [binary for binary in binaries if os.path.isfile(binary) and not os.path.islink(binary)],
+               lib_dir)
 
     # make symlinks
     for executable in executables:
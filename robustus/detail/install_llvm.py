@@ -4,24 +4,15 @@
 # =============================================================================
 
 import os
-import shutil
-import subprocess
+from recipe import Recipe, Archive, Autotools
+
+
+recipe = Recipe('llvm',
+                source=Archive(url='http://llvm.org/releases/%(version)s/llvm-%(version)s.src.tar.gz'),
+                build=Autotools(['--enable-optimized'], make_args=['REQUIRES_RTTI=1']),
+                outputs=['bin/llvm-config'])
 
 
 def install(robustus, requirement_specifier, rob_file, ignore_index):
-    cwd = os.getcwd()
-    os.chdir(robustus.cache)
-    llvm_archive = 'llvm-%s.src.tar.gz' % requirement_specifier.version
-    subprocess.call(['wget', '-c', 'http://llvm.org/releases/%s/%s' % (requirement_specifier.version, llvm_archive)])
-    llvm_install_dir = os.path.join(robustus.cache, 'llvm-%s' % requirement_specifier.version)
-    if not os.path.isdir(llvm_install_dir) and not ignore_index:
-        subprocess.call(['tar', 'zxvf', llvm_archive])
-        llvm_src_dir = 'llvm-%s.src' % requirement_specifier.version
-        os.chdir(llvm_src_dir)
-        os.mkdir(llvm_install_dir)
-        subprocess.call(['./configure', '--enable-optimized', '--prefix', llvm_install_dir])
-        subprocess.call('REQUIRES_RTTI=1 make install', shell=True)
-        os.chdir(robustus.cache)
-        shutil.rmtree(llvm_src_dir)
+    llvm_install_dir = recipe.install(robustus, requirement_specifier, ignore_index)
     os.environ['LLVM_CONFIG_PATH'] = os.path.join(llvm_install_dir, 'bin/llvm-config')
-    os.chdir(cwd)
@@ -9,8 +9,33 @@ import platform
 import glob
 import sys
 import subprocess
-from utility import cp, unpack, safe_remove, fix_rpath, safe_move, ln, run_shell, check_module_available
+from utility import fix_rpath, fix_rpaths, check_module_available
 from requirement import RequirementException
+from recipe import Recipe, Archive, CMake, Copy
+
+
+def _cmake_options(ctx):
+    options = ['-DPYTHON_EXECUTABLE=%s' % ctx.robustus.python_executable,
+               '-DBUILD_NEW_PYTHON_SUPPORT=ON',
+               '-DBUILD_TESTS=OFF',
+               '-DBUILD_PERF_TESTS=OFF',
+               '-DBUILD_DOCS=OFF',
+               '-DBUILD_opencv_apps=OFF',
+               '-DBUILD_opencv_java=OFF',
+               '-DWITH_CUDA=OFF']
+    if sys.platform.startswith('darwin'):
+        python_lib_path = subprocess.check_output(['python-config', '--prefix']).strip()
+        options.append('-DPYTHON_LIBRARY=%s/Python' % python_lib_path)
+        options.append('-DPYTHON_INCLUDE_DIR=%s/Headers' % python_lib_path)
+    return options
+
+
+recipe = Recipe('OpenCV',
+                source=Archive(),
+                build=CMake(_cmake_options),
+                outputs=['lib/python2.7/site-packages/cv2.so'],
+                compiled_archive=True,
+                runtime=[Copy('lib/python2.7/site-packages/*', 'lib/python2.7/site-packages')])
 
 
 def install(robustus, requirement_specifier, rob_file, ignore_index):
@@ -53,88 +78,16 @@ def install(robustus, requirement_specifier, rob_file, ignore_index):
         os.symlink('/usr/lib64/python2.7/site-packages/cv2.so', os.path.join(robustus.env, 'lib/python2.7/site-packages/cv2.so'))
         os.symlink('/usr/lib64/python2.7/site-packages/cv.py', os.path.join(robustus.env, 'lib/python2.7/site-packages/cv.py'))
     else:
-        cv_install_dir = os.path.join(robustus.cache, 'OpenCV-%s' % requirement_specifier.version)
-        cv2so = os.path.join(cv_install_dir, 'lib/python2.7/site-packages/cv2.so')
-
-        def in_cache():
-            return os.path.isfile(cv2so)
-
-        if not in_cache() and not ignore_index:
-            cwd = os.getcwd()
-            opencv_archive = None
-            opencv_archive_name = None
-
-            try:
-                opencv_archive = robustus.download_compiled_archive('OpenCV', requirement_specifier.version)
-
-                if opencv_archive is not None:
-                    opencv_archive_name = unpack(opencv_archive)
-
-                    logging.info('Initializing compiled OpenCV')
-                    # install into wheelhouse
-                    safe_move(opencv_archive_name, cv_install_dir)
-                else:
-                    opencv_archive = robustus.download('OpenCV', requirement_specifier.version)
-                    opencv_archive_name = unpack(opencv_archive)
+        cv_install_dir = recipe.install(robustus, requirement_specifier, ignore_index)
 
-                    logging.info('Building OpenCV')
-                    cv_build_dir = os.path.join(opencv_archive_name, 'build')
-                    if not os.path.isdir(cv_build_dir):
-                        os.mkdir(cv_build_dir)
-                    os.chdir(cv_build_dir)
-
-                    opencv_cmake_call_args = [
-                        'cmake',
-                        '../',
-                        '-DPYTHON_EXECUTABLE=%s' % robustus.python_executable,
-                        '-DBUILD_NEW_PYTHON_SUPPORT=ON',
-                        '-DBUILD_TESTS=OFF',
-                        '-DBUILD_PERF_TESTS=OFF',
-                        '-DBUILD_DOCS=OFF',
-                        '-DBUILD_opencv_apps=OFF',
-                        '-DBUILD_opencv_java=OFF',
-                        '-DWITH_CUDA=OFF',
-                        '-DCMAKE_INSTALL_PREFIX=%s' % cv_install_dir]
-
-                    if sys.platform.startswith('darwin'):
-                        python_lib_path = subprocess.check_output(['python-config', '--prefix']).strip()
-                        opencv_cmake_call_args.append('-DPYTHON_LIBRARY=%s/Python' % python_lib_path)
-                        opencv_cmake_call_args.append('-DPYTHON_INCLUDE_DIR=%s/Headers' % python_lib_path)
-
-                    run_shell(opencv_cmake_call_args,
-                              verbose=robustus.settings['verbosity'] >= 1)
-                    retcode = run_shell(['make', '-j4'], verbose=robustus.settings['verbosity'] >= 1)
-                    if retcode != 0:
-                        raise RequirementException('OpenCV build failed')
-
-                    # install into wheelhouse
-                    if not os.path.isdir(cv_install_dir):
-                        os.mkdir(cv_install_dir)
-                    retcode = run_shell(['make', 'install'], verbose=robustus.settings['verbosity'] >= 1)
-                    if retcode != 0:
-                        raise RequirementException('OpenCV installation failed')
-
-            finally:
-                safe_remove(opencv_archive)
-                safe_remove(opencv_archive_name)
-                os.chdir(cwd)
-
-            if in_cache():
-                # fix rpath for all dynamic libraries of cv2
-                all_cv_dlibs = os.path.abspath(os.path.join(cv_install_dir, 'lib'))
-                if sys.platform.startswith('darwin'):
-                    libs = glob.glob(os.path.join(all_cv_dlibs, '*.dylib'))
-                else:
-                    libs = glob.glob(os.path.join(all_cv_dlibs, '*.so'))
-                for lib in libs:
-                    fix_rpath(robustus, robustus.env, lib, cv_install_dir)
-
-        if in_cache():
-            logging.info('Copying OpenCV cv2.so to virtualenv')
-            cp(os.path.join(cv_install_dir, 'lib/python2.7/site-packages/*'),
-               os.path.join(robustus.env, 'lib/python2.7/site-packages'))
-            # fix rpath for cv2
-            cv2lib = os.path.join(robustus.env, 'lib/python2.7/site-packages/cv2.so')
-            fix_rpath(robustus, robustus.env, cv2lib, cv_install_dir)
+        # fix rpath for all dynamic libraries of cv2, libraries which have it already are not changed
+        all_cv_dlibs = os.path.join(cv_install_dir, 'lib')
+        if sys.platform.startswith('darwin'):
+            libs = glob.glob(os.path.join(all_cv_dlibs, '*.dylib'))
         else:
-            raise RequirementException('can\'t find OpenCV-%s in robustus cache' % requirement_specifier.version)
+            libs = glob.glob(os.path.join(all_cv_dlibs, '*.so'))
+        fix_rpaths(robustus, robustus.env, libs, cv_install_dir)
+
+        # fix rpath for cv2 copied to virtualenv
+        cv2lib = os.path.join(robustus.env, 'lib/python2.7/site-packages/cv2.so')
+        fix_rpath(robustus, robustus.env, cv2lib, cv_install_dir)
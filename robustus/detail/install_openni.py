@@ -9,7 +9,6 @@ import platform
 from utility import run_shell, cp, fix_rpath, safe_remove
 from requirement import RequirementException
 import shutil
-import subprocess
 
 
 def install(robustus, requirement_specifier, rob_file, ignore_index):
@@ -22,25 +21,17 @@ def install(robustus, requirement_specifier, rob_file, ignore_index):
 
     if not in_cache() and not ignore_index:
         cwd = os.getcwd()
-        ni_clone_dir = os.path.join(cwd, 'OpenNI2')
+        ni_clone_dir = os.path.join(robustus.build_root, 'OpenNI2')
 
         try:
-            if os.path.isdir(ni_clone_dir):
-                logging.warn('Directory for cloning OpenNI found, cloning skipped')
-            else:
-                logging.info('Cloning OpenNI')
-                retcode = run_shell(['git', 'clone', 'https://github.com/occipital/OpenNI2.git'])
-                if retcode != 0:
-                    raise RequirementException('OpenNI2 clone failed')
+            # clone left by an interrupted build may be of another version
+            safe_remove(ni_clone_dir)
+            # clone and checkout requested version
+            logging.info('Cloning OpenNI')
+            robustus.fetcher.clone('https://github.com/occipital/OpenNI2.git', ni_clone_dir,
+                                   branch=requirement_specifier.version)
             os.chdir(ni_clone_dir)
 
-            # checkout requested version
-            branch = requirement_specifier.version if requirement_specifier.version is not None else 'master'
-            if requirement_specifier.version is not None:
-                retcode = run_shell(['git', 'checkout', branch])
-                if retcode != 0:
-                    raise RequirementException('OpenNI2 checkout failed')
-
             logging.info('Building OpenNI')
             if platform.machine().startswith('arm'):
                 ver = 'Arm'
@@ -54,7 +45,9 @@ def install(robustus, requirement_specifier, rob_file, ignore_index):
                 ver = 'x64'
             else:
                 ver = 'x86'
-            retcode = run_shell(['make', 'PLATFORM=' + ver], verbose=robustus.settings['verbosity'] >= 1)
+            with robustus.jobserver.slots():
+                retcode = run_shell(['make', 'PLATFORM=' + ver], verbose=robustus.settings['verbosity'] >= 1,
+                                    env=robustus.jobserver.environ())
             if retcode != 0:
                 raise RequirementException('OpenNI2 build failed')
 
@@ -86,6 +79,6 @@ def install(robustus, requirement_specifier, rob_file, ignore_index):
         if retcode != 0:
             raise RequirementException('Faied to copy udev rules')
         # return nonzero code, but seems to work
-        subprocess.call(['sudo', 'udevadm', 'control', '--reload-rules'])
+        run_shell(['sudo', 'udevadm', 'control', '--reload-rules'], verbose=robustus.settings['verbosity'] >= 1)
     else:
         raise RequirementException('can\'t find OpenNI2-%s in robustus cache' % requirement_specifier.version)
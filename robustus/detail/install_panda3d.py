@@ -7,9 +7,8 @@ import glob
 import logging
 import os
 from requirement import RequirementException
-from utility import ln, write_file, run_shell, fix_rpath, unpack, safe_remove
+from utility import ln, write_file, run_shell, fix_rpaths, unpack, safe_remove
 import shutil
-import subprocess
 import sys
 
 
@@ -24,11 +23,13 @@ def install(robustus, requirement_specifier, rob_file, ignore_index):
 
     if not in_cache() and not ignore_index:
         cwd = os.getcwd()
-        panda3d_tgz = None
-        panda3d_archive_name = None
+        # unpack and build in scratch area, only built files are copied into the cache
+        build_dir = os.path.join(robustus.build_root, 'panda3d-%s' % requirement_specifier.version)
         try:
-            panda3d_tgz = robustus.download('panda3d', requirement_specifier.version)
-            panda3d_archive_name = unpack(panda3d_tgz)
+            safe_remove(build_dir)
+            os.makedirs(build_dir)
+            panda3d_tgz = robustus.download('panda3d', requirement_specifier.version, build_dir)
+            panda3d_archive_name = unpack(panda3d_tgz, build_dir)
 
             logging.info('Builduing panda3d')
             os.chdir(panda3d_archive_name)
@@ -64,33 +65,34 @@ def install(robustus, requirement_specifier, rob_file, ignore_index):
                                   '--use-gl',
                                   '--use-nvidiacg',
                                   '--use-pandatool',
-                                  '--use-tinydisplay',
-                                  '--threads', '4']
+                                  '--use-tinydisplay']
             if sys.platform.startswith('darwin'):
                 make_panda_options += ['--use-cocoa']
                 os.environ['CC'] = 'gcc'
                 os.environ['CXX'] = 'g++'
 
             makepanda_cmd = [robustus.python_executable, 'makepanda/makepanda.py'] + make_panda_options
-            # command takes much time and output very long, so run_shell isn't used
-            retcode = subprocess.call(makepanda_cmd)
+            verbose = robustus.settings['verbosity'] >= 1
+            with robustus.compiler_cache.build('panda3d') as env:
+                # makepanda can't use jobserver, it runs as many threads as there are free job slots
+                with robustus.jobserver.slots(robustus.jobserver.jobs) as threads:
+                    retcode = run_shell(makepanda_cmd + ['--threads', str(threads)], verbose=verbose, env=env)
             if retcode != 0:
                 raise RequirementException('panda3d build failed')
 
             # copy panda3d files to cache
             shutil.rmtree(panda_install_dir, ignore_errors=True)
             os.mkdir(panda_install_dir)
-            subprocess.call('cp -R built/lib %s' % panda_install_dir, shell=True)
-            subprocess.call('cp -R built/bin %s' % panda_install_dir, shell=True)
-            subprocess.call('cp -R built/include %s' % panda_install_dir, shell=True)
-            subprocess.call('cp -R built/direct %s' % panda_install_dir, shell=True)
-            subprocess.call('cp -R built/pandac %s' % panda_install_dir, shell=True)
-            subprocess.call('cp -R built/models %s' % panda_install_dir, shell=True)
-            subprocess.call('cp -R built/etc %s' % panda_install_dir, shell=True)
+            run_shell('cp -R built/lib %s' % panda_install_dir, shell=True, verbose=verbose)
+            run_shell('cp -R built/bin %s' % panda_install_dir, shell=True, verbose=verbose)
+            run_shell('cp -R built/include %s' % panda_install_dir, shell=True, verbose=verbose)
+            run_shell('cp -R built/direct %s' % panda_install_dir, shell=True, verbose=verbose)
+            run_shell('cp -R built/pandac %s' % panda_install_dir, shell=True, verbose=verbose)
+            run_shell('cp -R built/models %s' % panda_install_dir, shell=True, verbose=verbose)
+            run_shell('cp -R built/etc %s' % panda_install_dir, shell=True, verbose=verbose)
         finally:
-            safe_remove(panda3d_tgz)
-            safe_remove(panda3d_archive_name)
             os.chdir(cwd)
+            safe_remove(build_dir)
 
     if in_cache():
         # install panda3d to virtualenv
@@ -116,8 +118,7 @@ def install(robustus, requirement_specifier, rob_file, ignore_index):
             libs = glob.glob(os.path.join(libdir, '*.dylib'))
         else:
             libs = glob.glob(os.path.join(libdir, '*.so'))
-        for lib in libs:
-            fix_rpath(robustus, robustus.env, lib, libdir)
+        fix_rpaths(robustus, robustus.env, libs, libdir)
 
         prc_dir_setup = "import os; os.environ['PANDA_PRC_DIR'] = '%s'" % etcdir
         write_file(os.path.join(robustus.env, 'lib/python2.7/site-packages/panda3d.pth'),
@@ -29,19 +29,23 @@ def install(robustus, requirement_specifier, rob_file, ignore_index):
         os.chdir(build_dir)
 
         sphinxbase_dir = os.path.join(robustus.cache, 'sphinxbase-%s/' % requirement_specifier.version)
-        retcode = run_shell('./configure'
-                            + (' --prefix=%s' % robustus.env)
-                            + (' --with-python=%s' % os.path.join(robustus.env, 'bin/python'))
-                            + (' --with-sphinxbase=%s' % sphinxbase_dir)
-                            + (' --with-sphinxbase-build=%s' % sphinxbase_dir),
-                            shell=True,
-                            verbose=robustus.settings['verbosity'] >= 1)
-        if retcode != 0:
-            raise RequirementException('pocketsphinx configure failed')
+        with robustus.compiler_cache.build('pocketsphinx', robustus.jobserver.environ()) as env:
+            retcode = run_shell('./configure'
+                                + (' --prefix=%s' % robustus.env)
+                                + (' --with-python=%s' % os.path.join(robustus.env, 'bin/python'))
+                                + (' --with-sphinxbase=%s' % sphinxbase_dir)
+                                + (' --with-sphinxbase-build=%s' % sphinxbase_dir),
+                                shell=True,
+                                verbose=robustus.settings['verbosity'] >= 1,
+                                env=env)
+            if retcode != 0:
+                raise RequirementException('pocketsphinx configure failed')
 
-        retcode = run_shell('make clean && make', shell=True, verbose=robustus.settings['verbosity'] >= 1)
-        if retcode != 0:
-            raise RequirementException('pocketsphinx build failed')
+            with robustus.jobserver.slots():
+                retcode = run_shell('make clean && make', shell=True, verbose=robustus.settings['verbosity'] >= 1,
+                                    env=env)
+            if retcode != 0:
+                raise RequirementException('pocketsphinx build failed')
 
         logging.info('Installing pocketsphinx into virtualenv')
         retcode = run_shell('make install', shell=True, verbose=robustus.settings['verbosity'] >= 1)
@@ -9,7 +9,6 @@ import os
 from requirement import RequirementException
 from utility import unpack, run_shell, safe_remove
 import shutil
-import subprocess
 import sys
 
 
@@ -18,8 +17,9 @@ def install(robustus, requirement_specifier, rob_file, ignore_index):
         raise RequirementException('can only install pygame 1.9.1/bc1')
 
     if sys.platform.startswith('darwin'):
-        subprocess.call([robustus.pip_executable, 'install', '-U', 'pyobjc-core'])
-        subprocess.call([robustus.pip_executable, 'install', '-U', 'pyobjc'])
+        verbose = robustus.settings['verbosity'] >= 1
+        run_shell([robustus.pip_executable, 'install', '-U', 'pyobjc-core'], verbose=verbose)
+        run_shell([robustus.pip_executable, 'install', '-U', 'pyobjc'], verbose=verbose)
 
         print "#####################"
         print "You are on OSX"
@@ -28,18 +28,26 @@ def _install_ros_deps(robustus):
     if rosdep is None:
         raise RequirementException('Failed to find rosdep')
 
+    offline = robustus.settings.get('offline', False)
+
     # add ros package sources
-    if sys.platform.startswith('linux') and not os.path.isfile('/etc/apt/sources.list.d/ros-latest.list'):
-        os.system('sudo sh -c \'echo "deb http://packages.ros.org/ros/ubuntu %s main"'
-                  ' > /etc/apt/sources.list.d/ros-latest.list\'' % _get_distribution())
-        os.system('wget http://packages.ros.org/ros.key -O - | sudo apt-key add -')
-        os.system('sudo apt-get update')
+    if sys.platform.startswith('linux') and not os.path.isfile('/etc/apt/sources.list.d/ros-latest.list') \
+            and not offline:
+        verbose = robustus.settings['verbosity'] >= 1
+        run_shell('sudo sh -c \'echo "deb http://packages.ros.org/ros/ubuntu %s main"'
+                  ' > /etc/apt/sources.list.d/ros-latest.list\'' % _get_distribution(), shell=True, verbose=verbose)
+        run_shell('wget http://packages.ros.org/ros.key -O - | sudo apt-key add -', shell=True, verbose=verbose)
+        run_shell('sudo apt-get update', shell=True, verbose=verbose)
 
     # init rosdep, rosdep can already be initialized resulting in error, that's ok
     logging.info('BEGIN: Ignore \"ERROR: default sources list file already exists\"...\n')
-    os.system('sudo ' + rosdep + ' init')
+    run_shell('sudo ' + rosdep + ' init', shell=True, verbose=robustus.settings['verbosity'] >= 1)
     logging.info('END: Ignore \"ERROR: default sources list file already exists\".\n')
 
+    if offline:
+        logging.info('Offline mode, using ROS dependencies as they are')
+        return rosdep
+
     # update ros dependencies
     retcode = run_shell(rosdep + ' update',
                         shell=True,
@@ -84,7 +92,8 @@ def install(robustus, requirement_specifier, rob_file, ignore_index):
                       'rosdep==0.10.27',
                       'sip'])
 
-    ros_src_dir = os.path.join(robustus.env, 'ros-src-%s' % requirement_specifier.version)
+    # sources are checked out and built in scratch area, only install space is in the cache
+    ros_src_dir = os.path.join(robustus.build_root, 'ros-src-%s' % requirement_specifier.version)
     req_name = 'ros-install-%s' % requirement_specifier.version
     req_hash = ros_utils.hash_path(robustus.env)
     ros_install_dir = os.path.join(robustus.cache, '%s-%s' % (req_name, req_hash))
@@ -125,9 +134,10 @@ def install(robustus, requirement_specifier, rob_file, ignore_index):
                     raise RequirementException('Failed to generate rosinstall file')
     
                 wstool = os.path.join(robustus.env, 'bin/wstool')
-                retcode = run_shell(wstool + ' init -j2 src %s-%s-wet.rosinstall' % (dist, ver),
-                                    shell=True,
-                                    verbose=robustus.settings['verbosity'] >= 1)
+                with robustus.jobserver.slots(robustus.jobserver.jobs) as jobs:
+                    retcode = run_shell(wstool + ' init -j%d src %s-%s-wet.rosinstall' % (jobs, dist, ver),
+                                        shell=True,
+                                        verbose=robustus.settings['verbosity'] >= 1)
                 if retcode != 0:
                     raise RequirementException('Failed to build ROS')
     
@@ -150,11 +160,15 @@ def install(robustus, requirement_specifier, rob_file, ignore_index):
                 # create catkin workspace
                 py_activate_file = os.path.join(robustus.env, 'bin', 'activate')
                 catkin_make_isolated = os.path.join(ros_src_dir, 'src/catkin/bin/catkin_make_isolated')
-                retcode = run_shell('. ' + py_activate_file + ' && ' +
-                                    catkin_make_isolated +
-                                    ' --install-space %s --install' % ros_install_dir,
-                                    shell=True,
-                                    verbose=robustus.settings['verbosity'] >= 1)
+                # catkin_make_isolated passes make flags of jobserver to make
+                with robustus.compiler_cache.build('ROS', robustus.jobserver.environ()) as env, \
+                        robustus.jobserver.slots():
+                    retcode = run_shell('. ' + py_activate_file + ' && ' +
+                                        catkin_make_isolated +
+                                        ' --install-space %s --install' % ros_install_dir,
+                                        shell=True,
+                                        verbose=robustus.settings['verbosity'] >= 1,
+                                        env=env)
 
                 if retcode != 0:
                     raise RequirementException('Failed to create catkin workspace for ROS')
@@ -23,7 +23,7 @@ def _make_overlay_folder(robustus, req_hash):
     return overlay_folder
 
 
-def _get_source(package):
+def _get_source(fetcher, package):
     """Download source code for package."""
     logging.info('Obtaining ROS package %s' % package)
     # Break the git spec into components
@@ -48,15 +48,8 @@ def _get_source(package):
         if arrow_pos > 0:
             branch, cd_path = branch[:arrow_pos], branch[arrow_pos+2:]
 
-    ret_code = run_shell('git clone "%s"' % origin, shell=True)
-    if ret_code != 0:
-        raise Exception('git clone failed')
-
     clone_folder = os.path.splitext(os.path.basename(origin))[0]
-    if branch is not None:
-        ret_code = run_shell('cd "%s" && git checkout %s' % (clone_folder, branch), shell=True)
-        if ret_code != 0:
-            raise Exception('git checkout failed')
+    fetcher.clone(origin, clone_folder, branch=branch, paths=[cd_path] if cd_path is not None else None)
 
     if cd_path is not None:
         logging.info('Extracting %s package from %s repo' % (cd_path, origin))
@@ -65,10 +58,10 @@ def _get_source(package):
         shutil.rmtree(clone_folder)
 
 
-def _get_sources(packages):
+def _get_sources(fetcher, packages):
     os.chdir('src')
     for p in packages:
-        _get_source(p)
+        _get_source(fetcher, p)
     os.chdir('..')
 
 
@@ -109,9 +102,13 @@ def _ros_dep_init(env_source, robustus):
 
     # init rosdep, rosdep can already be initialized resulting in error, that's ok
     logging.info('BEGIN: Ignore \"ERROR: default sources list file already exists\"...\n')
-    os.system('sudo rosdep init')  # NOTE: This is called by the "bstem.ros" Debian control scripts.
+    run_shell('sudo rosdep init', shell=True, verbose=robustus.settings['verbosity'] >= 1)  # NOTE: This is called by the "bstem.ros" Debian control scripts.
     logging.info('END: Ignore \"ERROR: default sources list file already exists\".\n')
 
+    if robustus.settings.get('offline', False):
+        logging.info('Offline mode, using ROS dependencies and apt package lists as they are')
+        return
+
     # update ros dependencies  # NOTE: This cannot be called by the "bstem.ros" Debian control scripts.
     retcode = run_shell('rosdep update',
                         shell=True,
@@ -119,7 +116,8 @@ def _ros_dep_init(env_source, robustus):
     if retcode != 0:
         raise RequirementException('Failed to update ROS dependencies')
 
-    os.system('sudo apt-get update')  # NOTE: This cannot be called by the "bstem.ros" Debian control scripts.
+    # NOTE: This cannot be called by the "bstem.ros" Debian control scripts.
+    run_shell('sudo apt-get update', shell=True, verbose=robustus.settings['verbosity'] >= 1)
 
 
 def _ros_dep(env_source, robustus):
@@ -192,7 +190,7 @@ def install(robustus, requirement_specifier, rob_file, ignore_index):
                                                      overlay_install_folder))
 
                 os.mkdir(os.path.join(overlay_src_folder, 'src'))
-                _get_sources(packages)
+                _get_sources(robustus.fetcher, packages)
                 _ros_dep(env_source, robustus)
 
                 opencv_cmake_dir = _opencv_cmake_path(robustus)
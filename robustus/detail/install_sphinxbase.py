@@ -34,17 +34,21 @@ def install(robustus, requirement_specifier, rob_file, ignore_index):
         if not os.path.isfile(python_config):
             ln('/usr/bin/python-config', python_config)
 
-        retcode = run_shell('./configure'
-                            + (' --prefix=%s' % robustus.env)
-                            + (' --with-python=%s' % os.path.join(robustus.env, 'bin/python')),
-                            shell=True,
-                            verbose=robustus.settings['verbosity'] >= 1)
-        if retcode != 0:
-            raise RequirementException('sphinxbase configure failed')
+        with robustus.compiler_cache.build('sphinxbase', robustus.jobserver.environ()) as env:
+            retcode = run_shell('./configure'
+                                + (' --prefix=%s' % robustus.env)
+                                + (' --with-python=%s' % os.path.join(robustus.env, 'bin/python')),
+                                shell=True,
+                                verbose=robustus.settings['verbosity'] >= 1,
+                                env=env)
+            if retcode != 0:
+                raise RequirementException('sphinxbase configure failed')
 
-        retcode = run_shell('make clean && make', shell=True, verbose=robustus.settings['verbosity'] >= 1)
-        if retcode != 0:
-            raise RequirementException('sphinxbase build failed')
+            with robustus.jobserver.slots():
+                retcode = run_shell('make clean && make', shell=True, verbose=robustus.settings['verbosity'] >= 1,
+                                    env=env)
+            if retcode != 0:
+                raise RequirementException('sphinxbase build failed')
 
         logging.info('Installing sphinxbase into virtualenv')
         retcode = run_shell('make install', shell=True, verbose=robustus.settings['verbosity'] >= 1)
@@ -0,0 +1,135 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+"""
+GNU make compatible jobserver shared by all builds robustus runs.
+
+Total number of parallel jobs (--jobs) is represented by tokens in a pipe. Every build command
+takes a slot before it starts; make started by the command (directly or by cmake, catkin, configure
+scripts, ...) finds the pipe in MAKEFLAGS and takes a token for every additional job, so concurrent
+builds together never run more jobs than the budget. Tools which can't use the jobserver (ninja,
+makepanda, wstool) get as many slots as are free and are told the number with their -j option.
+
+If robustus itself is run by make with a jobserver and --jobs isn't given, that jobserver is joined.
+"""
+
+import contextlib
+import errno
+import multiprocessing
+import os
+import re
+import select
+import threading
+
+
+TOKEN = '+'
+
+
+def default_jobs():
+    """
+    :return: number of parallel jobs used if --jobs isn't given
+    """
+    # on bStem we can build only in single thread, but bStem has 2 cores, thus
+    # we are using this weird formula to determine number of threads for make
+    return max(multiprocessing.cpu_count() / 2, 1)
+
+
+def _fd_valid(fd):
+    try:
+        os.fstat(fd)
+        return True
+    except OSError:
+        return False
+
+
+def inherited_jobserver(makeflags):
+    """
+    Find jobserver of parent make in MAKEFLAGS.
+    :return: tuple (jobs or None if unknown, read fd, write fd) or None
+    >>> inherited_jobserver(' -j4 --jobserver-auth=3,4')
+    (4, 3, 4)
+    >>> inherited_jobserver('--jobserver-fds=3,4 -j')
+    (None, 3, 4)
+    >>> inherited_jobserver('-k') is None
+    True
+    """
+    match = re.search(r'--jobserver-(?:auth|fds)=(\d+),(\d+)', makeflags)
+    if match is None:
+        return None
+    jobs = re.search(r'(?:^|\s)-j(\d+)', makeflags)
+    return int(jobs.group(1)) if jobs is not None else None, int(match.group(1)), int(match.group(2))
+
+
+class JobServer(object):
+    def __init__(self, jobs=None):
+        """
+        :param jobs: total number of parallel jobs, if None jobserver of parent make is joined if
+        robustus runs under one, otherwise default_jobs() is used
+        """
+        inherited = None
+        if jobs is None:
+            inherited = inherited_jobserver(os.environ.get('MAKEFLAGS', ''))
+            if inherited is not None and not (_fd_valid(inherited[1]) and _fd_valid(inherited[2])):
+                # make didn't pass pipe to robustus, e.g. because the rule wasn't marked with +
+                inherited = None
+        if inherited is not None:
+            self.jobs = inherited[0] or default_jobs()
+            self._read_fd, self._write_fd = inherited[1:]
+        else:
+            self.jobs = max(jobs or default_jobs(), 1)
+            self._read_fd, self._write_fd = os.pipe()
+            # robustus holds one implicit slot like every make does, the rest are tokens
+            os.write(self._write_fd, TOKEN * (self.jobs - 1))
+        self._lock = threading.Lock()
+        self._implicit_free = True
+
+    def environ(self, env=None):
+        """
+        :param env: environment of build, os.environ by default
+        :return: copy of env making make use the jobserver
+        """
+        env = dict(os.environ if env is None else env)
+        fds = '%d,%d' % (self._read_fd, self._write_fd)
+        # make before 4.2 knows --jobserver-fds, later ones --jobserver-auth, unknown options are ignored
+        env['MAKEFLAGS'] = ' -j --jobserver-fds=%s --jobserver-auth=%s' % (fds, fds)
+        return env
+
+    def _read_token(self, block):
+        while True:
+            if not block and len(select.select([self._read_fd], [], [], 0)[0]) == 0:
+                return None
+            try:
+                # token may be taken by make between select and read, then read waits for the next one
+                return os.read(self._read_fd, 1)
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+
+    @contextlib.contextmanager
+    def slots(self, wanted=1):
+        """
+        Take job slots for the time of a build command, waits until at least one is free.
+        :param wanted: number of slots command can use
+        :return: number of slots taken, between 1 and wanted
+        """
+        with self._lock:
+            implicit = self._implicit_free
+            self._implicit_free = False
+        tokens = []
+        try:
+            if not implicit:
+                tokens.append(self._read_token(block=True))
+            while len(tokens) + int(implicit) < wanted:
+                token = self._read_token(block=False)
+                if token is None:
+                    break
+                tokens.append(token)
+            yield len(tokens) + int(implicit)
+        finally:
+            if len(tokens) > 0:
+                os.write(self._write_fd, ''.join(tokens))
+            if implicit:
+                with self._lock:
+                    self._implicit_free = True
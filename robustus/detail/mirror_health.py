@@ -0,0 +1,196 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+"""
+Health tracking of remote caches (find_links).
+
+Latency and errors of every mirror are persisted between runs. Mirrors are ordered by
+observed health and a mirror that failed several times in a row is skipped (circuit is
+open) until cooldown expires, then it gets a single trial again.
+"""
+
+import errno
+import logging
+import Queue
+import socket
+import threading
+import time
+import urllib2
+from utility import read_json, write_json
+
+
+class MirrorsFailed(urllib2.URLError):
+    """
+    None of raced mirrors provided requested file.
+    """
+    def __init__(self, errors):
+        """
+        :param errors: list of (mirror, url, exception)
+        """
+        urllib2.URLError.__init__(self, '; '.join('%s: %s' % (url, e) for _, url, e in errors))
+        self.errors = errors
+
+
+def is_missing_error(url, error):
+    """
+    :return: True if error means that the file doesn't exist rather than mirror failed
+    """
+    if isinstance(error, urllib2.HTTPError):
+        # S3 answers 403 for missing files in non-listable buckets
+        return error.code in (403, 404, 410)
+    if url.startswith('file:') and isinstance(error, urllib2.URLError):
+        return getattr(error.reason, 'errno', None) == errno.ENOENT
+    return False
+
+
+class MirrorHealth(object):
+    # number of consecutive failures after which mirror is skipped
+    failure_threshold = 3
+    # seconds after which skipped mirror gets another trial
+    cooldown = 15 * 60
+    # weight of the last observation in exponentially weighted average of latency
+    latency_weight = 0.3
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.stats = read_json(filename, {})
+        self._lock = threading.Lock()
+
+    def _mirror_stats(self, mirror):
+        return self.stats.setdefault(mirror, {'latency': None,
+                                              'successes': 0,
+                                              'failures': 0,
+                                              'consecutive_failures': 0,
+                                              'last_failure': 0})
+
+    def record_success(self, mirror, latency):
+        with self._lock:
+            s = self._mirror_stats(mirror)
+            if s['latency'] is None:
+                s['latency'] = latency
+            else:
+                s['latency'] += self.latency_weight * (latency - s['latency'])
+            s['successes'] += 1
+            s['consecutive_failures'] = 0
+            self._save()
+
+    def record_failure(self, mirror):
+        with self._lock:
+            s = self._mirror_stats(mirror)
+            s['failures'] += 1
+            s['consecutive_failures'] += 1
+            s['last_failure'] = time.time()
+            if s['consecutive_failures'] == self.failure_threshold:
+                logging.warn('Mirror %s failed %d times in a row, skipping it for %d minutes'
+                             % (mirror, self.failure_threshold, self.cooldown / 60))
+            self._save()
+
+    def is_tripped(self, mirror):
+        """
+        :return: True if mirror failed too many times recently and should be skipped
+        """
+        s = self.stats.get(mirror)
+        if s is None or s['consecutive_failures'] < self.failure_threshold:
+            return False
+        return time.time() - s['last_failure'] < self.cooldown
+
+    def order(self, mirrors):
+        """
+        Order mirrors by observed health, skipping tripped ones. If all mirrors are tripped,
+        they are returned in original order, so that total outage doesn't block anything.
+        Mirrors never used before keep their position relatively to each other and go first.
+        """
+        def key(indexed_mirror):
+            position, mirror = indexed_mirror
+            s = self.stats.get(mirror)
+            if s is None:
+                return (0, 0., position)
+            return (min(s['consecutive_failures'], self.failure_threshold), s['latency'] or 0., position)
+
+        healthy = [m for m in mirrors if not self.is_tripped(m)]
+        if len(healthy) == 0:
+            return list(mirrors)
+        for m in mirrors:
+            if m not in healthy:
+                logging.debug('Skipping mirror %s because of repeated failures' % m)
+        return [m for _, m in sorted(enumerate(healthy), key=key)]
+
+    def open_url(self, mirror, url, timeout=None):
+        """
+        Open url located on mirror, recording latency or failure of the mirror.
+        Missing files (HTTP 4xx or local files) don't count as mirror failures.
+        :param url: url string or urllib2.Request
+        :return: response as returned by urllib2.urlopen
+        """
+        full_url = url.get_full_url() if isinstance(url, urllib2.Request) else url
+        start = time.time()
+        try:
+            response = urllib2.urlopen(url, timeout=timeout)
+        except urllib2.HTTPError as e:
+            if e.code < 500:
+                self.record_success(mirror, time.time() - start)
+            else:
+                self.record_failure(mirror)
+            raise
+        except (urllib2.URLError, socket.error):
+            if full_url.startswith('file:'):
+                self.record_success(mirror, time.time() - start)
+            else:
+                self.record_failure(mirror)
+            raise
+        self.record_success(mirror, time.time() - start)
+        return response
+
+    def race(self, candidates, timeout=None):
+        """
+        Open urls on several mirrors concurrently and return the first one that responds.
+        Responses of the slower mirrors are closed.
+        :param candidates: list of (mirror, url)
+        :return: (mirror, url, response)
+        :raise: MirrorsFailed if none of mirrors responds
+        """
+        if len(candidates) == 1:
+            mirror, url = candidates[0]
+            try:
+                return mirror, url, self.open_url(mirror, url, timeout)
+            except (urllib2.URLError, socket.error) as e:
+                raise MirrorsFailed([(mirror, url, e)])
+
+        results = Queue.Queue()
+
+        def open_candidate(mirror, url):
+            try:
+                results.put((mirror, url, self.open_url(mirror, url, timeout), None))
+            except Exception as e:
+                results.put((mirror, url, None, e))
+
+        for mirror, url in candidates:
+            t = threading.Thread(target=open_candidate, args=(mirror, url))
+            t.daemon = True
+            t.start()
+
+        errors = []
+        for i in range(len(candidates)):
+            mirror, url, response, e = results.get()
+            if response is not None:
+                logging.info('Mirror %s won the race for %s' % (mirror, url))
+
+                def close_losers(count):
+                    for j in range(count):
+                        loser = results.get()[2]
+                        if loser is not None:
+                            loser.close()
+                closer = threading.Thread(target=close_losers, args=(len(candidates) - i - 1,))
+                closer.daemon = True
+                closer.start()
+                return mirror, url, response
+            errors.append((mirror, url, e))
+        raise MirrorsFailed(errors)
+
+    def _save(self):
+        try:
+            write_json(self.filename, self.stats)
+        except (IOError, OSError) as e:
+            logging.info('Failed to save mirror health to %s: %s' % (self.filename, e))
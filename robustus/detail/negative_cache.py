@@ -0,0 +1,77 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+"""
+Persistent cache of remote lookups known to fail.
+
+Most packages never have compiled archives or remote wheels, so robustus remembers
+"not found" answers of every find_link for ttl seconds and doesn't ask again.
+"""
+
+import fnmatch
+import logging
+import time
+from utility import read_json, write_json
+
+
+class NegativeCache(object):
+    def __init__(self, filename, ttl=24 * 60 * 60):
+        """
+        :param filename: file to persist cache in
+        :param ttl: seconds to remember failed lookup, 0 disables cache
+        """
+        self.filename = filename
+        self.ttl = ttl
+        self.entries = read_json(filename, {})
+
+    @staticmethod
+    def _key(location, artifact):
+        return '%s %s' % (location, artifact)
+
+    def is_missing(self, location, artifact):
+        """
+        :return: True if artifact was recently looked up in location and not found
+        """
+        timestamp = self.entries.get(self._key(location, artifact))
+        if timestamp is None:
+            return False
+        return time.time() - timestamp < self.ttl
+
+    def add(self, location, artifact):
+        """
+        Remember that artifact is missing in location.
+        """
+        if self.ttl <= 0:
+            return
+        self.entries[self._key(location, artifact)] = time.time()
+        self._save()
+
+    def invalidate(self, patterns=None):
+        """
+        Forget failed lookups of artifacts matching any of shell-style patterns (all by default).
+        Artifact kind prefix (e.g. 'wheel:') may be omitted in patterns. Expired entries are removed as well.
+        :return: number of forgotten lookups
+        """
+        def matches(artifact):
+            names = [artifact, artifact.split(':', 1)[-1]]
+            return any(fnmatch.fnmatch(n, p) for n in names for p in patterns)
+
+        removed = 0
+        now = time.time()
+        for key in self.entries.keys():
+            artifact = key.split(' ', 1)[1]
+            expired = now - self.entries[key] >= self.ttl
+            if expired or patterns is None or matches(artifact):
+                del self.entries[key]
+                if not expired:
+                    removed += 1
+        self._save()
+        return removed
+
+    def _save(self):
+        try:
+            write_json(self.filename, self.entries)
+        except (IOError, OSError) as e:
+            logging.info('Failed to save negative lookup cache to %s: %s' % (self.filename, e))
@@ -0,0 +1,231 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+"""
+Persistent probe worker running in python interpreter of environment.
+
+Worker answers batches of queries (imports, python statements, file existence, installed
+distributions) sent over a pipe, so that checking many modules costs one interpreter start.
+Every batch is one line of json list of [kind, argument], answer is one line of json list of
+[error, value], error being None if query succeeded.
+"""
+
+import atexit
+import json
+import os
+import pipes
+import subprocess
+import threading
+
+
+_WORKER = r'''
+import json, os, sys
+
+# protocol goes through private copy of stdout, output of imported modules goes to stderr
+protocol = os.fdopen(os.dup(1), 'w')
+os.dup2(2, 1)
+site_dirs = [p for p in sys.path if p.endswith('site-packages')]
+worker_modules = set(sys.modules)
+
+
+def pth_files():
+    # path of every .pth file in site directories -> its mtime
+    files = {}
+    for d in site_dirs:
+        try:
+            names = os.listdir(d)
+        except OSError:
+            continue
+        for name in names:
+            if name.endswith('.pth'):
+                files[os.path.join(d, name)] = os.path.getmtime(os.path.join(d, name))
+    return files
+
+
+# .pth files were processed at interpreter start
+processed_pth_files = pth_files()
+
+
+def refresh():
+    # pick up packages installed since worker started, only new or changed .pth files are processed,
+    # so that their import lines don't run on every batch
+    import site
+    known_paths = site._init_pathinfo()
+    for path, mtime in sorted(pth_files().items()):
+        if processed_pth_files.get(path) != mtime:
+            processed_pth_files[path] = mtime
+            site.addpackage(os.path.dirname(path), os.path.basename(path), known_paths)
+    sys.path_importer_cache.clear()
+
+
+def evict(name):
+    # package may have been upgraded or removed since it was imported, or imported only partially
+    top_level = name.split('.')[0]
+    for module in list(sys.modules):
+        if (module == top_level or module.startswith(top_level + '.')) and module not in worker_modules:
+            del sys.modules[module]
+
+
+def distribution(name):
+    import pkg_resources
+    pkg_resources.working_set = pkg_resources.WorkingSet()
+    dist = pkg_resources.get_distribution(name)
+    top_level = []
+    if dist.has_metadata('top_level.txt'):
+        top_level = [m for m in dist.get_metadata_lines('top_level.txt') if len(m.strip()) > 0]
+    return {'name': dist.project_name, 'version': dist.version, 'top_level': top_level}
+
+
+def answer(kind, arg):
+    if kind == 'import':
+        evict(arg)
+        __import__(arg)
+    elif kind == 'exec':
+        exec arg in {}
+    elif kind == 'file':
+        if not os.path.exists(arg):
+            raise IOError('No such file: %s' % arg)
+    elif kind == 'distribution':
+        return distribution(arg)
+    else:
+        raise ValueError('unknown query %s' % kind)
+
+
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    refresh()
+    results = []
+    for kind, arg in json.loads(line):
+        try:
+            results.append([None, answer(kind, arg)])
+        except BaseException as e:
+            results.append(['%s: %s' % (type(e).__name__, e), None])
+    protocol.write(json.dumps(results) + '\n')
+    protocol.flush()
+'''
+
+
+class ProbeError(RuntimeError):
+    pass
+
+
+def env_python_executable(env):
+    """
+    :return: path to python interpreter of environment
+    """
+    python_executable = os.path.join(env, 'bin/python')
+    if not os.path.isfile(python_executable):
+        python_executable = os.path.join(env, 'bin/python27')
+    if not os.path.isfile(python_executable):
+        raise RuntimeError('can\'t find python executable in %s' % env)
+    return python_executable
+
+
+class PythonProbe(object):
+    def __init__(self, env, shell_script=None):
+        """
+        :param env: path to python environment
+        :param shell_script: shell command to run before starting interpreter, e.g. sourcing setup script
+        """
+        self.env = env
+        self.shell_script = shell_script
+        self._process = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _start(self):
+        python_executable = env_python_executable(self.env)
+        if self.shell_script is None:
+            command = [python_executable, '-c', _WORKER]
+        else:
+            command = '%s && exec "%s" -c %s' % (self.shell_script, python_executable, pipes.quote(_WORKER))
+        with open(os.devnull, 'w') as devnull:
+            try:
+                self._process = subprocess.Popen(command, shell=self.shell_script is not None,
+                                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                                 stderr=devnull, close_fds=True)
+            except OSError as e:
+                raise ProbeError('can\'t start python probe in %s: %s' % (self.env, e))
+
+    def _query(self, queries):
+        if self._process is None or self._process.poll() is not None:
+            self._start()
+        try:
+            self._process.stdin.write(json.dumps(queries) + '\n')
+            self._process.stdin.flush()
+            line = self._process.stdout.readline()
+        except IOError:
+            line = ''
+        if not line:
+            self._close()
+            raise ProbeError('python probe in %s exited' % self.env)
+        return [tuple(result) for result in json.loads(line)]
+
+    def query(self, queries):
+        """
+        :param queries: list of (kind, argument), kind is 'import' (module name), 'exec' (python
+        statement), 'file' (path) or 'distribution' (name of installed distribution)
+        :return: list of (error, value), error is None if query succeeded, value of distribution
+        query is dict with name, version and top_level modules
+        """
+        with self._lock:
+            try:
+                return self._query(queries)
+            except ProbeError:
+                if len(queries) == 1:
+                    return [('python probe crashed', None)]
+            # find out which query crashed interpreter
+            return [self._query_single(q) for q in queries]
+
+    def _query_single(self, query):
+        try:
+            return self._query([query])[0]
+        except ProbeError:
+            return ('python probe crashed', None)
+
+    def _close(self):
+        if self._process is not None:
+            try:
+                self._process.stdin.close()
+            except IOError:
+                pass
+            self._process.wait()
+            self._process.stdout.close()
+            self._process = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+# probes of environments shared by the whole robustus run
+_probes = {}
+_probes_lock = threading.Lock()
+
+
+def probe(env):
+    """
+    :return: PythonProbe of environment, started once per robustus run
+    """
+    env = os.path.abspath(env)
+    with _probes_lock:
+        if env not in _probes:
+            _probes[env] = PythonProbe(env)
+        return _probes[env]
+
+
+@atexit.register
+def close_probes():
+    with _probes_lock:
+        for p in _probes.values():
+            p.close()
+        _probes.clear()
@@ -0,0 +1,301 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+"""
+Local caching proxy of package index served to pip during robustus install.
+
+Every pip subprocess robustus runs points at the proxy. Simple index pages of the upstream
+index and listings of remote wheel caches are served with file links rewritten to the proxy,
+files are served from the wheelhouse and downloaded into it on a miss. This way each file
+crosses the network at most once per machine, regardless of how many pip calls, retries and
+environments sharing the wheelhouse need it.
+"""
+
+import BaseHTTPServer
+import cgi
+import hashlib
+import logging
+import os
+import posixpath
+import re
+import shutil
+import socket
+import SocketServer
+import threading
+import urllib
+import urllib2
+import urlparse
+from remote_index import artifact_info, normalize_name
+from utility import download, DownloadError, safe_remove, write_file
+
+
+DEFAULT_INDEX_URL = 'https://pypi.python.org/simple/'
+FILE_EXTENSIONS = ('.tar.gz', '.tgz', '.tar.bz2', '.zip', '.whl', '.egg')
+
+_href_re = re.compile(r'''href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^>\s]+))''', re.IGNORECASE)
+
+
+def rewrite_links(html, page_url, file_url):
+    """
+    Rewrite links to package files in index page to the proxy, other links are made absolute.
+    :param html: index page
+    :param page_url: url page was fetched from, used to resolve relative links
+    :param file_url: function (filename, absolute url, sha256 or None) -> proxy url of the file
+    :return: (rewritten html, list of linked filenames)
+    >>> html, files = rewrite_links('<a href="../../packages/source/p/pep8/pep8-1.4.6.tar.gz#md5=abc">'
+    ...                             '<a href="http://pep8.org">', 'https://pypi/simple/pep8/',
+    ...                             lambda f, u, d: '/files/' + f)
+    >>> html
+    '<a href="/files/pep8-1.4.6.tar.gz#md5=abc"><a href="http://pep8.org">'
+    >>> files
+    ['pep8-1.4.6.tar.gz']
+    """
+    filenames = []
+
+    def rewrite(mo):
+        href = (mo.group(1) or mo.group(2) or mo.group(3) or '').replace('&amp;', '&')
+        absolute_url = urlparse.urljoin(page_url, href)
+        url, _, fragment = absolute_url.partition('#')
+        filename = posixpath.basename(urlparse.urlsplit(url).path)
+        if not filename.lower().endswith(FILE_EXTENSIONS):
+            return 'href="%s"' % cgi.escape(absolute_url, quote=True)
+        filenames.append(filename)
+        sha256 = fragment[len('sha256='):] if fragment.startswith('sha256=') else None
+        proxied = file_url(filename, url, sha256)
+        return 'href="%s"' % cgi.escape(proxied + ('#' + fragment if fragment else ''), quote=True)
+
+    return _href_re.sub(rewrite, html), filenames
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logging.debug('pypi proxy: ' + format % args)
+
+    def do_GET(self):
+        proxy = self.server.proxy
+        path, _, query = self.path.partition('?')
+        params = dict(urlparse.parse_qsl(query))
+        parts = [urllib.unquote(p) for p in path.split('/') if p]
+        try:
+            if len(parts) == 2 and parts[0] == 'simple':
+                self._send_page(proxy.simple_page(parts[1]))
+            elif len(parts) == 2 and parts[0] == 'links':
+                self._send_page(proxy.links_page(parts[1]))
+            elif len(parts) == 2 and parts[0] == 'files':
+                self._send_file(proxy.file_path(parts[1], params.get('src'), params.get('sha256')))
+            else:
+                self._send_page(None)
+        except socket.error:
+            # pip went away
+            pass
+
+    def _send_page(self, html):
+        if html is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(html)))
+        self.end_headers()
+        self.wfile.write(html)
+
+    def _send_file(self, path):
+        if path is None:
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile)
+
+
+class PypiProxy(object):
+    def __init__(self, wheelhouse, pages_dir, index_url=DEFAULT_INDEX_URL, governor=None,
+                 catalog=None, timeout=60, verbose=False):
+        """
+        :param wheelhouse: directory to serve files from and store downloaded files in
+        :param pages_dir: directory to keep last fetched index pages in, used when upstream is unreachable
+        :param index_url: upstream simple index
+        :param governor: Governor limiting downloads made by the proxy
+        :param catalog: CacheCatalog to record digests of downloaded files in
+        :param timeout: seconds to wait for upstream to respond
+        """
+        self.wheelhouse = os.path.abspath(wheelhouse)
+        self.pages_dir = pages_dir
+        self.upstream_index_url = index_url.rstrip('/') + '/'
+        self.governor = governor
+        self.catalog = catalog
+        self.timeout = timeout
+        self.verbose = verbose
+        self._links = {}
+        self._pages = {}
+        self._file_locks = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+    @property
+    def index_url(self):
+        """
+        Simple index url to give to pip.
+        """
+        return self.url + '/simple/'
+
+    def find_links_url(self, page_url, digests=None):
+        """
+        :param page_url: listing of package files, e.g. remote wheels cache index.html
+        :param digests: dict filename -> sha256 files listed must have, e.g. taken from remote index
+        :return: url of the listing served by proxy to give to pip as --find-links
+        """
+        key = hashlib.sha1(page_url).hexdigest()
+        self._links[key] = (page_url, digests or {})
+        return '%s/links/%s/' % (self.url, key)
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.proxy = self
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        logging.info('Serving package index proxy at %s (upstream %s)' % (self.index_url, self.upstream_index_url))
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _file_url(self, filename, url, sha256):
+        params = {'src': url}
+        if sha256 is not None:
+            params['sha256'] = sha256
+        return '/files/%s?%s' % (urllib.quote(filename), urllib.urlencode(params))
+
+    def _fetch_page(self, url):
+        """
+        Fetch page once per run, keep copy on disk to use if upstream gets unreachable.
+        :return: (page url after redirects, html) or None if page doesn't exist
+        """
+        with self._lock:
+            if url in self._pages:
+                return self._pages[url]
+        saved_page = os.path.join(self.pages_dir, hashlib.sha1(url).hexdigest() + '.html')
+        try:
+            response = urllib2.urlopen(url, timeout=self.timeout)
+            page = (response.geturl(), response.read())
+            if not os.path.isdir(self.pages_dir):
+                os.makedirs(self.pages_dir)
+            write_file(saved_page, 'w', page[0] + '\n' + page[1])
+        except urllib2.HTTPError as e:
+            if e.code == 404:
+                page = None
+                safe_remove(saved_page)
+            else:
+                # server errors, forbidden pages of captive portals etc. don't mean page is gone
+                page = self._saved_page(saved_page, url, e)
+        except (urllib2.URLError, socket.error) as e:
+            page = self._saved_page(saved_page, url, e)
+        with self._lock:
+            self._pages[url] = page
+        return page
+
+    def _saved_page(self, saved_page, url, error):
+        """
+        :return: (page url, html) fetched earlier or None if there is no copy
+        """
+        if not os.path.isfile(saved_page):
+            logging.warn('Failed to fetch %s: %s' % (url, error))
+            return None
+        logging.warn('Failed to fetch %s: %s, using copy fetched earlier' % (url, error))
+        page_url, _, html = open(saved_page).read().partition('\n')
+        return page_url, html
+
+    def _local_files(self, name):
+        files = []
+        for filename in sorted(os.listdir(self.wheelhouse)):
+            info = artifact_info(filename)
+            if info is not None and info[0] in ('wheel', 'source') and normalize_name(info[1]) == name:
+                files.append(filename)
+        return files
+
+    def simple_page(self, name):
+        """
+        Simple index page of a project: upstream files plus files in the wheelhouse.
+        """
+        name = normalize_name(name)
+        local_files = self._local_files(name)
+        page = self._fetch_page(self.upstream_index_url + name + '/')
+        if page is None and len(local_files) == 0:
+            return None
+
+        html, upstream_files = rewrite_links(page[1], page[0], self._file_url) if page is not None else ('', [])
+        links = ['<a href="/files/%s">%s</a><br/>' % (urllib.quote(f), cgi.escape(f))
+                 for f in local_files if f not in upstream_files]
+        return ('<html><head><title>Links for %s</title></head><body>\n' % name +
+                '\n'.join(links) + '\n' + html + '\n</body></html>\n')
+
+    def links_page(self, key):
+        """
+        Listing of remote files registered with find_links_url.
+        """
+        if key not in self._links:
+            return None
+        page_url, digests = self._links[key]
+        page = self._fetch_page(page_url)
+        if page is None:
+            return None
+
+        def file_url(filename, url, sha256):
+            return self._file_url(filename, url, sha256 if sha256 is not None else digests.get(filename))
+        return rewrite_links(page[1], page[0], file_url)[0]
+
+    def file_path(self, filename, url=None, sha256=None):
+        """
+        :return: path to file in the wheelhouse, downloaded from url if necessary, or None if not available
+        """
+        filename = os.path.basename(filename)
+        path = os.path.join(self.wheelhouse, filename)
+        with self._lock:
+            lock = self._file_locks.setdefault(filename, threading.Lock())
+        with lock:
+            if os.path.isfile(path) and (self.catalog is None or self.catalog.is_intact(path)):
+                return path
+            if url is None:
+                return None
+            logging.info('Package index proxy fetching %s' % url)
+            try:
+                if self.governor is not None:
+                    with self.governor.slot():
+                        _, digest = download(url, path, verbose=self.verbose,
+                                             response=urllib2.urlopen(url, timeout=self.timeout),
+                                             expected_digest=sha256, return_digest=True,
+                                             throttle=self.governor.throttle(url))
+                else:
+                    _, digest = download(url, path, verbose=self.verbose,
+                                         response=urllib2.urlopen(url, timeout=self.timeout),
+                                         expected_digest=sha256, return_digest=True)
+            except (urllib2.URLError, socket.error, DownloadError) as e:
+                logging.warn('Failed to download %s: %s' % (url, e))
+                return None
+            if self.catalog is not None:
+                self.catalog.record(path, digest, url)
+            return path
@@ -0,0 +1,583 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+"""
+Declarative recipes of native packages.
+
+Install script declares where sources come from, how they are built, which files the build
+has to produce and how the package is installed into environment, e.g.:
+
+    recipe = Recipe('bullet',
+                    source=Archive(),
+                    build=CMake(['-DCMAKE_CXX_FLAGS=-fPIC']),
+                    outputs=['lib/libBulletCollision.a'],
+                    runtime=[CopyTree('lib/bullet-%(version)s')])
+
+    def install(robustus, requirement_specifier, rob_file, ignore_index):
+        recipe.install(robustus, requirement_specifier, ignore_index)
+
+The rest is done by the recipe: package is built once into <cache>/<name>-<version>, compiled
+archive from remote cache is used instead of building if available, builds run in parallel (sharing
+--jobs budget with other builds through robustus jobserver) and install into staging directory
+first, so that failed build never leaves half installed package in the cache. Downloaded archives
+are removed afterwards.
+
+Every build runs in its own directory <build root>/<name>-<version>-<key> in scratch area (tmpfs or
+<env>/.robustus_builds, see scratch.py), key depends on source, build system and package location.
+Only installed package is written into the cache. Directory is kept after the build (failed or not), so that
+a retry continues where the build stopped and a build with slightly changed options recompiles only
+what the change affects. The least recently used build directories are removed when there are more
+than --keep-builds of them. CMake builds use Ninja generator if it's installed. Compilers run
+through the compiler cache of robustus (see compiler_cache.py).
+
+Strings in recipes (urls, options, paths) may refer to %(name)s, %(version)s, %(prefix)s (package
+directory in the cache), %(env)s, %(python)s, %(source)s and %(build)s (source and build directories).
+Options may also be given as functions of BuildContext.
+"""
+
+import distutils.spawn
+import errno
+import fcntl
+import glob
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from requirement import RequirementException
+from utility import run_shell, unpack, safe_remove, ln, cp
+from scratch import is_tmpfs
+
+
+# folder of scratch area with build directories of recipes, other builders keep theirs next to it
+BUILDS_DIR = 'recipes'
+# build directories kept by default
+KEEP_BUILDS = 3
+# build directories kept by default in tmpfs, they take memory
+KEEP_TMPFS_BUILDS = 1
+
+
+def _single_dir(path):
+    """
+    :return: the only directory inside path if archive unpacked into path had a root folder, path otherwise
+    """
+    entries = os.listdir(path)
+    if len(entries) == 1 and os.path.isdir(os.path.join(path, entries[0])):
+        return os.path.join(path, entries[0])
+    return path
+
+
+def _key(step, ctx):
+    """
+    :return: part of build key describing source or build system
+    """
+    if step is None:
+        return ''
+    if hasattr(step, 'key'):
+        return step.key(ctx)
+    return type(step).__name__
+
+
+class BuildContext(object):
+    """
+    State of a single package install, passed to sources, build systems and install steps.
+    """
+    def __init__(self, robustus, recipe, requirement_specifier):
+        self.robustus = robustus
+        self.name = recipe.name
+        self.version = requirement_specifier.version
+        self.env = robustus.env
+        self.prefix = os.path.abspath(os.path.join(robustus.cache, recipe.cache_name % self.fields()))
+        self.jobs = robustus.jobserver.jobs
+        self.verbose = robustus.settings['verbosity'] >= 1
+        self.environ = os.environ.copy()
+        self.work_dir = None
+        self.source_dir = None
+        self.build_dir = None
+        self.stage_root = None
+
+    @property
+    def stage_dir(self):
+        """
+        Location of prefix inside the staging directory, build installs files here.
+        """
+        return os.path.join(self.stage_root, self.prefix.lstrip(os.sep))
+
+    def fields(self):
+        return {'name': self.name,
+                'version': self.version,
+                'prefix': getattr(self, 'prefix', None),
+                'env': self.env,
+                'python': self.robustus.python_executable,
+                'source': getattr(self, 'source_dir', None),
+                'build': getattr(self, 'build_dir', None)}
+
+    def format(self, value):
+        """
+        Substitute fields into recipe string, list of strings or result of function of context.
+        """
+        if callable(value):
+            value = value(self)
+        if isinstance(value, (list, tuple)):
+            return [self.format(v) for v in value]
+        if isinstance(value, basestring) and '%(' in value:
+            return value % self.fields()
+        return value
+
+    def run(self, command, step, cwd=None, env=None, parallel=False):
+        """
+        Run build command in a slot of robustus jobserver, by default in build directory. make run
+        by the command takes slots for its parallel jobs from the jobserver.
+        :param step: name of the step for error message
+        :param parallel: command can't use jobserver, it takes free slots and their number is passed
+        to it as -j<N>
+        :raise: RequirementException if command failed
+        """
+        jobserver = self.robustus.jobserver
+        with jobserver.slots(self.jobs if parallel else 1) as slots:
+            if parallel:
+                command = command + ['-j%d' % slots]
+            retcode = run_shell(command, cwd=cwd if cwd is not None else self.build_dir,
+                                env=jobserver.environ(env if env is not None else self.environ),
+                                verbose=self.verbose)
+        if retcode != 0:
+            raise RequirementException('%s %s failed' % (self.name, step))
+
+
+# sources
+
+class Archive(object):
+    def __init__(self, url=None, filename=None, sha256=None, package=None):
+        """
+        Source archive.
+        :param url: original location of archive, if None archive <package>-<version>.{tar.gz,tar.bz2,zip}
+        is searched on remote caches (find_links)
+        :param filename: name to keep downloaded archive under, should be unique
+        :param package: package name of archive on remote caches, name of recipe by default
+        """
+        self.url = url
+        self.filename = filename
+        self.sha256 = sha256
+        self.package = package
+
+    def key(self, ctx):
+        if self.url is None:
+            return 'remote cache:%s' % (self.package or ctx.name)
+        return ctx.format(self.url)
+
+    def fetch(self, ctx, dest):
+        """
+        :return: source directory
+        """
+        if self.url is None:
+            archive = ctx.robustus.download(self.package or ctx.name, ctx.version, ctx.work_dir)
+        else:
+            archive = ctx.robustus.fetcher.fetch_url(ctx.format(self.url), ctx.format(self.filename), self.sha256)
+        try:
+            os.mkdir(dest)
+            unpack(archive, dest)
+        finally:
+            if self.url is None:
+                # archives from remote caches are downloaded into build directory
+                safe_remove(archive)
+        return _single_dir(dest)
+
+
+class Git(object):
+    def __init__(self, url, submodules=True):
+        """
+        Git repository, version of requirement is the branch, tag or commit to check out.
+        """
+        self.url = url
+        self.submodules = submodules
+
+    def key(self, ctx):
+        return ctx.format(self.url)
+
+    def fetch(self, ctx, dest):
+        ctx.robustus.fetcher.clone(ctx.format(self.url), dest, branch=ctx.version, submodules=self.submodules)
+        return dest
+
+
+# build systems
+
+class CMake(object):
+    in_source = False
+
+    def __init__(self, options=(), install=True, ninja=True):
+        """
+        :param options: cmake options
+        :param install: run "make install", otherwise files are taken from build tree by Stage steps
+        :param ninja: use Ninja generator if it's installed and options don't choose generator
+        """
+        self.options = options
+        self.install = install
+        self.ninja = ninja
+
+    def _ninja(self, ctx):
+        """
+        :return: ninja executable to build with or None if build uses makefiles
+        """
+        if not self.ninja or not ctx.robustus.settings.get('ninja', True):
+            return None
+        if not callable(self.options) and any(o.startswith('-G') for o in self.options):
+            return None
+        return distutils.spawn.find_executable('ninja') or distutils.spawn.find_executable('ninja-build')
+
+    def key(self, ctx):
+        # build directory configured for one generator can't be used with another
+        return 'CMake-Ninja' if self._ninja(ctx) is not None else 'CMake'
+
+    def build(self, ctx):
+        env = dict(ctx.environ)
+        env['PKG_CONFIG_PATH'] = os.pathsep.join(ctx.robustus.search_pkg_config_locations())
+        ninja = self._ninja(ctx)
+        generator = ['-G', 'Ninja'] if ninja is not None else []
+        ctx.run(['cmake', ctx.source_dir, '-DCMAKE_INSTALL_PREFIX=%s' % ctx.prefix] + generator +
+                ctx.format(self.options), 'configure', env=env)
+        if ninja is not None:
+            ctx.run([ninja], 'build', parallel=True)
+            if self.install:
+                env = dict(ctx.environ)
+                env['DESTDIR'] = ctx.stage_root
+                ctx.run([ninja, 'install'], '"ninja install"', env=env)
+            return
+        ctx.run(['make'], 'build')
+        if self.install:
+            ctx.run(['make', 'install', 'DESTDIR=%s' % ctx.stage_root], '"make install"')
+
+
+class Autotools(object):
+    in_source = True
+
+    def __init__(self, options=(), bootstrap=None, make_args=(), install=True):
+        """
+        :param options: configure options
+        :param bootstrap: script generating configure
+        :param make_args: arguments of every make call, e.g. variables
+        :param install: run "make install", otherwise files are taken from build tree by Stage steps
+        """
+        self.options = options
+        self.bootstrap = bootstrap
+        self.make_args = make_args
+        self.install = install
+
+    def build(self, ctx):
+        if self.bootstrap is not None:
+            ctx.run([self.bootstrap], 'bootstrap')
+        ctx.run(['./configure', '--prefix=%s' % ctx.prefix] + ctx.format(self.options), 'configure')
+        ctx.run(['make'] + ctx.format(self.make_args), 'build')
+        if self.install:
+            ctx.run(['make', 'install', 'DESTDIR=%s' % ctx.stage_root] + ctx.format(self.make_args),
+                    '"make install"')
+
+
+class Make(object):
+    in_source = True
+
+    def __init__(self, make_args=()):
+        """
+        Plain makefile without install target, files are taken from build tree by Stage steps.
+        """
+        self.make_args = make_args
+
+    def build(self, ctx):
+        ctx.run(['make'] + ctx.format(self.make_args), 'build')
+
+
+class SetupPy(object):
+    in_source = True
+
+    def __init__(self, args=()):
+        """
+        Package built and installed by its setup.py with python of environment.
+        :param args: setup.py arguments preceding install command
+        """
+        self.args = args
+
+    def build(self, ctx):
+        ctx.run([ctx.robustus.python_executable, 'setup.py'] + ctx.format(self.args) +
+                ['install', '--prefix=%s' % ctx.prefix, '--root=%s' % ctx.stage_root], 'setup.py install')
+
+
+class Custom(object):
+    def __init__(self, function, in_source=True):
+        """
+        :param function: function of BuildContext building the package and installing it into ctx.stage_dir
+        """
+        self.function = function
+        self.in_source = in_source
+
+    def build(self, ctx):
+        self.function(ctx)
+
+
+# build steps copying files into staging directory
+
+class Stage(object):
+    def __init__(self, pattern, dest='', root='build'):
+        """
+        Copy files or directories matching pattern from build (or 'source') directory into the package.
+        :param dest: directory inside the package
+        """
+        self.pattern = pattern
+        self.dest = dest
+        self.root = root
+
+    def install(self, ctx):
+        root = ctx.build_dir if self.root == 'build' else ctx.source_dir
+        dest = os.path.join(ctx.stage_dir, ctx.format(self.dest))
+        if not os.path.isdir(dest):
+            os.makedirs(dest)
+        paths = glob.glob(os.path.join(root, ctx.format(self.pattern)))
+        if len(paths) == 0:
+            raise RequirementException('%s build didn\'t produce %s' % (ctx.name, self.pattern))
+        for path in paths:
+            if os.path.isdir(path):
+                shutil.copytree(path, os.path.join(dest, os.path.basename(path)), symlinks=True)
+            else:
+                shutil.copy2(path, dest)
+
+
+# install steps copying package from the cache into environment
+
+class CopyTree(object):
+    def __init__(self, dest=None):
+        """
+        Copy the whole package into directory of environment, replacing it.
+        :param dest: directory relative to environment, if None package is merged into environment
+        """
+        self.dest = dest
+
+    def install(self, ctx):
+        if self.dest is None:
+            # distutils remembers created directories, which may have been removed since
+            import distutils.dir_util
+            distutils.dir_util._path_created = {}
+            distutils.dir_util.copy_tree(ctx.prefix, ctx.env)
+            return
+        dest = os.path.join(ctx.env, ctx.format(self.dest))
+        safe_remove(dest)
+        shutil.copytree(ctx.prefix, dest)
+
+
+class Copy(object):
+    def __init__(self, pattern, dest):
+        """
+        Copy files of the package matching pattern into directory of environment.
+        """
+        self.pattern = pattern
+        self.dest = dest
+
+    def install(self, ctx):
+        dest = os.path.join(ctx.env, ctx.format(self.dest))
+        if not os.path.isdir(dest):
+            os.makedirs(dest)
+        cp(os.path.join(ctx.prefix, ctx.format(self.pattern)), dest)
+
+
+class Link(object):
+    def __init__(self, target, name):
+        """
+        Symlink file of environment to file of the package.
+        """
+        self.target = target
+        self.name = name
+
+    def install(self, ctx):
+        ln(os.path.join(ctx.prefix, ctx.format(self.target)), os.path.join(ctx.env, ctx.format(self.name)),
+           force=True)
+
+
+class Recipe(object):
+    def __init__(self, name, source=None, build=None, stage=(), outputs=(), runtime=(), compiled_archive=False,
+                 cache_name='%(name)s-%(version)s', compiler_cache=True):
+        """
+        :param name: package name
+        :param source: Archive or Git
+        :param build: CMake, Autotools, Make, SetupPy or Custom
+        :param stage: Stage steps run after build
+        :param outputs: files the package must contain, relative to package directory
+        :param runtime: install steps (CopyTree, Copy, Link) run on every install
+        :param compiled_archive: look for compiled archive on remote caches before building
+        :param cache_name: name of package directory in the cache
+        :param compiler_cache: compile through compiler cache
+        """
+        self.name = name
+        self.source = source
+        self.build = build
+        self.stage = stage
+        self.outputs = outputs
+        self.runtime = runtime
+        self.compiled_archive = compiled_archive
+        self.cache_name = cache_name
+        self.compiler_cache = compiler_cache
+
+    def _complete(self, ctx, package_dir):
+        return os.path.isdir(package_dir) and \
+            all(os.path.exists(os.path.join(package_dir, ctx.format(o))) for o in self.outputs)
+
+    def in_cache(self, robustus, requirement_specifier):
+        ctx = BuildContext(robustus, self, requirement_specifier)
+        return self._complete(ctx, ctx.prefix)
+
+    def install(self, robustus, requirement_specifier, ignore_index):
+        """
+        Build package into the cache unless it's there and install it into environment.
+        :return: package directory in the cache
+        """
+        ctx = BuildContext(robustus, self, requirement_specifier)
+        if not self._complete(ctx, ctx.prefix) and not ignore_index:
+            if not (self.compiled_archive and self._unpack_compiled_archive(ctx)):
+                self._build(ctx)
+
+        if not self._complete(ctx, ctx.prefix):
+            raise RequirementException('can\'t find %s-%s in robustus cache' % (self.name, ctx.version))
+        for step in self.runtime:
+            step.install(ctx)
+        return ctx.prefix
+
+    def _work_dir(self, ctx):
+        return tempfile.mkdtemp(prefix='%s-%s-' % (self.name, ctx.version), dir=ctx.robustus.cache)
+
+    def _commit(self, ctx, package_dir):
+        """
+        Move completely built package into the cache.
+        """
+        if not self._complete(ctx, package_dir):
+            raise RequirementException('%s build didn\'t produce %s' %
+                                       (self.name, ', '.join(ctx.format(self.outputs)) or ctx.prefix))
+        safe_remove(ctx.prefix)
+        try:
+            os.rename(package_dir, ctx.prefix)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # package is built in another filesystem (tmpfs), it's copied next to its place first,
+            # so that interrupted copy doesn't leave incomplete package in the cache
+            partial = ctx.prefix + '.partial'
+            safe_remove(partial)
+            shutil.copytree(package_dir, partial, symlinks=True)
+            os.rename(partial, ctx.prefix)
+            safe_remove(package_dir)
+
+    def _unpack_compiled_archive(self, ctx):
+        """
+        :return: True if package was taken from compiled archive
+        """
+        archive = ctx.robustus.download_compiled_archive(self.name, ctx.version)
+        if archive is None:
+            return False
+        work_dir = self._work_dir(ctx)
+        try:
+            logging.info('Initializing compiled %s' % self.name)
+            unpack(archive, work_dir)
+            self._commit(ctx, _single_dir(work_dir))
+        except RequirementException as e:
+            logging.warn('Compiled archive of %s is unusable: %s' % (self.name, e))
+            return False
+        finally:
+            safe_remove(archive)
+            safe_remove(work_dir)
+        return True
+
+    def _build_key(self, ctx):
+        """
+        :return: key of build directory, builds of the same package from the same source with the same build
+        system share the directory regardless of options
+        """
+        key = '\n'.join([self.name, ctx.version, ctx.prefix, _key(self.source, ctx), _key(self.build, ctx)])
+        return hashlib.sha1(key).hexdigest()[:10]
+
+    def _build_dir(self, ctx):
+        return os.path.join(ctx.robustus.build_root, BUILDS_DIR,
+                            '%s-%s-%s' % (self.name, ctx.version, self._build_key(ctx)))
+
+    def _fetch(self, ctx):
+        """
+        Fetch sources into work directory unless previous build already did.
+        """
+        marker = os.path.join(ctx.work_dir, 'source.ready')
+        if os.path.isfile(marker):
+            ctx.source_dir = os.path.join(ctx.work_dir, open(marker).read())
+            logging.info('Resuming build of %s in %s' % (self.name, ctx.work_dir))
+            return
+        # sources are incomplete, so is everything built from them
+        for d in ['source', 'build']:
+            safe_remove(os.path.join(ctx.work_dir, d))
+        source_dir = os.path.join(ctx.work_dir, 'source')
+        if self.source is not None:
+            ctx.source_dir = self.source.fetch(ctx, source_dir)
+        else:
+            ctx.source_dir = source_dir
+            os.mkdir(source_dir)
+        with open(marker, 'w') as f:
+            f.write(os.path.relpath(ctx.source_dir, ctx.work_dir))
+
+    def _build(self, ctx):
+        ctx.work_dir = self._build_dir(ctx)
+        if not os.path.isdir(ctx.work_dir):
+            os.makedirs(ctx.work_dir)
+        # build directory may be used by robustus installing into the same environment concurrently
+        lock = open(os.path.join(ctx.work_dir, '.lock'), 'w')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            # mtime of build directory is the time of its last use
+            os.utime(ctx.work_dir, None)
+            self._fetch(ctx)
+            if self.build is None or self.build.in_source:
+                ctx.build_dir = ctx.source_dir
+            else:
+                ctx.build_dir = os.path.join(ctx.work_dir, 'build')
+                if not os.path.isdir(ctx.build_dir):
+                    os.mkdir(ctx.build_dir)
+            ctx.stage_root = os.path.join(ctx.work_dir, 'stage')
+            safe_remove(ctx.stage_root)
+            os.makedirs(ctx.stage_dir)
+
+            logging.info('Building %s' % self.name)
+            if self.build is not None:
+                if self.compiler_cache:
+                    with ctx.robustus.compiler_cache.build(self.name, ctx.environ) as ctx.environ:
+                        self.build.build(ctx)
+                else:
+                    self.build.build(ctx)
+            for step in self.stage:
+                step.install(ctx)
+            self._commit(ctx, ctx.stage_dir)
+            safe_remove(ctx.stage_root)
+        finally:
+            keep = ctx.robustus.settings.get('keep_builds')
+            if keep is None:
+                keep = KEEP_TMPFS_BUILDS if is_tmpfs(ctx.work_dir) else KEEP_BUILDS
+            if keep == 0:
+                safe_remove(ctx.work_dir)
+            # current build directory is locked and thus kept even if it's failed
+            prune_build_dirs(os.path.dirname(ctx.work_dir), keep)
+            lock.close()
+            ctx.work_dir = ctx.source_dir = ctx.build_dir = ctx.stage_root = None
+
+
+def prune_build_dirs(root, keep):
+    """
+    Remove least recently used build directories, so that at most keep of them are left.
+    Directories of builds running right now and directories not made by recipes are not removed.
+    """
+    try:
+        build_dirs = [os.path.join(root, d) for d in os.listdir(root)]
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return
+        raise
+    # every build directory of recipe has a lock file
+    build_dirs = [d for d in build_dirs if os.path.isfile(os.path.join(d, '.lock'))]
+    for build_dir in sorted(build_dirs, key=os.path.getmtime, reverse=True)[keep:]:
+        with open(os.path.join(build_dir, '.lock'), 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                continue
+            logging.info('Removing old build directory %s' % build_dir)
+            safe_remove(build_dir)
@@ -0,0 +1,272 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+"""
+Machine-readable manifests of remote caches (find_links).
+
+Each find_link may publish MANIFEST_NAME next to its python-wheels folder. The manifest
+lists every artifact (wheels, compiled and source archives) with its name, version,
+platform, size, digest and url relative to the find_link. Robustus fetches it once per
+run (revalidating with ETag) and resolves artifacts locally instead of probing the server.
+"""
+
+import distutils.util
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import urllib2
+from utility import read_json, write_json, file_sha256
+
+
+MANIFEST_NAME = 'robustus-index.json'
+MANIFEST_FORMAT_VERSION = 1
+ARCHIVE_EXTENSIONS = ['.tar.gz', '.tar.bz2', '.zip']
+COMPILED_EXTENSIONS = ['.compiled' + ext for ext in ARCHIVE_EXTENSIONS]
+
+
+def normalize_name(name):
+    """
+    Normalize package name the way pip compares them.
+    >>> normalize_name('Foo_Bar.baz')
+    'foo-bar-baz'
+    """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def _split_name_version(base):
+    """
+    Split '<name>-<version>' where both name and version may contain dashes.
+    Version is assumed to start at the first dash followed by a digit.
+    >>> _split_name_version('OpenNI-2.2-beta2')
+    ('OpenNI', '2.2-beta2')
+    >>> _split_name_version('ros-installed-overlay-abcdef')
+    ('ros-installed-overlay', 'abcdef')
+    """
+    mo = re.match(r'^(.+?)-(\d.*)$', base)
+    if mo is not None:
+        return mo.group(1), mo.group(2)
+    name, _, version = base.rpartition('-')
+    return name, version
+
+
+def artifact_info(filename):
+    """
+    Extract (kind, name, version, platform) from artifact filename.
+    :return: tuple or None if filename is not a robustus artifact
+    >>> artifact_info('scipy-0.13.3-cp27-none-linux_armv7l.whl')
+    ('wheel', 'scipy', '0.13.3', 'linux_armv7l')
+    >>> artifact_info('OpenCV-2.4.8-x86_64.compiled.tar.gz')
+    ('compiled', 'OpenCV', '2.4.8', 'x86_64')
+    >>> artifact_info('bullet-2.81.tar.bz2')
+    ('source', 'bullet', '2.81', 'source')
+    >>> artifact_info('index.html') is None
+    True
+    """
+    if filename.endswith('.whl'):
+        parts = filename[:-4].split('-')
+        if len(parts) not in (5, 6):
+            return None
+        return 'wheel', parts[0], parts[1], parts[-1]
+
+    for ext in COMPILED_EXTENSIONS:
+        if filename.endswith(ext):
+            base, _, arch = filename[:-len(ext)].rpartition('-')
+            if not base:
+                return None
+            name, version = _split_name_version(base)
+            return 'compiled', name, version, arch
+
+    for ext in ARCHIVE_EXTENSIONS:
+        if filename.endswith(ext):
+            name, version = _split_name_version(filename[:-len(ext)])
+            if not name:
+                return None
+            return 'source', name, version, 'source'
+
+    return None
+
+
+def current_wheel_platform():
+    """
+    Platform tag of wheels built on this machine, e.g. linux_x86_64.
+    """
+    return distutils.util.get_platform().replace('-', '_').replace('.', '_')
+
+
+class Manifest(object):
+    """
+    Parsed manifest of a single find_link.
+    """
+    def __init__(self, find_link, data):
+        self.find_link = find_link
+        self.artifacts = data.get('artifacts', [])
+        self._by_filename = dict((a['filename'], a) for a in self.artifacts)
+
+    def __len__(self):
+        return len(self.artifacts)
+
+    def find_file(self, filename):
+        """
+        :return: manifest entry for artifact with given filename or None
+        """
+        return self._by_filename.get(filename)
+
+    def find_wheel(self, name, version=None, platform_tag=None):
+        """
+        Find wheel for package of specified version suitable for this platform.
+        :return: manifest entry or None
+        """
+        if platform_tag is None:
+            platform_tag = current_wheel_platform()
+        name = normalize_name(name)
+        for a in self.artifacts:
+            if a['kind'] != 'wheel' or normalize_name(a['name']) != name:
+                continue
+            if version is not None and a['version'] != version:
+                continue
+            if a['platform'] not in ('any', platform_tag):
+                continue
+            return a
+        return None
+
+    def url(self, entry):
+        """
+        :return: absolute url of manifest entry
+        """
+        return self.find_link.rstrip('/') + '/' + entry['url']
+
+
+class RemoteIndex(object):
+    """
+    Fetches manifests of find_links once per run, caching them on disk with ETags.
+    """
+    def __init__(self, cache_dir, timeout=30, health=None):
+        """
+        :param cache_dir: directory to store fetched manifests in
+        :param timeout: timeout of manifest request in seconds
+        :param health: MirrorHealth to record latency and failures of find_links or None
+        """
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.health = health
+        self._manifests = {}
+
+    def _cache_filename(self, find_link):
+        return os.path.join(self.cache_dir, hashlib.sha1(find_link).hexdigest() + '.json')
+
+    def manifest(self, find_link):
+        """
+        :return: Manifest of find_link or None if find_link doesn't publish one
+        """
+        if find_link not in self._manifests:
+            data = self._fetch(find_link)
+            self._manifests[find_link] = Manifest(find_link, data) if data is not None else None
+        return self._manifests[find_link]
+
+    def _fetch(self, find_link):
+        cache_filename = self._cache_filename(find_link)
+        cached = read_json(cache_filename)
+        if self.health is not None and self.health.is_tripped(find_link):
+            return cached['manifest'] if cached is not None else None
+
+        url = find_link.rstrip('/') + '/' + MANIFEST_NAME
+        request = urllib2.Request(url)
+        if cached is not None and cached.get('etag'):
+            request.add_header('If-None-Match', cached['etag'])
+
+        start = time.time()
+        try:
+            if self.health is not None:
+                response = self.health.open_url(find_link, request, self.timeout)
+            else:
+                response = urllib2.urlopen(request, timeout=self.timeout)
+            data = response.read()
+        except urllib2.HTTPError as e:
+            if e.code == 304 and cached is not None:
+                logging.info('Remote index %s is not modified' % url)
+                return cached['manifest']
+            if e.code == 404:
+                logging.info('%s does not publish remote index' % find_link)
+                if cached is not None:
+                    os.remove(cache_filename)
+                return None
+            logging.info('Failed to fetch remote index %s: %s' % (url, e))
+            return cached['manifest'] if cached is not None else None
+        except (urllib2.URLError, IOError) as e:
+            logging.info('Failed to fetch remote index %s: %s' % (url, e))
+            return cached['manifest'] if cached is not None else None
+
+        try:
+            manifest = json.loads(data)
+        except ValueError:
+            logging.warn('Remote index %s is malformed, ignoring it' % url)
+            return None
+        if manifest.get('format') != MANIFEST_FORMAT_VERSION:
+            logging.warn('Remote index %s has unsupported format %s, ignoring it' % (url, manifest.get('format')))
+            return None
+
+        logging.info('Fetched remote index %s with %d artifacts in %.2f sec'
+                     % (url, len(manifest.get('artifacts', [])), time.time() - start))
+        etag = response.info().getheader('ETag')
+        write_json(cache_filename, {'etag': etag, 'manifest': manifest})
+        return manifest
+
+
+def generate_manifest(root_dir, wheels_dir='python-wheels', previous=None):
+    """
+    Generate manifest for find_link stored in root_dir. Wheels are expected in
+    root_dir/wheels_dir, compiled and source archives in root_dir itself.
+    Digests of files which size and modification time didn't change are reused
+    from previous manifest, so regeneration is incremental.
+    :param previous: previous manifest data or None
+    :return: manifest data
+    """
+    known = {}
+    if previous is not None and previous.get('format') == MANIFEST_FORMAT_VERSION:
+        known = dict((a['url'], a) for a in previous.get('artifacts', []))
+
+    artifacts = []
+    for subdir in ['', wheels_dir]:
+        directory = os.path.join(root_dir, subdir)
+        if not os.path.isdir(directory):
+            continue
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            info = artifact_info(filename)
+            if info is None or not os.path.isfile(path):
+                continue
+            kind, name, version, platform_tag = info
+            if (kind == 'wheel') != (subdir == wheels_dir):
+                continue
+            url = filename if subdir == '' else subdir + '/' + filename
+            stat = os.stat(path)
+            entry = known.get(url)
+            if entry is None or entry['size'] != stat.st_size or entry['mtime'] != int(stat.st_mtime):
+                entry = {'filename': filename,
+                         'kind': kind,
+                         'name': name,
+                         'version': version,
+                         'platform': platform_tag,
+                         'size': stat.st_size,
+                         'mtime': int(stat.st_mtime),
+                         'sha256': file_sha256(path),
+                         'url': url}
+            artifacts.append(entry)
+
+    return {'format': MANIFEST_FORMAT_VERSION, 'artifacts': artifacts}
+
+
+def update_manifest(root_dir, wheels_dir='python-wheels'):
+    """
+    Incrementally regenerate MANIFEST_NAME in root_dir.
+    :return: manifest data
+    """
+    manifest_filename = os.path.join(root_dir, MANIFEST_NAME)
+    manifest = generate_manifest(root_dir, wheels_dir, read_json(manifest_filename))
+    write_json(manifest_filename, manifest)
+    return manifest
@@ -4,22 +4,71 @@
 # =============================================================================
 
 import os
+import posixpath
 import re
+import subprocess
 import urlparse
 from git_accessor import GitAccessor
+from remote_index import normalize_name
 import logging
 import urllib
 from collections import OrderedDict, defaultdict
+from multiprocessing.pool import ThreadPool
 import string
 import hashlib
 
 
+# number of requirements files of editable packages fetched at once
+FETCH_JOBS = 8
+
+_ros_overlay_re = re.compile(r'^ros_overlay\w*==(.*)')
+_name_version_re = re.compile(r'^([\w-]+)\s*(?:([>=]=)?\s*([\w.-]+))?\s*(?:#.*)?$')
+_include_re = re.compile(r'^(-r|--requirement|-c|--constraint)(?:\s*=\s*|\s*)(\S.*)$')
+# memoized results of parsing specifiers that don't depend on file system
+_parsed_urls = {}
+_parsed_names = {}
+# filtered lines of requirements files by hash of file content
+_parsed_files = {}
+
+
+def _parse_url(specifier):
+    """
+    @return: urlparse result if specifier is url, None otherwise
+    """
+    if specifier not in _parsed_urls:
+        url = urlparse.urlparse(specifier)
+        _parsed_urls[specifier] = url if len(url.scheme) > 0 else None
+    return _parsed_urls[specifier]
+
+
+def _parse_name(specifier):
+    """
+    @return: (name, version, allow_greater_version) of <package>[==|>=]<version> specifier
+    """
+    if specifier not in _parsed_names:
+        mo = _ros_overlay_re.match(specifier)
+        if mo is not None:
+            # This is a ROS package description
+            parsed = ('ros_overlay', mo.group(1), False)
+        else:
+            # check if requirement is in <package>[==|>=]<version> format
+            mo = _name_version_re.match(specifier)
+            if mo is None:
+                raise RequirementException('invalid requirement specified "%s"' % specifier)
+            # check if user accepts greater version, i.e. >= is used
+            parsed = mo.group(1, 3) + (mo.group(2) == '>=',)
+        _parsed_names[specifier] = parsed
+    return _parsed_names[specifier]
+
+
 class RequirementException(Exception):
     def __init__(self, message):
         Exception.__init__(self, message)
 
 
 class Requirement(object):
+    __slots__ = ('name', 'version', 'url', 'path', 'editable')
+
     def __init__(self, *args, **kwargs):
         """
         Create requirement.
@@ -161,6 +210,8 @@ class Requirement(object):
 
 
 class RequirementSpecifier(Requirement):
+    __slots__ = ('allow_greater_version',)
+
     def __init__(self, *args, **kwargs):
         """
         Create requirement specifier.
@@ -174,10 +225,12 @@ class RequirementSpecifier(Requirement):
         >>> RequirementSpecifier(specifier='-e numpy>=1.7.1')
         RequirementSpecifier(name='numpy', version='1.7.1', allow_greater_version, editable)
         """
+        # parse specifier once, here rather than in base class
+        specifier = kwargs.pop('specifier', None)
         Requirement.__init__(self, *args, **kwargs)
         self.allow_greater_version = kwargs.get('allow_greater_version', False)
-        if 'specifier' in kwargs:
-            self._from_specifier(kwargs['specifier'])
+        if specifier is not None:
+            self._from_specifier(specifier)
 
     def override_branch(self, tag):
         """Modified the specified branch to a given tag or branch."""
@@ -254,8 +307,8 @@ class RequirementSpecifier(Requirement):
             self.editable = True
             specifier = specifier[2:].lstrip()
         # check if requirement is url
-        url = urlparse.urlparse(specifier)
-        if len(url.scheme) > 0:
+        url = _parse_url(specifier)
+        if url is not None:
             self.url = url
             # try to extract name from egg, demand name if requirement is editable
             try:
@@ -271,23 +324,9 @@ class RequirementSpecifier(Requirement):
             self.path = path_specifier
             return self.path, self.editable
 
-        mo = re.match(r'^ros_overlay\w*==(.*)', specifier)
-        if mo is not None:
-            # This is a ROS package description
-            self.name = 'ros_overlay'
-            self.version = mo.group(1)
-            self.allow_greater_version = False
+        self.name, self.version, self.allow_greater_version = _parse_name(specifier)
+        if self.name == 'ros_overlay':
             self.editable = False
-        else:
-            # check if requirement is in <package>[==|>=]<version> format
-            mo = re.match(r'^([\w-]+)\s*(?:([>=]=)?\s*([\w.-]+))?\s*(?:#.*)?$', specifier)
-            if mo is None:
-                raise RequirementException('invalid requirement specified "%s"' % specifier)
-            self.name, self.version = mo.group(1, 3)
-            # check if user accepts greater version, i.e. >= is used
-            version_specifier = mo.group(2)
-            if version_specifier is not None and version_specifier == '>=':
-                self.allow_greater_version = True
 
         return self.name, self.version, self.allow_greater_version, self.editable
 
@@ -388,10 +427,23 @@ def _split_egg_and_url(url):
     return url[:egg_position], url[egg_position+5:]
 
 
-def _obtain_requirements_from_remote_package(git_accessor, original_req,
-                                             override_tag=None, ignore_missing_refs = False):
-    url = original_req.url.geturl()[4:]
+def git_link_and_ref(requirement):
+    """
+    Split url of editable git requirement into repository link and branch or tag.
+    @return: (link, ref), ref is None if not specified
+    Examples:
+    >>> git_link_and_ref(RequirementSpecifier(specifier='-e git+https://github.com/company/my_package@branch_name#egg=my_package'))
+    ('https://github.com/company/my_package', 'branch_name')
+    >>> git_link_and_ref(RequirementSpecifier(specifier='-e git+ssh://git@github.com/company/my_package#egg=my_package'))
+    ('ssh://git@github.com/company/my_package', None)
+    >>> git_link_and_ref(RequirementSpecifier(specifier='-e git+file:///repos/my_package@v1.0#egg=my_package'))
+    ('file:///repos/my_package', 'v1.0')
+    """
+    url = requirement.url.geturl()[4:]
     url, name = _split_egg_and_url(url)
+    if url.startswith('file:') and not url.startswith('file://'):
+        # urlparse drops empty netloc of unknown git+file scheme
+        url = 'file://' + url[len('file:'):]
 
     if url.startswith('ssh://git@'):
         # searching '@' after git@
@@ -400,9 +452,14 @@ def _obtain_requirements_from_remote_package(git_accessor, original_req,
         at_pos = url.find('@')
 
     if at_pos > 0:
-        link, tag = url[:at_pos], url[at_pos+1:]
+        return url[:at_pos], url[at_pos+1:]
     else:
-        link, tag = url, None
+        return url, None
+
+
+def _obtain_requirements_from_remote_package(git_accessor, original_req,
+                                             override_tag=None, ignore_missing_refs = False):
+    link, tag = git_link_and_ref(original_req)
     if override_tag:
         tag = override_tag
 
@@ -422,9 +479,10 @@ def _obtain_requirements_from_local_package(original_req):
 
 
 def do_requirement_recursion(git_accessor, original_req, visited_sites = None,
-                             tag=None, ignore_missing_refs = False):
+                             tag=None, ignore_missing_refs = False, includes=None):
     '''
     Recursive extraction of requirements from -e git+.. pip links.
+    @includes: _Includes of resolution pass this recursion is part of
     @return: list
     '''
     if visited_sites is None:
@@ -454,8 +512,16 @@ def do_requirement_recursion(git_accessor, original_req, visited_sites = None,
         raise RequirementException('Editable requirement %s does not have a requirements.txt file'
                                    % original_req.freeze())
 
+    # files included from requirements.txt are looked up next to it
+    if original_req.url is not None:
+        link, ref = git_link_and_ref(original_req)
+        files = _RemoteRequirementsFiles(git_accessor, link, tag or ref, ignore_missing_refs)
+    else:
+        files = _LocalRequirementsFiles(original_req.path)
     return expand_requirements_specifiers(req_file_content, git_accessor, visited_sites,
-                                          tag=tag, ignore_missing_refs=ignore_missing_refs) + [original_req]
+                                          tag=tag, ignore_missing_refs=ignore_missing_refs,
+                                          files=files, includes=includes,
+                                          site=original_req.freeze()) + [original_req]
 
 
 def _filter_requirements_lines(lines):
@@ -484,6 +550,168 @@ def _filter_requirements_lines(lines):
     return filtered_lines
 
 
+def _parse_requirements_lines(lines):
+    '''
+    Filter lines of requirements file and split them into requirement specifiers and includes
+    of other requirements (-r) and constraints (-c) files. Result is cached by content hash, so
+    file included from many places is parsed once.
+    @return: tuple of (option, value) pairs, option is None for requirement specifier, '-r' or '-c' for include
+    Examples:
+    >>> _parse_requirements_lines(['numpy==1.7.2\\n', '# comment\\n', '-r base.txt\\n', '--constraint=pins.txt\\n'])
+    ((None, 'numpy==1.7.2'), ('-r', 'base.txt'), ('-c', 'pins.txt'))
+    '''
+    key = hashlib.sha1('\0'.join(lines)).hexdigest()
+    if key not in _parsed_files:
+        parsed = []
+        for line in _filter_requirements_lines(lines):
+            mo = _include_re.match(line)
+            if mo is None:
+                parsed.append((None, line))
+            else:
+                option, value = mo.groups()
+                parsed.append(('-r' if option in ('-r', '--requirement') else '-c', value.strip()))
+        _parsed_files[key] = tuple(parsed)
+    return _parsed_files[key]
+
+
+class _LocalRequirementsFiles(object):
+    '''
+    Requirements files on local file system, paths are relative to directory of including file.
+    '''
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+
+    def locate(self, path):
+        '''
+        @return: (key of file in visited_sites, path of file)
+        '''
+        file_path = os.path.normpath(os.path.join(self.base_dir, path))
+        return file_path, file_path
+
+    def read(self, file_path):
+        if not os.path.isfile(file_path):
+            raise RequirementException('Included requirements file %s does not exist' % file_path)
+        with open(file_path, 'r') as req_file:
+            return req_file.readlines()
+
+    def relative_to(self, file_path):
+        return _LocalRequirementsFiles(os.path.dirname(file_path))
+
+
+class _RemoteRequirementsFiles(object):
+    '''
+    Requirements files in git repository of editable requirement, read at the same ref as its
+    requirements.txt. Paths are relative to directory of including file in the repository.
+    '''
+    def __init__(self, git_accessor, link, ref, ignore_missing_refs, base_dir=''):
+        self.git_accessor = git_accessor
+        self.link = link
+        self.ref = ref
+        self.ignore_missing_refs = ignore_missing_refs
+        self.base_dir = base_dir
+
+    def locate(self, path):
+        file_path = posixpath.normpath(posixpath.join(self.base_dir, path))
+        if file_path.startswith('../') or posixpath.isabs(file_path):
+            raise RequirementException('Requirements file %s included in %s is outside of repository'
+                                       % (path, self.link))
+        return '%s (%s:%s)' % (self.link, self.ref or 'HEAD', file_path), file_path
+
+    def read(self, file_path):
+        try:
+            lines = self.git_accessor.access(self.link, self.ref, file_path,
+                                             ignore_missing_refs=self.ignore_missing_refs)
+        except (IOError, subprocess.CalledProcessError) as e:
+            raise RequirementException('Failed to read requirements file %s from %s: %s'
+                                       % (file_path, self.link, e))
+        if lines is None:
+            raise RequirementException('Included requirements file %s does not exist in %s' % (file_path, self.link))
+        return lines
+
+    def relative_to(self, file_path):
+        return _RemoteRequirementsFiles(self.git_accessor, self.link, self.ref, self.ignore_missing_refs,
+                                        posixpath.dirname(file_path))
+
+
+class _Includes(object):
+    '''
+    State of one resolution pass: -r includes are expanded in place once per file, -c files are
+    collected into constraints applied to the whole resolved set of requirements.
+    '''
+    def __init__(self, visited_sites):
+        self.visited_sites = visited_sites
+        # normalized package name -> RequirementSpecifier
+        self.constraints = OrderedDict()
+        # file key -> its requirement specifiers with includes expanded
+        self._expanded = {}
+        # keys of files being expanded, to detect cycles
+        self._stack = []
+        # site -> its lines with includes pointing to keys of included files
+        self._sites = OrderedDict()
+
+    def expand(self, lines, files, site=None):
+        '''
+        @return: requirement specifiers in lines, -r includes replaced by specifiers of included files
+        '''
+        result = []
+        resolved_lines = []
+        has_includes = False
+        for option, value in _parse_requirements_lines(lines):
+            if option is None:
+                result.append(value)
+                resolved_lines.append(value)
+                continue
+            has_includes = True
+            key, specifiers = self._include(value, files)
+            resolved_lines.append('%s %s' % (option, key))
+            if option == '-r':
+                result += specifiers
+            else:
+                self._add_constraints(key, specifiers)
+        if site is not None and has_includes:
+            self._sites[site] = resolved_lines
+        return result
+
+    def _include(self, path, files):
+        key, file_path = files.locate(path)
+        if key in self._stack:
+            raise RequirementException('Requirements files include each other: %s'
+                                       % ' -> '.join(self._stack[self._stack.index(key):] + [key]))
+        if key not in self._expanded:
+            lines = files.read(file_path)
+            self.visited_sites[key] = lines
+            self._stack.append(key)
+            try:
+                self._expanded[key] = self.expand(lines, files.relative_to(file_path), site=key)
+            finally:
+                self._stack.pop()
+        return key, self._expanded[key]
+
+    def _add_constraints(self, key, specifiers):
+        for specifier in specifiers:
+            c = RequirementSpecifier(specifier=specifier)
+            if c.name is None:
+                raise RequirementException('Constraint %s in %s does not name a package' % (specifier, key))
+            self.constraints[normalize_name(c.name)] = c
+
+    def finish(self, requirements):
+        '''
+        Point includes in visited_sites to included files and apply constraints to requirements.
+        @return: list of requirements
+        '''
+        self.visited_sites.update(self._sites)
+        result = []
+        for r in requirements:
+            if r.name is not None and r.name != 'ros_overlay' and not r.editable and \
+                    r.url is None and r.path is None:
+                c = self.constraints.get(normalize_name(r.name))
+                if c is not None and (c.version is not None or c.url is not None) and c.freeze() != r.freeze():
+                    logging.info('Requirement %s is constrained to %s' % (r.freeze(), c.freeze()))
+                    r = c
+            result.append(r)
+        return result
+
+
 def _filter(string):
     """
     Remove comments and empty lines
@@ -500,7 +728,58 @@ def _filter(string):
     return string
 
 
-def expand_requirements_specifiers(specifiers_list, git_accessor = None, visited_sites = None, tag=None, ignore_missing_refs = False):
+def _is_remote_editable(requirement):
+    return requirement.editable and requirement.url is not None and requirement.url.geturl().startswith('git+')
+
+
+def prefetch_requirements_files(specifiers_list, git_accessor, visited_sites, tag=None, ignore_missing_refs=False,
+                                jobs=FETCH_JOBS):
+    '''
+    Walk the tree of editable git requirements breadth first, fetching requirements files of
+    all requirements on the current level at once, and store them in visited_sites where
+    do_requirement_recursion looks for them. Files which failed to be fetched are left for the
+    recursion to fetch again and report the error.
+    '''
+    pool = None
+    try:
+        frontier = _filter_requirements_lines(specifiers_list)
+        while len(frontier) > 0:
+            pending = OrderedDict()
+            for line in frontier:
+                if not line.startswith('-e') or 'git+' not in line:
+                    continue
+                try:
+                    r = RequirementSpecifier(specifier=line)
+                except RequirementException:
+                    continue
+                if _is_remote_editable(r) and r.freeze() not in visited_sites:
+                    pending[r.freeze()] = r
+            if len(pending) == 0:
+                break
+            if pool is None:
+                pool = ThreadPool(jobs)
+
+            def fetch(r):
+                try:
+                    return _obtain_requirements_from_remote_package(git_accessor, r, override_tag=tag,
+                                                                    ignore_missing_refs=ignore_missing_refs)
+                except Exception as e:
+                    logging.info('Failed to prefetch requirements of %s: %s' % (r.freeze(), e))
+                    return None
+
+            frontier = []
+            for key, content in zip(pending.keys(), pool.map(fetch, pending.values())):
+                if content is not None:
+                    visited_sites[key] = content
+                    frontier += _filter_requirements_lines(content)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def expand_requirements_specifiers(specifiers_list, git_accessor = None, visited_sites = None, tag=None, ignore_missing_refs = False,
+                                   files=None, includes=None, site=None, constraints=None):
     '''
     Nice dirty hack to have a clean workflow:)
     In order to process hierarchical dependencies, we assume that -e git+ links
@@ -511,38 +790,53 @@ def expand_requirements_specifiers(specifiers_list, git_accessor = None, visited
     (this is what pip does to process all dependencies in pip).
     However we loosing wheeling capability - robustus will never get control
     back if pip started to process dependencies from egg_info.
+
+    Lines may include other requirements files with '-r file' and constraints files with
+    '-c file', paths are relative to the including file (to current directory on command line).
+    Constraints apply to all requirements resolved in one call.
+
+    @files: where included files are looked up, _LocalRequirementsFiles or _RemoteRequirementsFiles
+    @includes: _Includes of resolution pass this call is part of, None starts a new pass
+    @site: key of specifiers_list in visited_sites
+    @constraints: dict filled with constraints applied to requirements, by package name
     '''
 
     if visited_sites is None:
         visited_sites = {}
 
     assert(isinstance(specifiers_list, (list, tuple)))
-    requirements = []
+    requirements = _UniqueRequirements()
     if git_accessor is None:
         git_accessor = GitAccessor()
+    top_level = includes is None
+    if top_level:
+        includes = _Includes(visited_sites)
+
+    # remove comments, empty lines, concatenate lines with '\', expand included files
+    filtered_lines = includes.expand(specifiers_list, files or _LocalRequirementsFiles(''), site)
 
-    # remove comments, empty lines, concatenate lines with '\'
-    filtered_lines = _filter_requirements_lines(specifiers_list)
+    # requirements files are fetched concurrently first, recursion below reads them from visited_sites
+    prefetch_requirements_files(filtered_lines, git_accessor, visited_sites, tag=tag,
+                                ignore_missing_refs=ignore_missing_refs)
 
     for line in filtered_lines:
         r = RequirementSpecifier(specifier=line)
-        if r.freeze() not in [ritem.freeze() for ritem in requirements]:
-            requirements += do_requirement_recursion(git_accessor, r, visited_sites,
-                                                     tag=tag,
-                                                     ignore_missing_refs = ignore_missing_refs)
-            requirements = remove_duplicate_requirements(requirements)
-
-    return requirements
-
-
-def read_requirement_file(requirement_file, tag, ignore_missing_refs = False, visited_sites=None):
-    with open(requirement_file, 'r') as req_file:
-        specifiers_list = req_file.readlines()
-
-    if visited_sites is not None:
-        visited_sites[requirement_file] = specifiers_list
-
-    return expand_requirements_specifiers(specifiers_list, tag=tag,
+        if not requirements.contains_frozen(r.freeze()):
+            requirements.extend(do_requirement_recursion(git_accessor, r, visited_sites,
+                                                         tag=tag,
+                                                         ignore_missing_refs = ignore_missing_refs,
+                                                         includes=includes))
+
+    if top_level:
+        if constraints is not None:
+            constraints.update(includes.constraints)
+        return includes.finish(requirements.values())
+    return requirements.values()
+
+
+def read_requirement_file(requirement_file, tag, ignore_missing_refs = False, visited_sites=None,
+                          git_accessor=None):
+    return expand_requirements_specifiers(['-r ' + requirement_file], git_accessor, tag=tag,
                                           ignore_missing_refs=ignore_missing_refs,
                                           visited_sites=visited_sites)
 
@@ -555,22 +849,19 @@ def parse_visited(visited_sites):
     :return: defaultdict<set> that maps packages to all repos that included them
     """
 
-    check_list = visited_sites.keys()
-    visited = []
+    visited = set()
 
     # Stores where package was included from
     package_from = defaultdict(set)
 
-    while len(check_list):
-        current_node = check_list.pop(0)
-
-        visited.append(current_node)
+    for current_node in visited_sites.keys():
+        visited.add(current_node)
 
         for child in visited_sites[current_node]:
             child = _filter(child)
 
             # If contains '==', '>=' or 'tar.gz', this is a package name
-            if not child in visited and child.find('==') != -1 or child.find('>=') != -1 \
+            if child not in visited and child.find('==') != -1 or child.find('>=') != -1 \
                or child.find('tar.gz') != -1:
                     package_from[child].add(current_node)
     return package_from
@@ -632,6 +923,45 @@ def generate_dependency_list(visited_sites, selected_requirements=None):
     return result
 
 
+class _UniqueRequirements(object):
+    '''
+    Requirements deduplicated by base_name() strings as they are added. Requirement added later
+    replaces earlier one with the same base name, but keeps its position. ROS overlays are never
+    deduplicated.
+    '''
+    __slots__ = ('_by_name', '_frozen', '_ros_overlay_counter')
+
+    def __init__(self):
+        self._by_name = OrderedDict()
+        # number of requirements with given freeze() string
+        self._frozen = defaultdict(int)
+        self._ros_overlay_counter = 0
+
+    def add(self, r):
+        name = r.base_name()
+        if name == 'ros_overlay':
+            name += str(self._ros_overlay_counter)
+            self._ros_overlay_counter += 1
+        replaced = self._by_name.get(name)
+        if replaced is not None:
+            frozen = replaced.freeze()
+            self._frozen[frozen] -= 1
+            if self._frozen[frozen] == 0:
+                del self._frozen[frozen]
+        self._by_name[name] = r
+        self._frozen[r.freeze()] += 1
+
+    def extend(self, requirements_list):
+        for r in requirements_list:
+            self.add(r)
+
+    def contains_frozen(self, frozen):
+        return frozen in self._frozen
+
+    def values(self):
+        return self._by_name.values()
+
+
 def remove_duplicate_requirements(requirements_list):
     '''
     Given list of requirements, removes all duplicates of requirements comparing
@@ -639,12 +969,6 @@ def remove_duplicate_requirements(requirements_list):
     without version or branch, therefore we will keep only the most latest entry with
     version.
     '''
-    result = OrderedDict()
-    ros_overlay_counter = 0
-    for r in requirements_list:
-        name = r.base_name()
-        if name == 'ros_overlay':
-            name += str(ros_overlay_counter)
-            ros_overlay_counter += 1
-        result[name] = r
+    result = _UniqueRequirements()
+    result.extend(requirements_list)
     return result.values()
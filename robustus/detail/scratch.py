@@ -0,0 +1,62 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+"""
+Scratch area native packages are unpacked and built in.
+
+Intermediate files of builds don't need to survive reboot, so by default they are kept in tmpfs
+if it has enough free space. This saves flash of robots and traffic of NFS mounted environments,
+only installed packages are written into the cache.
+"""
+
+import os
+
+
+TMPFS = '/dev/shm'
+# free space tmpfs must have to be used for builds by default
+MIN_TMPFS_SPACE = 4 * 1024 * 1024 * 1024
+MEMORY_FILESYSTEMS = ['tmpfs', 'ramfs']
+
+
+def free_space(path):
+    """
+    :return: bytes available to unprivileged user on filesystem of path
+    """
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+
+def tmpfs_dir():
+    """
+    :return: tmpfs directory to build in or None if there is none with enough free space
+    """
+    if os.path.isdir(TMPFS) and os.access(TMPFS, os.W_OK) and is_tmpfs(TMPFS) and \
+            free_space(TMPFS) >= MIN_TMPFS_SPACE:
+        return TMPFS
+    return None
+
+
+def is_tmpfs(path):
+    """
+    :return: True if path is on filesystem kept in memory
+    """
+    try:
+        with open('/proc/mounts') as f:
+            mounts = [line.split() for line in f]
+    except IOError:
+        return False
+    path = os.path.realpath(path)
+    filesystem = None
+    mount_point_length = -1
+    for mount in mounts:
+        if len(mount) < 3:
+            continue
+        # mount points with spaces are escaped in /proc/mounts
+        mount_point = mount[1].replace('\\040', ' ')
+        if (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')) and \
+                len(mount_point) > mount_point_length:
+            filesystem = mount[2]
+            mount_point_length = len(mount_point)
+    return filesystem in MEMORY_FILESYSTEMS
@@ -2,12 +2,15 @@ import logging
 import os
 import robustus
 import shutil
-from utility import execute_python_expr
+from probe import PythonProbe
 
 
 def check_module(test_env, python_imports, package_files, postinstall_script):
-    for imp in python_imports:
-        assert execute_python_expr(test_env, imp, postinstall_script) == 0
+    # all imports are checked by one interpreter
+    with PythonProbe(test_env, postinstall_script) as probe:
+        results = probe.query([('exec', imp) for imp in python_imports])
+    for imp, (error, _) in zip(python_imports, results):
+        assert error is None, '%s failed: %s' % (imp, error)
     for file in package_files:
         assert os.path.isfile(os.path.join(test_env, file))
 
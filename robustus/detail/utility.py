@@ -3,12 +3,18 @@
 # License under MIT license (see LICENSE file)
 # =============================================================================
 
+import errno
 import glob
+import hashlib
+import json
+import select
 import shutil
+import signal
 import subprocess
 import sys
 import tarfile
 import tempfile
+import threading
 import time
 import zipfile
 import logging
@@ -17,6 +23,10 @@ import os
 import sys
 import tty
 import termios
+import build_log
+import elf
+import probe
+from multiprocessing.pool import ThreadPool
 
 
 def add_source_ref(robustus, source_path):
@@ -48,6 +58,50 @@ def write_file(filename, mode, data):
     f.write(data)
 
 
+def read_json(filename, default=None):
+    """
+    read json data from a file
+    :param filename: name of a file to read from
+    :param default: value to return if file doesn't exist or is malformed
+    :return: decoded data
+    """
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return default
+
+
+def write_json(filename, data):
+    """
+    atomically write json data to a file, create parent directories if necessary
+    :param filename: name of a file to write into
+    :param data: json serializable data
+    :return: None
+    """
+    dirname = os.path.dirname(os.path.abspath(filename))
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    fd, tmp_filename = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.rename(tmp_filename, filename)
+
+
+def file_sha256(filename, block_size=131072):
+    """
+    Compute sha256 hex digest of a file.
+    """
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
 def cp(mask, dest_dir):
     """
     copy files satisfying mask as unix cp
@@ -119,13 +173,18 @@ def is_self_test():
 class OutputCapture(object):
     """
     Helper to capture output produced by command and print dots instead.
-    By default prints dots every ten seconds.
+    By default prints dots every ten seconds. Verbose output is printed as is.
+    Only a bounded tail of output is kept, unless capture is True or logfile is given.
+    Output is also written to build log if one is given.
     """
-    def __init__(self, verbose, secs_between_dots=10, logfile=None):
+    def __init__(self, verbose, secs_between_dots=10, logfile=None, capture=False, log=None):
         self.verbose = verbose
         self.secs_between_dots = secs_between_dots
-        if not verbose:
+        self.logfile = None
+        if capture or logfile is not None:
             self.logfile = tempfile.TemporaryFile() if logfile is None else logfile
+        self.tail = build_log.OutputTail()
+        self.log = log
         self.prev_time = time.time()
         self.dot_produced = False
         logging.getLogger().handlers[0].flush()
@@ -141,9 +200,13 @@ class OutputCapture(object):
         self.finish()
 
     def update(self, output=''):
-        if not self.verbose:
-            if len(output) > 0:
+        if len(output) > 0:
+            if self.logfile is not None:
                 self.logfile.write(output)
+            self.tail.write(output)
+            if self.log is not None:
+                self.log.write(output)
+        if not self.verbose:
             if time.time() - self.prev_time > self.secs_between_dots:
                 sys.stderr.write('.')
                 self.prev_time = time.time()
@@ -160,47 +223,121 @@ class OutputCapture(object):
             # Running shell command: ['cmd2']...
             if not is_self_test() and self.dot_produced:
                 sys.stderr.write('\n')
+        if self.logfile is not None:
             self.logfile.close()
 
     def read_captured_output(self):
+        if self.logfile is None:
+            return self.tail.getvalue()
         self.logfile.seek(0)
         return self.logfile.read()
 
+    def describe_output(self):
+        """
+        :return: tail of output to print on failure, saying where the whole output is
+        """
+        notes = []
+        if self.tail.truncated():
+            notes.append('last %d bytes' % self.tail.size)
+        if self.log is not None:
+            notes.append('full output in %s' % self.log.path)
+        return 'output%s:\n%s' % (' (%s)' % ', '.join(notes) if len(notes) > 0 else '', self.tail.getvalue())
+
+
+class DownloadError(IOError):
+    """
+    Downloaded file is truncated or doesn't match expected digest.
+    """
+    pass
+
 
-def download(url, filename=None, verbose=False):
+def download(url, filename=None, verbose=False, response=None, expected_digest=None, return_digest=False,
+             throttle=None, resume=False, timeout=None):
     """
-    download file from url, store it under name
+    download file from url, store it under name. sha256 digest is computed while file is
+    transferred, incomplete or corrupt downloads are never left under filename.
     :param url: url to download file
     :param filename: location to store downloaded file, if None try to extract filename from url
+    :param response: already opened url, if None url is opened by download
+    :param expected_digest: sha256 hex digest downloaded file must have, if None digest is not checked
+    :param return_digest: if True return (filename, sha256 hex digest)
+    :param throttle: function called with size of every block received, may sleep to limit bandwidth
+    :param resume: keep partially downloaded file if transfer fails and continue it next time
+    (using HTTP Range request if server supports it)
+    :param timeout: seconds to wait for server response
     :return: filename of downloaded file
+    :raise: DownloadError if file is truncated or its digest doesn't match
     """
     if filename is None:
         filename = url.split('/')[-1]
 
-    u = urllib2.urlopen(url)
-    file_size = int(u.info().getheaders("Content-Length")[0])
-    logging.info("Downloading: %s Bytes: %s" % (filename, file_size))
-
-    with open(filename, 'wb') as f, OutputCapture(verbose) as oc:
-        file_size_dl = 0
-        prev_percent = 0
-        block_sz = 131072
-        while True:
-            buffer = u.read(block_sz)
-            if not buffer:
-                break
-
-            file_size_dl += len(buffer)
-            f.write(buffer)
+    partial_filename = filename + '.part'
+    h = hashlib.sha256()
+    offset = 0
+    if response is None:
+        request = urllib2.Request(url)
+        if resume and os.path.isfile(partial_filename):
+            offset = os.path.getsize(partial_filename)
+            request.add_header('Range', 'bytes=%d-' % offset)
+        u = urllib2.urlopen(request, timeout=timeout) if timeout is not None else urllib2.urlopen(request)
+        if offset > 0 and u.getcode() != 206:
+            # server doesn't support ranges, start over
+            offset = 0
+    else:
+        u = response
+    content_length = u.info().getheaders("Content-Length")
+    file_size = int(content_length[0]) if len(content_length) > 0 else None
+    if offset > 0:
+        logging.info("Resuming download: %s from %d Bytes: %s" % (filename, offset, file_size))
+        with open(partial_filename, 'rb') as f:
+            for block in iter(lambda: f.read(131072), ''):
+                h.update(block)
+    else:
+        logging.info("Downloading: %s Bytes: %s" % (filename, file_size))
 
-            percent_downloaded = file_size_dl * 100. / file_size
-            if percent_downloaded > prev_percent + 1:
-                status = "%10d  [%3.2f%%]\r" % (file_size_dl, percent_downloaded)
-                oc.update(status,)
-                prev_percent = percent_downloaded
-            else:
+    try:
+        with open(partial_filename, 'ab' if offset > 0 else 'wb') as f, OutputCapture(verbose) as oc:
+            file_size_dl = 0
+            prev_percent = 0
+            # smaller blocks make throttled transfer smoother
+            block_sz = 131072 if throttle is None else 16384
+            while True:
+                buffer = u.read(block_sz)
+                if not buffer:
+                    break
+
+                file_size_dl += len(buffer)
+                f.write(buffer)
+                h.update(buffer)
+                if throttle is not None:
+                    throttle(len(buffer))
+
+                if file_size:
+                    percent_downloaded = file_size_dl * 100. / file_size
+                    if percent_downloaded > prev_percent + 1:
+                        status = "%10d  [%3.2f%%]\r" % (file_size_dl, percent_downloaded)
+                        oc.update(status,)
+                        prev_percent = percent_downloaded
+                        continue
                 oc.update()
 
+        if file_size is not None and file_size_dl != file_size:
+            raise DownloadError('%s is truncated: got %d of %d bytes' % (url, file_size_dl, file_size))
+        digest = h.hexdigest()
+        if expected_digest is not None and digest != expected_digest:
+            # corrupt file is not worth resuming
+            safe_remove(partial_filename)
+            raise DownloadError('%s is corrupt: sha256 %s, expected %s' % (url, digest, expected_digest))
+        os.rename(partial_filename, filename)
+    except:
+        if not resume:
+            safe_remove(partial_filename)
+        raise
+    finally:
+        u.close()
+
+    if return_digest:
+        return filename, digest
     return filename
 
 
@@ -239,38 +376,234 @@ def safe_remove(path):
         shutil.rmtree(path)
 
 
-def run_shell(command, verbose=False, return_output=False, **kwargs):
+class CommandTimeout(RuntimeError):
+    """
+    Shell command didn't finish in time and was killed together with all its children.
+    """
+    def __init__(self, command, timeout):
+        RuntimeError.__init__(self, 'Command %s timed out after %d seconds' % (command, timeout))
+        self.command = command
+        self.timeout = timeout
+
+
+# default timeout of every shell command and time.time() all commands must finish by, None if unlimited
+_step_timeout = None
+_deadline = None
+# process groups of commands being run
+_running_groups = set()
+_running_lock = threading.Lock()
+
+
+def set_shell_timeouts(step_timeout=None, overall_timeout=None):
+    """
+    Limit time of shell commands run by run_shell.
+    :param step_timeout: seconds every command may run, unless it is given other timeout
+    :param overall_timeout: seconds from now all commands have to finish in
+    :return: None
+    """
+    global _step_timeout, _deadline
+    _step_timeout = step_timeout
+    _deadline = time.time() + overall_timeout if overall_timeout is not None else None
+
+
+def _command_timeout(timeout):
     """
-    Run command logging accordingly to the verbosity level.
+    :return: seconds command may run given its own timeout and the overall deadline, None if unlimited
+    """
+    if timeout is None:
+        timeout = _step_timeout
+    if _deadline is not None:
+        left = max(_deadline - time.time(), 0)
+        timeout = left if timeout is None else min(timeout, left)
+    return timeout
+
+
+def kill_process_group(pgid, grace=5):
+    """
+    Terminate all processes of the group, kill those which don't exit in grace seconds.
+    """
+    try:
+        os.killpg(pgid, signal.SIGTERM)
+    except OSError:
+        return
+    end = time.time() + grace
+    while time.time() < end:
+        try:
+            os.killpg(pgid, 0)
+        except OSError:
+            return
+        time.sleep(0.1)
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def terminate_shell_commands():
+    """
+    Cancel all shell commands being run, e.g. by other threads when install is interrupted.
+    """
+    with _running_lock:
+        groups = list(_running_groups)
+    for pgid in groups:
+        kill_process_group(pgid)
+
+
+def _controlling_terminal():
+    """
+    :return: file descriptor of terminal robustus runs in foreground of, if called from the main
+    thread, None otherwise
+    """
+    if not isinstance(threading.current_thread(), threading._MainThread):
+        return None
+    try:
+        fd = sys.stdin.fileno()
+        if os.isatty(fd) and os.tcgetpgrp(fd) == os.getpgrp():
+            return fd
+    except (AttributeError, ValueError, OSError):
+        pass
+    return None
+
+
+def _set_foreground(terminal):
+    """
+    Make process group of the caller foreground process group of the terminal.
+    """
+    # process not in foreground gets SIGTTOU when changing it
+    handler = signal.signal(signal.SIGTTOU, signal.SIG_IGN)
+    try:
+        os.tcsetpgrp(terminal, os.getpgrp())
+    finally:
+        signal.signal(signal.SIGTTOU, handler)
+
+
+def _new_process_group(terminal):
+    """
+    :return: function to run in child process before command, putting the command into its own
+    process group, which gets the terminal (so that prompts and Ctrl-C go to the command)
+    """
+    def preexec():
+        os.setpgrp()
+        if terminal is not None:
+            _set_foreground(terminal)
+    return preexec
+
+
+def _wait_for_output(p, output, oc, timeout=None):
+    """
+    Pass output of process to OutputCapture as it is produced, until the process exits.
+    Sleeps in select between chunks of output and wakes up otherwise only to print a dot.
+    Process group of the command is killed if it doesn't exit in time or waiting is interrupted.
+    :param p: subprocess.Popen started in its own process group
+    :param output: file descriptor of pipe process writes to, None if output isn't captured
+    :param oc: OutputCapture
+    :param timeout: seconds to wait for the process, None to wait until it exits
+    :return: True if process exited, False if it was killed on timeout
+    """
+    # pipe closed by waiter thread once process exits, wakes select even if output is not captured
+    # or is held open by children left running in background
+    exit_r, exit_w = os.pipe()
+
+    def wait():
+        try:
+            p.wait()
+        finally:
+            os.close(exit_w)
+
+    waiter = threading.Thread(target=wait)
+    waiter.daemon = True
+    waiter.start()
+    fds = [exit_r] + ([output] if output is not None else [])
+    end = time.time() + timeout if timeout is not None else None
+    exited = False
+    try:
+        while not exited:
+            select_timeout = None if oc.verbose else oc.secs_between_dots
+            if end is not None:
+                left = end - time.time()
+                if left <= 0:
+                    break
+                select_timeout = left if select_timeout is None else min(select_timeout, left)
+            try:
+                ready = select.select(fds, [], [], select_timeout)[0]
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if output in ready:
+                data = os.read(output, 65536)
+                if len(data) > 0:
+                    oc.update(data)
+                else:
+                    fds.remove(output)
+            exited = exit_r in ready
+            if len(ready) == 0:
+                oc.update()
+        # read what is left in the pipe, but don't wait for background children
+        while exited and output in fds and len(select.select([output], [], [], 0)[0]) > 0:
+            data = os.read(output, 65536)
+            if len(data) == 0:
+                break
+            oc.update(data)
+    finally:
+        if not exited:
+            kill_process_group(p.pid)
+        waiter.join()
+        os.close(exit_r)
+    return exited
+
+
+def run_shell(command, verbose=False, return_output=False, timeout=None, **kwargs):
+    """
+    Run command logging accordingly to the verbosity level. Command runs in its own process group,
+    which is killed if command doesn't finish in timeout seconds (default set by set_shell_timeouts)
+    or robustus is interrupted.
+    :raise: CommandTimeout if command was killed on timeout
     """
     logging.info('Running shell command: %s' % command)
-    # some problem using temporary files to capture output
-    with OutputCapture(verbose) as oc, tempfile.TemporaryFile('w+') as stdout:
-        # there is problem with PIPE in case of large output, so use logfile
-        if 'stdout' in kwargs:
-            stdout.close()
-            stdout = kwargs['stdout']
-        else:
-            kwargs['stdout'] = stdout
-        readable = 'r' in stdout.mode or '+' in stdout.mode
-        if 'stderr' not in kwargs:
-            # do not use subprocess.STDOUT
-            # http://stackoverflow.com/questions/11495783/redirect-subprocess-stderr-to-stdout
+    timeout = _command_timeout(timeout)
+    log = build_log.current()
+    if log is not None:
+        log.write('$ %s\n' % (command if isinstance(command, basestring) else ' '.join(command)))
+    with OutputCapture(verbose, capture=return_output, log=log) as oc:
+        stdout = kwargs.get('stdout')
+        if stdout is None:
+            kwargs['stdout'] = subprocess.PIPE
+            if 'stderr' not in kwargs:
+                kwargs['stderr'] = subprocess.STDOUT
+        elif 'stderr' not in kwargs:
             kwargs['stderr'] = stdout
-        p = subprocess.Popen(command, **kwargs)
-        s = 0
-        while p.poll() is None:
-            # writing to stdout moves cursor further, so need to seek back to read written data
-            stdout.seek(s)
-            oc.update(stdout.readline() if readable else '')
-            s = stdout.tell()
-        # read rest
-        stdout.seek(s)
-        oc.update(stdout.read() if readable else '')
+        # output written to file given by caller is passed to OutputCapture after command finishes
+        readable = stdout is not None and hasattr(stdout, 'mode') and ('r' in stdout.mode or '+' in stdout.mode)
+        start = stdout.tell() if readable else 0
+        terminal = _controlling_terminal()
+        p = subprocess.Popen(command, preexec_fn=_new_process_group(terminal), **kwargs)
+        with _running_lock:
+            _running_groups.add(p.pid)
+        try:
+            exited = _wait_for_output(p, p.stdout.fileno() if stdout is None else None, oc, timeout)
+        finally:
+            with _running_lock:
+                _running_groups.discard(p.pid)
+            if terminal is not None:
+                _set_foreground(terminal)
+            if stdout is None:
+                p.stdout.close()
+        if readable:
+            stdout.seek(start)
+            oc.update(stdout.read())
+
+        if not exited:
+            logging.error('Timed out with %s' % oc.describe_output())
+            raise CommandTimeout(command, timeout)
+
+        # Ctrl-C went to the command in foreground, stop robustus too
+        if terminal is not None and p.returncode in (-signal.SIGINT, 128 + signal.SIGINT):
+            raise KeyboardInterrupt()
 
         # print log in case of failure
         if not oc.verbose and p.returncode != 0:
-            logging.error('Failed with output:\n%s' % oc.read_captured_output())
+            logging.error('Failed with %s' % oc.describe_output())
 
         if return_output:
             return p.returncode, oc.read_captured_output()
@@ -287,24 +620,6 @@ def check_run_shell(command, verbose=False, return_output=False, **kwargs):
         raise subprocess.CalledProcessError(ret, command)
 
 
-def execute_python_expr(env, expr, shell_script=None):
-    """
-    Execute expression using env python interpreter.
-    :param env: path to python environment
-    :param expr: python expression
-    :return: return code
-    """
-    python_executable = os.path.join(env, 'bin/python')
-    if not os.path.isfile(python_executable):
-        python_executable = os.path.join(env, 'bin/python27')
-    if not os.path.isfile(python_executable):
-        raise RuntimeError('can\'t find python executable in %s' % env)
-    cmd = python_executable + ' -c "' + expr + '"'
-    if shell_script is not None:
-        cmd = shell_script + ' && ' + cmd
-    return subprocess.call(cmd, shell=True)
-
-
 def check_module_available(env, module):
     """
     check if speicified module is available to specified python environment.
@@ -312,7 +627,9 @@ def check_module_available(env, module):
     :param module: module name
     :return: True if module available, False otherwise
     """
-    return execute_python_expr(env, 'import %s' % module) == 0
+    # modules are imported by env interpreter kept running for the whole robustus run
+    error, _ = probe.probe(env).query([('import', module)])[0]
+    return error is None
 
 
 def fix_rpath(robustus, env, executable, rpath):
@@ -320,9 +637,6 @@ def fix_rpath(robustus, env, executable, rpath):
     Add rpath to list of rpaths of given executable. For osx also add @rpath/
     prefix to dependent library names (absolute paths are not prefixed).
     """
-    # Install here to avoid circular dependency
-    from robustus.detail.requirement import RequirementSpecifier
-
     if sys.platform.startswith('darwin'):
         # extract list o dependent library names
         otool_output = subprocess.check_output(['otool', '-L', executable])
@@ -336,19 +650,71 @@ def fix_rpath(robustus, env, executable, rpath):
             pass
         return run_shell('install_name_tool -add_rpath "%s" "%s"' % (rpath, executable), shell=True)
     else:
-        patchelf_executable = os.path.join(env, 'bin/patchelf')
-        if not os.path.isfile(patchelf_executable):
-            logging.info('patchelf is not installed. Installing')
-            robustus.install_requirement(RequirementSpecifier(name = 'patchelf',
-                                                              version = '6fb4cdb'),
-                                         ignore_index = False, tag = None)
-
-        old_rpath = subprocess.check_output([patchelf_executable, '--print-rpath', executable])
-        if len(old_rpath) > 1:
-            new_rpath = old_rpath[:-1] + ':' + rpath
-        else:
-            new_rpath = rpath
-        return run_shell('%s --set-rpath %s %s' % (patchelf_executable, new_rpath, executable), shell=True)
+        return fix_rpaths(robustus, env, [executable], rpath)
+
+
+def _add_rpath_in_place(executable, rpath, grow):
+    """
+    :return: True if rpath was added without patchelf
+    """
+    try:
+        return elf.add_rpath(executable, rpath, grow)
+    except elf.ElfError as e:
+        logging.info('Can\'t edit rpath of %s in place: %s' % (executable, e))
+        return False
+
+
+def _patchelf_add_rpath(robustus, env, executable, rpath):
+    # Install here to avoid circular dependency
+    from robustus.detail.requirement import RequirementSpecifier
+
+    patchelf_executable = os.path.join(env, 'bin/patchelf')
+    if not os.path.isfile(patchelf_executable):
+        logging.info('patchelf is not installed. Installing')
+        robustus.install_requirement(RequirementSpecifier(name = 'patchelf',
+                                                          version = '6fb4cdb'),
+                                     ignore_index = False, tag = None)
+
+    old_rpath = subprocess.check_output([patchelf_executable, '--print-rpath', executable])
+    if len(old_rpath) > 1:
+        new_rpath = old_rpath[:-1] + ':' + rpath
+    else:
+        new_rpath = rpath
+    return run_shell('%s --set-rpath %s %s' % (patchelf_executable, new_rpath, executable), shell=True)
+
+
+def fix_rpaths(robustus, env, executables, rpath, jobs=None, grow=False):
+    """
+    Add rpath to list of rpaths of every given executable or library. On linux files which rpath
+    already contains the directory are skipped and rpath strings are edited in place by robustus
+    if the new one fits, patchelf is used for files without rpath or with rpath too short to hold
+    the new one.
+    :param jobs: number of files edited in parallel, 1 to edit them one by one, None for number of cpus
+    :param grow: grow string tables of shared libraries by robustus instead of patchelf
+    :return: 0 if all rpaths were fixed, return code of the first failed fix otherwise
+    """
+    if sys.platform.startswith('darwin'):
+        ret_codes = [fix_rpath(robustus, env, executable, rpath) for executable in executables]
+        return ([r for r in ret_codes if r != 0] + [0])[0]
+
+    executables = list(executables)
+    if jobs != 1 and len(executables) > 1:
+        pool = ThreadPool(jobs)
+        try:
+            done = pool.map(lambda executable: _add_rpath_in_place(executable, rpath, grow), executables)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        done = [_add_rpath_in_place(executable, rpath, grow) for executable in executables]
+
+    ret_code = 0
+    for executable, in_place in zip(executables, done):
+        if not in_place:
+            r = _patchelf_add_rpath(robustus, env, executable, rpath)
+            if ret_code == 0:
+                ret_code = r
+    return ret_code
 
 
 def get_single_char():
@@ -5,21 +5,40 @@
 
 import argparse
 import collections
-import distutils.core
+import contextlib
 import fnmatch
+import getpass
 import glob
+import hashlib
 import importlib
 import logging
-import multiprocessing
 import os
 import platform
 import shutil
+import socket
 import subprocess
 import sys
 import tempfile
-from detail import Requirement, RequirementException, read_requirement_file
+from detail import Requirement, RequirementSpecifier, RequirementException
 from detail.requirement import remove_duplicate_requirements, expand_requirements_specifiers, generate_dependency_list
-from detail.utility import ln, run_shell, download, safe_remove, unpack, get_single_char
+from detail.requirement import git_link_and_ref
+from detail.git_accessor import GitAccessor, OfflineGitAccessor
+from detail.dependency_graph import DependencyGraph
+from detail.probe import probe
+from detail.recipe import Recipe, Archive, Git, CMake, CopyTree
+from detail.utility import ln, run_shell, download, safe_remove, get_single_char, file_sha256, DownloadError
+from detail.utility import write_file, set_shell_timeouts, terminate_shell_commands, CommandTimeout
+from detail.build_log import build_log
+from detail.compiler_cache import CompilerCache, DEFAULT_CACHE_SIZE
+from detail.jobserver import JobServer
+from detail.scratch import tmpfs_dir
+from detail.remote_index import RemoteIndex, artifact_info, normalize_name
+from detail.cache_catalog import CacheCatalog
+from detail.governor import Governor, parse_host_limits
+from detail.pypi_proxy import PypiProxy, DEFAULT_INDEX_URL
+from detail.fetcher import Fetcher
+from detail.mirror_health import MirrorHealth, MirrorsFailed, is_missing_error
+from detail.negative_cache import NegativeCache
 import urllib2
 # for doctests
 import detail
@@ -36,6 +55,9 @@ class RobustusException(Exception):
 
 class Robustus(object):
     settings_file_path = '.robustus'
+    graph_file_path = '.robustus_graph.json'
+    build_logs_path = '.robustus_logs'
+    build_dirs_path = '.robustus_builds'
     cached_requirements_file_path = 'cached_requirements.txt'
     default_settings = {
         'cache': 'wheelhouse'
@@ -82,6 +104,24 @@ class Robustus(object):
         self.cache = os.path.join(self.env, self.settings['cache'])
         if not os.path.isdir(self.cache):
             os.mkdir(self.cache)
+        # robustus specific information about the cache
+        self.cache_info_dir = os.path.join(self.cache, '.robustus')
+        self.mirror_health = MirrorHealth(os.path.join(self.cache_info_dir, 'mirror_health.json'))
+        self.remote_index = RemoteIndex(os.path.join(self.cache_info_dir, 'remote_index'),
+                                        health=self.mirror_health)
+        self.negative_cache = NegativeCache(os.path.join(self.cache_info_dir, 'negative_cache.json'))
+        self.cache_catalog = CacheCatalog(self.cache, os.path.join(self.cache_info_dir, 'catalog.json'))
+        self.governor = Governor(bwlimit=self.settings['bwlimit'],
+                                 host_bwlimits=self.settings['host_bwlimits'],
+                                 max_transfers=self.settings['max_transfers'],
+                                 background=self.settings['background'])
+        self.pypi_proxy = None
+        self.fetcher = Fetcher(self)
+        self.compiler_cache = CompilerCache(self)
+        self.jobserver = JobServer(self.settings.get('jobs'))
+        self.build_root = self._build_root()
+        self.dependency_graph = None
+        self._installing = False
 
         # remove bad formatted rob files with '.' in version instead of '_'
         for rob_file in glob.iglob('%s/*.rob' % self.cache):
@@ -107,6 +147,26 @@ class Robustus(object):
             settings['cache'] = args.cache
         settings['verbosity'] = args.verbosity
         settings['debug'] = args.debug
+        settings['bwlimit'] = args.bwlimit
+        try:
+            settings['host_bwlimits'] = parse_host_limits(args.host_bwlimit)
+        except ValueError as e:
+            raise RobustusException(str(e))
+        settings['max_transfers'] = args.max_transfers
+        settings['background'] = args.background
+        settings['offline'] = args.offline
+        settings['step_timeout'] = args.step_timeout
+        settings['timeout'] = args.timeout
+        if args.keep_builds is not None:
+            settings['keep_builds'] = args.keep_builds
+        settings['ninja'] = not args.no_ninja
+        settings['jobs'] = args.jobs
+        if args.scratch is not None:
+            settings['scratch'] = os.path.abspath(args.scratch)
+        settings['compiler_cache'] = not args.no_compiler_cache
+        if args.compiler_cache_size is not None:
+            settings['compiler_cache_size'] = args.compiler_cache_size
+        set_shell_timeouts(settings['step_timeout'], settings['timeout'])
 
         # Set logging volume for debugging
         if settings['debug']:
@@ -217,38 +277,139 @@ class Robustus(object):
         False otherwise.
         """
         logging.info('Attempting to install package from remote wheel')
-        for find_link in self.settings['find_links']:
-            find_links_url = find_link + '/python-wheels/index.html',  # TEMPORARY.
+        wheel_artifact = 'wheel:' + requirement_specifier.freeze()
+        for find_link in self.find_links():
+            if self.negative_cache.is_missing(find_link, wheel_artifact):
+                logging.info('%s is known to have no wheel for %s'
+                             % (find_link, requirement_specifier.freeze()))
+                continue
+            manifest = self.remote_index.manifest(find_link)
+            if manifest is not None and manifest.find_wheel(requirement_specifier.name,
+                                                            requirement_specifier.version) is None:
+                logging.info('Remote index of %s has no wheel for %s'
+                             % (find_link, requirement_specifier.freeze()))
+                continue
+            find_links_url = find_link + '/python-wheels/index.html'  # TEMPORARY.
+            if self.pypi_proxy is not None:
+                # proxy stores wheels of the requirement and its dependencies right in the wheelhouse
+                digests = None
+                if manifest is not None:
+                    digests = dict((a['filename'], a['sha256']) for a in manifest.artifacts if a.get('sha256'))
+                return_code = run_shell([self.pip_executable,
+                                         'install',
+                                         '--no-index',
+                                         '--use-wheel',
+                                         '--find-links=%s' % self.pypi_proxy.find_links_url(find_links_url, digests),
+                                         '--trusted-host=127.0.0.1',
+                                         requirement_specifier.freeze()],
+                                        verbose=self.settings['verbosity'] >= 2)
+                if return_code == 0:
+                    return True
+                logging.info('pip failed to install requirement %s from remote wheels cache %s.'
+                             % (requirement_specifier.freeze(), find_links_url))
+                if self._remote_wheel_missing(find_link, find_links_url, requirement_specifier):
+                    self.negative_cache.add(find_link, wheel_artifact)
+                continue
+
+            # Wheels of the requirement (and those of dependencies) are downloaded into a temporary folder,
+            # verified, moved into the local Robustus cache and installed from there. Regarding the need for
+            # this see "Wheels for Dependencies" "http://lucumr.pocoo.org/2014/1/27/python-on-wheels/".
             dtemp_path = tempfile.mkdtemp()
-            return_code = run_shell([self.pip_executable,
-                                     'install',
-                                     '--download-cache=%s' % dtemp_path,
-                                     '--no-index',
-                                     '--use-wheel',
-                                     '--find-links=%s' % find_links_url,
-                                     '--trusted-host=%s' % find_link.split("http://")[1],
-                                     requirement_specifier.freeze()],
-                                    verbose=self.settings['verbosity'] >= 2)
-            if return_code == 0:
-                # The following downloads the wheels of the requirment (and those of
-                # dependencies) into a pip download cache and moves (renames) the downloaded
-                # wheels into the local Robustus cache.  Regarding the need for this see "Wheels
-                # for Dependencies" "http://lucumr.pocoo.org/2014/1/27/python-on-wheels/".
-                for file_path in glob.glob(os.path.join(dtemp_path, 'http*.whl')):
-                    if os.path.isfile(file_path):
+            try:
+                return_code = run_shell([self.pip_executable,
+                                         'install',
+                                         '--download=%s' % dtemp_path,
+                                         '--no-index',
+                                         '--use-wheel',
+                                         '--find-links=%s' % find_links_url,
+                                         '--trusted-host=%s' % find_link.split("http://")[1],
+                                         requirement_specifier.freeze()],
+                                        verbose=self.settings['verbosity'] >= 2)
+                if return_code == 0:
+                    wheels = glob.glob(os.path.join(dtemp_path, '*.whl'))
+                    # corrupt wheel must not get into the environment nor into the cache
+                    digests = [self._verify_remote_wheel(file_path, manifest) for file_path in wheels]
+                    for file_path, digest in zip(wheels, digests):
                         file_name = os.path.basename(file_path)
-                        file_name_new = file_name.rpartition('%2F')[-1]
-                        file_path_new = os.path.join(self.cache, file_name_new)
+                        file_path_new = os.path.join(self.cache, file_name)
                         shutil.move(file_path, file_path_new)  # NOTE: Allow overwrites.
+                        self.cache_catalog.record(file_path_new, digest, find_link + '/python-wheels/' + file_name)
+                    return_code = run_shell([self.pip_executable,
+                                             'install',
+                                             '--no-index',
+                                             '--use-wheel',
+                                             '--find-links=%s' % self.cache,
+                                             requirement_specifier.freeze()],
+                                            verbose=self.settings['verbosity'] >= 2)
+                    if return_code == 0:
+                        return True
+            finally:
                 safe_remove(dtemp_path)
-                return True
-            else:
-                logging.info('pip failed to install requirement %s from remote wheels cache %s.'
-                             % (requirement_specifier.freeze(), find_links_url))
-                safe_remove(dtemp_path)
+            logging.info('pip failed to install requirement %s from remote wheels cache %s.'
+                         % (requirement_specifier.freeze(), find_links_url))
+            if self._remote_wheel_missing(find_link, find_links_url, requirement_specifier):
+                self.negative_cache.add(find_link, wheel_artifact)
 
         return False
 
+    def _remote_wheel_missing(self, find_link, find_links_url, requirement_specifier):
+        """
+        Find out if pip failed because find_link has no wheel of requirement. Pip fails as well on timeouts,
+        unavailable mirror, missing dependency or broken build, such failures must not hide the wheel.
+        :return: True if wheels page of find_link doesn't exist or doesn't link any wheel of requirement
+        """
+        try:
+            page = self.mirror_health.open_url(find_link, find_links_url, self.settings['mirror_timeout']).read()
+        except urllib2.URLError as e:
+            return is_missing_error(find_links_url, e)
+        except (socket.error, IOError):
+            return False
+        for file_name in re.findall(r'[^/"\'<>\s]+\.whl', page):
+            info = artifact_info(urllib2.unquote(file_name).rpartition('/')[-1])
+            if info is not None and normalize_name(info[1]) == normalize_name(requirement_specifier.name) \
+                    and (requirement_specifier.version is None or info[2] == requirement_specifier.version):
+                return False
+        return True
+
+    def _verify_remote_wheel(self, file_path, manifest):
+        """
+        Check wheel downloaded by pip against digest published in remote index.
+        Pip doesn't let us hash the transfer, so the wheel is hashed once before it's installed.
+        :return: sha256 of wheel
+        """
+        digest = file_sha256(file_path)
+        if manifest is None:
+            return digest
+        file_name = os.path.basename(file_path)
+        entry = manifest.find_file(file_name)
+        if entry is not None and entry.get('sha256') is not None and digest != entry['sha256']:
+            raise RequirementException('Remote wheel %s is corrupt: sha256 %s, expected %s'
+                                       % (file_name, digest, entry['sha256']))
+        return digest
+
+    def _cached_wheels(self, requirement_specifier):
+        """
+        :return: paths to wheels of requirement in robustus cache
+        """
+        wheels = []
+        for path in glob.iglob(os.path.join(self.cache, '*.whl')):
+            info = artifact_info(os.path.basename(path))
+            if info is not None and normalize_name(info[1]) == normalize_name(requirement_specifier.name) \
+                    and (requirement_specifier.version is None or info[2] == requirement_specifier.version):
+                wheels.append(path)
+        return wheels
+
+    def _check_cached_wheels(self, requirement_specifier):
+        """
+        Make sure downloaded wheels of requirement are not corrupted since they entered the cache.
+        Corrupt wheels are removed, so that next attempt fetches them again.
+        """
+        for path in self._cached_wheels(requirement_specifier):
+            if not self.cache_catalog.is_intact(path):
+                self.cache_catalog.forget(path)
+                os.remove(path)
+                raise RequirementException('Cached wheel %s is corrupt' % os.path.basename(path))
+
     def install_through_wheeling(self, requirement_specifier, rob_file, ignore_index):
         """
         Check if package cache already contains package of specified version, if so install it.
@@ -260,12 +421,20 @@ class Robustus(object):
         """
         # If wheelhouse doesn't contain necessary requirement attempt to install from remote wheel archive or make a wheel.
         installed = False
-        if self.find_satisfactory_requirement(requirement_specifier) is None:
+        if self.find_satisfactory_requirement(requirement_specifier) is not None:
+            self._check_cached_wheels(requirement_specifier)
+        else:
             # Pip does not download the wheels of dependencies unless it installs.
             installed = False
-            if not self.settings['no_remote_cache']:
+            if self.settings['offline']:
+                if len(self._cached_wheels(requirement_specifier)) == 0:
+                    raise RequirementException('%s is not cached and can\'t be downloaded in offline mode'
+                                               % requirement_specifier.freeze())
+                # wheel is in the cache, but package wasn't registered there
+                self._check_cached_wheels(requirement_specifier)
+            elif not self.settings['no_remote_cache']:
                 installed = self.install_satisfactory_requirement_from_remote(requirement_specifier)
-            if not installed:
+            if not installed and not self.settings['offline']:
                 logging.info('Wheel not found, downloading package')
                 cmd = [self.pip_executable, 'install']
                 if len(self.settings['allow_external']) > 0:
@@ -274,7 +443,8 @@ class Robustus(object):
                     cmd.append('--allow-all-external')
                 if len(self.settings['allow_unverified']) > 0:
                     cmd += ['--allow-unverified'] + self.settings['allow_unverified']
-                cmd += ['--download', self.cache, requirement_specifier.freeze()]
+                # files fetched through package index proxy are already in the cache
+                cmd += ['--exists-action', 'i', '--download', self.cache, requirement_specifier.freeze()]
                 return_code = run_shell(cmd, verbose=self.settings['verbosity'] >= 2)
                 if return_code != 0:
                     raise RequirementException('pip failed to download requirement %s' % requirement_specifier.freeze())
@@ -290,7 +460,11 @@ class Robustus(object):
                 # we probably sometimes will want to see build log
                 for i in xrange(self.settings['verbosity']):
                     wheel_cmd.append('-v')
-                return_code = run_shell(wheel_cmd, verbose=self.settings['verbosity'] >= 1)
+                # C extensions are compiled through compiler cache if it's installed, most packages are pure python
+                with self.compiler_cache.build(requirement_specifier.name, self.jobserver.environ(),
+                                               install=False) as env:
+                    with self.jobserver.slots():
+                        return_code = run_shell(wheel_cmd, verbose=self.settings['verbosity'] >= 1, env=env)
                 if return_code != 0:
                     raise RequirementException('pip failed to build wheel for requirement %s'
                                                % requirement_specifier.freeze())
@@ -317,13 +491,63 @@ class Robustus(object):
         ret_code = run_shell(command, shell=True, verbose=self.settings['verbosity'] >= 1)
         return ret_code
 
+    def _install_editable_offline(self, requirement_specifier):
+        """
+        Install editable git requirement from its working copy in <env>/src, cloned from local mirror if necessary.
+        :return: pip return code
+        """
+        link, ref = git_link_and_ref(requirement_specifier)
+        path = os.path.join(self.env, 'src', requirement_specifier.name)
+        verbose = self.settings['verbosity'] >= 1
+        if not os.path.isdir(path):
+            try:
+                self.fetcher.clone(link, path)
+            except RequirementException as exc:
+                logging.warn(str(exc))
+                return 1
+        if ref is not None:
+            if run_shell(['git', 'checkout', ref], cwd=path, verbose=verbose) != 0:
+                if not self.settings['ignore_missing_refs']:
+                    return 1
+                logging.info('Tag or branch doesnt exist for this package, using default')
+        return run_shell([self.pip_executable, 'install', '-e', path], verbose=verbose)
+
+    def _missing_offline(self, requirements):
+        """
+        :return: list of requirements which can't be installed without network
+        """
+        missing = []
+        for r in requirements:
+            if r.path is not None:
+                continue
+            if r.url is not None:
+                if r.editable and r.url.geturl().startswith('git+'):
+                    link, _ = git_link_and_ref(r)
+                    if os.path.isdir(os.path.join(self.env, 'src', r.name)) or self.fetcher.git_mirrors.has(link):
+                        continue
+                elif r.url.scheme == 'file':
+                    continue
+            elif self.find_satisfactory_requirement(r) is not None or len(self._cached_wheels(r)) > 0:
+                continue
+            missing.append(r.freeze())
+        return missing
+
+    @staticmethod
+    def _build_log_name(requirement_specifier):
+        if requirement_specifier.name is not None:
+            return os.path.splitext(requirement_specifier.rob_filename())[0]
+        return 'url__' + hashlib.sha1(requirement_specifier.freeze()).hexdigest()[:10]
+
     def install_requirement(self, requirement_specifier, ignore_index, tag):
         attempts = self.settings['attempts']
         logging.info('='*30)  # Nicely separate installation of different packages in console output
-        for a in range(attempts):
-            result = self._install_requirement_attempt(requirement_specifier, ignore_index, tag, a)
-            if result:
-                return
+        # output of all attempts is kept in the package build log
+        with build_log(os.path.join(self.env, Robustus.build_logs_path),
+                       Robustus._build_log_name(requirement_specifier)):
+            for a in range(attempts):
+                result = self._install_requirement_attempt(requirement_specifier, ignore_index, tag, a)
+                if result:
+                    return
 
     def _install_requirement_attempt(self, requirement_specifier, ignore_index, tag, attempt_number):
         if attempt_number == 0:
@@ -357,7 +581,10 @@ class Robustus(object):
                 original_url = requirement_specifier.url
                 requirement_specifier.override_branch(tag)
 
-            ret_code = self._pip_install_requirement(requirement_specifier)
+            if self.settings['offline'] and requirement_specifier.url is not None and requirement_specifier.editable:
+                ret_code = self._install_editable_offline(requirement_specifier)
+            else:
+                ret_code = self._pip_install_requirement(requirement_specifier)
             
             # special case for path-based requirements - we need to call 'git checkout'
             if ret_code == 0 and tag and requirement_specifier.editable and requirement_specifier.path is not None:
@@ -380,9 +607,11 @@ class Robustus(object):
                     
                     See http://stackoverflow.com/questions/945654/git-checkout-on-a-remote-branch-does-not-work
                     '''
-                    os.system('git fetch origin {0}:{0}'.format(tag))
+                    run_shell('git fetch origin {0}:{0}'.format(tag), shell=True,
+                              verbose=self.settings['verbosity'] >= 1)
 
-                local_checkout_code = os.system('git checkout {0}'.format(tag))
+                local_checkout_code = run_shell('git checkout {0}'.format(tag), shell=True,
+                                                verbose=self.settings['verbosity'] >= 1)
                 os.chdir(cwd)
                 if local_checkout_code!=0:
                     if self.settings['ignore_missing_refs']:
@@ -390,7 +619,7 @@ class Robustus(object):
                     else:
                         return False
                 
-            if ret_code != 0 and tag and self.settings['ignore_missing_refs']:
+            if ret_code != 0 and tag and self.settings['ignore_missing_refs'] and not self.settings['offline']:
                 logging.info('Tag or branch doesnt exist for this package, using default')
                 requirement_specifier.url = original_url
                 ret_code = self._pip_install_requirement(requirement_specifier)
@@ -497,6 +726,11 @@ class Robustus(object):
         self.settings['allow_external'] = args.allow_external
         self.settings['allow_all_external'] = args.allow_all_external
         self.settings['allow_unverified'] = args.allow_unverified
+        self.settings['race_mirrors'] = args.race_mirrors
+        self.settings['mirror_timeout'] = args.mirror_timeout
+        self.negative_cache.ttl = args.negative_cache_ttl * 60 * 60
+        self.settings['index_url'] = args.index_url
+        self.settings['pypi_proxy'] = not args.no_pypi_proxy
 
         tag = args.tag
         if tag is not None:
@@ -509,22 +743,31 @@ class Robustus(object):
         specifiers = args.packages
         if args.editable is not None:
             specifiers += ['-e ' + r for r in args.editable]
-        # NOTE: If "tag=tag" is not passed to "expand_requirements_specifiers", then the
-        # "requirements.txt" files expanded will be those on the default/"master" branch
-        # (i.e., default kwarg "tag=None") not the branch/tag indicated by value of "tag".
-        visited_sites = collections.OrderedDict()
-        requirements = expand_requirements_specifiers(specifiers, tag=tag, visited_sites=visited_sites,
-                                                      ignore_missing_refs=self.settings['ignore_missing_refs'])
-        if args.requirement is not None:
-            for requirement_file in args.requirement:
-                requirements += read_requirement_file(requirement_file, tag,
-                                                      ignore_missing_refs = self.settings['ignore_missing_refs'],
-                                                      visited_sites=visited_sites)
+        git_accessor = self._git_accessor()
+        requirements, visited_sites = self._resolve_requirements(specifiers, args.requirement, tag, git_accessor,
+                                                                 args.constraint)
 
         if len(requirements) == 0:
             raise RobustusException('You must give at least one requirement to install (see "robustus install -h")')
 
-        requirements = remove_duplicate_requirements(requirements)
+        if not self._installing:
+            # keep graph of top level install for 'robustus why' and 'robustus graph'
+            write_file(os.path.join(self.env, Robustus.graph_file_path), 'w', self.dependency_graph.to_json())
+
+            # report conflicting pins before anything is downloaded or built
+            conflicts = self.dependency_graph.describe_conflicts()
+            if len(conflicts) > 0:
+                if args.fail_on_conflict:
+                    raise RobustusException('Conflicting requirements:\n' + conflicts)
+                logging.warn('Conflicting requirements, only the ones marked [to be installed] are installed:\n' +
+                             conflicts)
+
+        if self.settings['offline']:
+            # fail before installing anything rather than in the middle of the install
+            missing = git_accessor.missing + self._missing_offline(requirements)
+            if len(missing) > 0:
+                raise RobustusException('Following requirements are not available offline:\n    ' +
+                                        '\n    '.join(missing))
 
         logging.info('Here are all packages cached in robustus:\n' +
                      '\n'.join([r.freeze() for r in self.cached_packages]) + '\n')
@@ -542,8 +785,14 @@ class Robustus(object):
             os.environ['CPPFLAGS'] = '-Qunused-arguments'
         
         # install
-        for requirement_specifier in requirements:
-            self.install_requirement(requirement_specifier, args.no_index, tag)
+        nested = self._installing
+        self._installing = True
+        try:
+            with self._package_index():
+                for requirement_specifier in requirements:
+                    self.install_requirement(requirement_specifier, args.no_index, tag)
+        finally:
+            self._installing = nested
 
         # Display the branch of the currently installed repos.
         src_dirs = [os.path.join(os.getcwd(), 'venv', 'src', r.base_name().replace('_', '-')) for r in requirements if r.editable]
@@ -582,6 +831,149 @@ class Robustus(object):
         os.chdir(old_dir)
         logging.info('='*56)
 
+    def _git_accessor(self):
+        if self.settings['offline']:
+            return OfflineGitAccessor(self.fetcher.git_mirrors, os.path.join(self.env, 'src'))
+        return GitAccessor(self.fetcher.git_mirrors)
+
+    def _resolve_requirements(self, specifiers, requirement_files, tag, git_accessor, constraint_files=None):
+        """
+        Expand requirements recursively through included requirements files and requirements files
+        of editable packages, in one pass. Graph of requirements inclusion built during resolution
+        is kept in self.dependency_graph.
+        :param specifiers: requirements given on command line
+        :param requirement_files: requirements files given on command line or None
+        :param constraint_files: constraints files given on command line or None
+        :return: (deduplicated list of requirements, visited_sites)
+        """
+        # NOTE: If "tag=tag" is not passed to "expand_requirements_specifiers", then the
+        # "requirements.txt" files expanded will be those on the default/"master" branch
+        # (i.e., default kwarg "tag=None") not the branch/tag indicated by value of "tag".
+        visited_sites = collections.OrderedDict()
+        constraints = collections.OrderedDict()
+        includes = ['-r ' + f for f in requirement_files or []] + ['-c ' + f for f in constraint_files or []]
+        requirements = expand_requirements_specifiers(specifiers + includes, git_accessor, tag=tag,
+                                                      visited_sites=visited_sites,
+                                                      ignore_missing_refs=self.settings['ignore_missing_refs'],
+                                                      constraints=constraints)
+        requirements = remove_duplicate_requirements(requirements)
+        self.dependency_graph = DependencyGraph.from_visited(visited_sites, specifiers, requirements, constraints)
+        return requirements, visited_sites
+
+    def _load_dependency_graph(self, args):
+        """
+        Resolve requirements given in args or load graph saved by the last install.
+        """
+        self.settings['ignore_missing_refs'] = args.ignore_missing_refs
+        specifiers = ['-e ' + r for r in args.editable] if args.editable is not None else []
+        if len(specifiers) > 0 or args.requirement is not None:
+            self._resolve_requirements(specifiers, args.requirement, args.tag, self._git_accessor(), args.constraint)
+            return self.dependency_graph
+        graph_file = os.path.join(self.env, Robustus.graph_file_path)
+        if not os.path.isfile(graph_file):
+            raise RobustusException('No requirements given and nothing was installed yet')
+        return DependencyGraph.from_json(open(graph_file).read())
+
+    def graph(self, args):
+        graph = self._load_dependency_graph(args)
+        print graph.to_dot() if args.format == 'dot' else graph.to_json()
+
+    def why(self, args):
+        sys.stdout.write(self._load_dependency_graph(args).why(args.package))
+
+    @staticmethod
+    def _verify_result(requirement, distribution, imports):
+        """
+        :param distribution: (error, info) answer of python probe to distribution query
+        :param imports: list of (error, value) answers to import queries of modules of requirement
+        :return: (ok, message)
+        """
+        dist_error, dist = distribution
+        import_errors = [error for error, _ in imports if error is not None]
+        if dist_error is None:
+            if requirement.version is not None and not requirement.editable and dist['version'] != requirement.version:
+                return False, 'version %s is installed' % dist['version']
+            if len(import_errors) > 0:
+                return False, import_errors[0]
+            return True, 'ok'
+        if len(imports) > len(import_errors):
+            # package installed by robustus script or without pip metadata
+            return True, 'ok (module imported, no distribution found)'
+        script = os.path.join(os.path.dirname(detail.__file__), 'install_%s.py' % requirement.name.lower())
+        if os.path.isfile(script):
+            return True, 'not checked (installed by robustus script)'
+        return False, dist_error
+
+    def verify(self, args):
+        """
+        Check that requirements of the last install (or given ones) are installed and importable.
+        All checks are done by single python interpreter of the environment.
+        """
+        graph = self._load_dependency_graph(args)
+        requirements = [RequirementSpecifier(specifier=n) for n in graph.nodes if n in graph.selected]
+        checked = [r for r in requirements if r.name is not None and r.name != 'ros_overlay']
+        env_probe = probe(self.env)
+        distributions = env_probe.query([('distribution', r.name) for r in checked])
+        modules = []
+        for r, (error, dist) in zip(checked, distributions):
+            modules.append(dist['top_level'] if error is None else list(set([r.name, r.name.lower()])))
+        imports = env_probe.query([('import', m) for r_modules in modules for m in r_modules])
+
+        results = {}
+        for i, r in enumerate(checked):
+            r_imports, imports = imports[:len(modules[i])], imports[len(modules[i]):]
+            results[id(r)] = Robustus._verify_result(r, distributions[i], r_imports)
+
+        failed = 0
+        for r in requirements:
+            ok, message = results.get(id(r), (True, 'not checked'))
+            if not ok:
+                failed += 1
+            print '%s: %s' % (r.freeze(), message)
+        if failed > 0:
+            raise RobustusException('%d of %d requirements failed verification' % (failed, len(requirements)))
+
+    @contextlib.contextmanager
+    def _package_index(self):
+        """
+        Point all pip subprocesses to the package index proxy (or to the upstream index if proxy is disabled)
+        for the duration of the context. Nested installs (e.g. from install scripts) reuse running proxy.
+        In offline mode pip may only install from robustus cache.
+        """
+        if self.pypi_proxy is not None:
+            yield
+            return
+
+        saved_environ = dict((k, os.environ.get(k)) for k in ['PIP_INDEX_URL', 'PIP_TRUSTED_HOST',
+                                                              'PIP_NO_INDEX', 'PIP_FIND_LINKS'])
+        if self.settings['offline']:
+            os.environ['PIP_NO_INDEX'] = '1'
+            os.environ['PIP_FIND_LINKS'] = self.cache
+        elif self.settings['pypi_proxy']:
+            self.pypi_proxy = PypiProxy(self.cache,
+                                        os.path.join(self.cache_info_dir, 'pypi_proxy'),
+                                        index_url=self.settings['index_url'],
+                                        governor=self.governor,
+                                        catalog=self.cache_catalog,
+                                        timeout=self.settings['mirror_timeout'],
+                                        verbose=self.settings['verbosity'] >= 2)
+            self.pypi_proxy.start()
+            os.environ['PIP_INDEX_URL'] = self.pypi_proxy.index_url
+            os.environ['PIP_TRUSTED_HOST'] = '127.0.0.1'
+        elif self.settings['index_url'] != DEFAULT_INDEX_URL:
+            os.environ['PIP_INDEX_URL'] = self.settings['index_url']
+        try:
+            yield
+        finally:
+            if self.pypi_proxy is not None:
+                self.pypi_proxy.stop()
+                self.pypi_proxy = None
+            for k, v in saved_environ.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+
     def search_pkg_config_locations(self, locations=None):
         """
         Search for pkg-config files locations. Usually all libraries are going to '<env>/lib' folder, so
@@ -598,112 +990,126 @@ class Robustus(object):
 
         return list(pkg_files_dirs)
 
+    def _build_root(self):
+        """
+        :return: directory build directories of native packages are kept in
+        """
+        scratch = self.settings.get('scratch') or tmpfs_dir()
+        if scratch is None:
+            return os.path.join(self.env, Robustus.build_dirs_path)
+        # scratch directory may be shared by several users and environments
+        return os.path.join(scratch, 'robustus-%s-%s' % (getpass.getuser(),
+                                                         hashlib.sha1(os.path.abspath(self.env)).hexdigest()[:10]))
+
     def install_cmake_package(self, requirement_specifier, cmake_options, ignore_index, clone_url=None, install_dir=None):
         """
         Build and install cmake package into cache & copy it to env.
+        :param install_dir: directory to copy package to, by default it is merged into env
+        :return: directory package was installed to
         """
-        pkg_cache_dir = os.path.abspath(os.path.join(self.cache, '%s-%s' % (requirement_specifier.name,
-                                                                            requirement_specifier.version)))
-
-        def in_cache():
-            return os.path.isdir(pkg_cache_dir)
-
-        if not in_cache() and not ignore_index:
-            cwd = os.getcwd()
-            archive = None
-            download_dir = None
-            try:
-                if clone_url is not None:
-                    retcode = run_shell(['git', 'clone', clone_url],
-                                        verbose=self.settings['verbosity'] >= 1)
-                    if retcode != 0:
-                        raise RequirementException('Failed to clone %s' % clone_url)
-                    download_dir = os.path.abspath(requirement_specifier.name)
-                    os.chdir(download_dir)
-
-                    # checkout specific version (branch)
-                    if requirement_specifier.version is not None:
-                        retcode = run_shell(['git', 'checkout', '-b', requirement_specifier.version,
-                                             '--track', 'origin/%s' % requirement_specifier.version],
-                                            verbose=self.settings['verbosity'] >= 1)
-                        if retcode != 0:
-                            raise RequirementException('Failed to checkout branch %s in %s' % (requirement_specifier.version,
-                                                                                               requirement_specifier.name))
-
-                    # update submodules if any
-                    run_shell(['git', 'submodule', 'update', '--init'],
-                              verbose=self.settings['verbosity'] >= 1)
-                else:
-                    archive = self.download(requirement_specifier.name, requirement_specifier.version)
-                    download_dir = unpack(archive)
-                    os.chdir(download_dir)
-
-                logging.info('Building %s' % requirement_specifier.name)
-                env = os.environ.copy()
-                env['PKG_CONFIG_PATH'] = ','.join(self.search_pkg_config_locations())
-                retcode = run_shell(['cmake', '.', '-DCMAKE_INSTALL_PREFIX=%s' % pkg_cache_dir] + cmake_options,
-                                    env=env,
-                                    verbose=self.settings['verbosity'] >= 1)
-                if retcode != 0:
-                    raise RequirementException('%s configure failed' % requirement_specifier.name)
-
-                # on bStem we can build only in single thread, but bStem has 2 cores, thus
-                # we are using this weird formula to determine number of threads for make
-                retcode = run_shell(['make', '-j%i' % max(multiprocessing.cpu_count() / 2, 1)],
-                                    verbose=self.settings['verbosity'] >= 1)
-                if retcode != 0:
-                    raise RequirementException('%s build failed' % requirement_specifier.name)
-                retcode = run_shell(['make', 'install'],
-                                    verbose=self.settings['verbosity'] >= 1)
-                if retcode != 0:
-                    raise RequirementException('%s "make install" failed' % requirement_specifier.name)
-            except:
-                safe_remove(pkg_cache_dir)
-                raise
-            finally:
-                os.chdir(cwd)
-                safe_remove(archive)
-                safe_remove(download_dir)
-
-        if in_cache():
-            if install_dir is not None:
-                if os.path.exists(install_dir):
-                    shutil.rmtree(install_dir)
-                shutil.copytree(pkg_cache_dir, install_dir)
-            else:
-                # install directly into venv
-                install_dir = self.env
-                distutils.dir_util._path_created = {}
-                distutils.dir_util.copy_tree(pkg_cache_dir, install_dir)
-        else:
-            raise RequirementException('can\'t find %s-%s in robustus cache' % (requirement_specifier.name, requirement_specifier.version))
-
-        return install_dir
+        recipe = Recipe(requirement_specifier.name,
+                        source=Git(clone_url) if clone_url is not None else Archive(),
+                        build=CMake(cmake_options),
+                        runtime=[CopyTree(install_dir)])
+        recipe.install(self, requirement_specifier, ignore_index)
+        return install_dir if install_dir is not None else self.env
 
     def freeze(self, args):
         for requirement in self.cached_packages:
             print requirement.freeze()
 
-    def download(self, package, version):
+    def find_links(self):
+        """
+        Locations specified using --find-links ordered by their observed health, mirrors
+        which failed repeatedly are skipped. None in offline mode.
+        """
+        if self.settings['offline']:
+            return []
+        return self.mirror_health.order(self.settings['find_links'])
+
+    def _download_archive(self, archive_names, dest_dir=None):
+        """
+        Download the first of archives found in locations specified using --find-links. Store archive
+        in current working folder. If location publishes remote index, only archives listed there
+        are requested. If racing of mirrors is enabled, the same archive is requested from several
+        healthiest mirrors at once and downloaded from the fastest one. Archives recently found
+        missing on a mirror are not requested from it again until negative cache entry expires.
+        Digest of archive is computed during download and checked against remote index,
+        corrupt downloads are discarded and the next mirror is tried.
+        :param archive_names: archive file names in order of preference
+        :param dest_dir: directory to store archive in, current working folder by default
+        :return: path to archive or None if not found
+        """
+        candidates = []
+        expected_digests = {}
+        for index in self.find_links():
+            manifest = self.remote_index.manifest(index)
+            for archive_name in archive_names:
+                if self.negative_cache.is_missing(index, archive_name):
+                    continue
+                if manifest is not None:
+                    entry = manifest.find_file(archive_name)
+                    if entry is None:
+                        continue
+                    url = manifest.url(entry)
+                    expected_digests[url] = entry.get('sha256')
+                else:
+                    url = os.path.join(index, archive_name)
+                candidates.append((index, archive_name, url))
+
+        while len(candidates) > 0:
+            index, archive_name, url = candidates.pop(0)
+            # skip mirrors that have failed repeatedly during this search
+            healthy = self.find_links()
+            if index not in healthy:
+                continue
+            race = [(index, url)]
+            for candidate in [c for c in candidates if c[1] == archive_name and c[0] in healthy]:
+                if len(race) >= self.settings['race_mirrors']:
+                    break
+                candidates.remove(candidate)
+                race.append((candidate[0], candidate[2]))
+            try:
+                archive_path = os.path.join(dest_dir, archive_name) if dest_dir is not None else archive_name
+                with self.governor.slot():
+                    mirror, url, response = self.mirror_health.race(race, timeout=self.settings['mirror_timeout'])
+                    _, digest = download(url, archive_path, verbose=self.settings['verbosity'] >= 2,
+                                         response=response, expected_digest=expected_digests.get(url),
+                                         return_digest=True, throttle=self.governor.throttle(url))
+                # archives fetched into the cache are trusted later without hashing them again,
+                # others are unpacked and removed by the caller
+                if self.cache_catalog.contains(archive_path):
+                    self.cache_catalog.record(archive_path, digest, url)
+                return os.path.abspath(archive_path)
+            except DownloadError as e:
+                logging.warn(str(e))
+                self.mirror_health.record_failure(mirror)
+            except MirrorsFailed as e:
+                for mirror, url, error in e.errors:
+                    if is_missing_error(url, error):
+                        self.negative_cache.add(mirror, archive_name)
+            except (urllib2.URLError, socket.error):
+                pass
+        return None
+
+    def download(self, package, version, dest_dir=None):
         """
         Download package archive, look for locations specified using --find-links. Store archive in current
         working folder.
         :param package: package name
         :param version: package version
+        :param dest_dir: directory to store archive in, current working folder by default
         :return: path to archive
         """
+        if self.settings['offline']:
+            raise RequirementException('Package archive %s-%s can\'t be downloaded in offline mode' % (package, version))
         logging.info('Searching for package archive %s-%s' % (package, version))
         archive_base_name = '%s-%s' % (package, version)
         extensions = ['.tar.gz', '.tar.bz2', '.zip']
-        for index in self.settings['find_links']:
-            for archive_name in [archive_base_name + ext for ext in extensions]:
-                try:
-                    download(os.path.join(index, archive_name), archive_name, verbose=self.settings['verbosity'] >= 2)
-                    return os.path.abspath(archive_name)
-                except urllib2.URLError:
-                    pass
-
-        raise RequirementException('Failed to find package archive %s-%s' % (package, version))
+        archive = self._download_archive([archive_base_name + ext for ext in extensions], dest_dir)
+        if archive is None:
+            raise RequirementException('Failed to find package archive %s-%s' % (package, version))
+        return archive
 
     def download_compiled_archive(self, package, version):
         """
@@ -714,7 +1120,7 @@ class Robustus(object):
         :return: path to archive or None if not found
         """
         
-        if self.settings['no_remote_cache']:
+        if self.settings['offline'] or self.settings['no_remote_cache']:
             return None
 
         if not platform.machine():
@@ -724,16 +1130,47 @@ class Robustus(object):
         archive_base_name = '%s-%s-%s' % (package, version, platform.machine())
         logging.info('Searching for compiled package archive %s' % archive_base_name)
         extensions = ['.compiled.tar.gz', '.compiled.tar.bz2', '.compiled.zip']
-        for index in self.settings['find_links']:
-            for archive_name in [archive_base_name + ext for ext in extensions]:
-                try:
-                    download(os.path.join(index, archive_name), archive_name, verbose=self.settings['verbosity'] >= 2)
-                    return os.path.abspath(archive_name)
-                except urllib2.URLError:
-                    pass
+        archive = self._download_archive([archive_base_name + ext for ext in extensions])
+        if archive is None:
+            logging.info('Failed to find compiled package archive %s' % archive_base_name)
+        return archive
 
-        logging.info('Failed to find compiled package archive %s' % archive_base_name)
-        return None
+    def forget_missing(self, args):
+        count = self.negative_cache.invalidate(args.patterns if len(args.patterns) > 0 else None)
+        logging.info('Forgot %d failed remote lookups' % count)
+
+    def _download_from_amazon_key(self, key, filename):
+        """
+        Download S3 object hashing it on the fly. Single part uploads have md5 of the content as etag,
+        so transfer is verified against it. Corrupt or incomplete file is removed.
+        """
+        throttle = self.governor.throttle('https://%s' % key.bucket.connection.server_name())
+
+        class HashingFile(object):
+            def __init__(self, f):
+                self.f = f
+                self.md5 = hashlib.md5()
+                self.sha256 = hashlib.sha256()
+
+            def write(self, data):
+                self.md5.update(data)
+                self.sha256.update(data)
+                self.f.write(data)
+                if throttle is not None:
+                    throttle(len(data))
+
+        try:
+            with open(filename, 'wb') as f, self.governor.slot():
+                hashing_file = HashingFile(f)
+                key.get_contents_to_file(hashing_file)
+            etag = (key.etag or '').strip('"')
+            if etag and '-' not in etag and etag != hashing_file.md5.hexdigest():
+                raise DownloadError('%s is corrupt: md5 %s, expected %s'
+                                    % (filename, hashing_file.md5.hexdigest(), etag))
+        except:
+            safe_remove(filename)
+            raise
+        self.cache_catalog.record(filename, hashing_file.sha256.hexdigest(), 's3://%s/%s' % (key.bucket.name, key.name))
 
     def download_cache_from_amazon(self, filename, bucket_name, key, secret):
         if filename is None or bucket_name is None:
@@ -756,7 +1193,7 @@ class Robustus(object):
             os.chdir(self.cache)
             for l in bucket.list():
                 if str(l.key) == filename:
-                    l.get_contents_to_filename(filename)
+                    self._download_from_amazon_key(l, filename)
                     break
             os.chdir(cwd)
             if not os.path.exists(os.path.join(self.cache, filename)):
@@ -780,7 +1217,9 @@ class Robustus(object):
                 self.download_cache_from_amazon(wheelhouse_archive, args.bucket, args.key, args.secret)
             else:
                 logging.info('Downloading ' + args.url)
-                subprocess.call(['rsync', '-r', '-l', args.url, '.'])
+                with self.governor.slot():
+                    run_shell(self.governor.command(['rsync', '-r', '-l', args.url, '.'], args.url),
+                              verbose=self.settings['verbosity'] >= 1)
         except:
             os.chdir(cwd)
             raise
@@ -788,19 +1227,35 @@ class Robustus(object):
         wheelhouse_archive_lowercase = wheelhouse_archive.lower()
         if wheelhouse_archive_lowercase.endswith('.tar.gz'):
             logging.info('Unzipping')
-            subprocess.call(['tar', '-xzvf', wheelhouse_archive])
+            run_shell(['tar', '-xzvf', wheelhouse_archive], verbose=self.settings['verbosity'] >= 1)
         elif wheelhouse_archive_lowercase.endswith('.tar.bz'):
             logging.info('Unzipping')
-            subprocess.call(['tar', '-xjvf', wheelhouse_archive])
+            run_shell(['tar', '-xjvf', wheelhouse_archive], verbose=self.settings['verbosity'] >= 1)
         elif wheelhouse_archive_lowercase.endswith('.zip'):
             logging.info('Unzipping')
-            subprocess.call(['unzip', wheelhouse_archive])
+            run_shell(['unzip', wheelhouse_archive], verbose=self.settings['verbosity'] >= 1)
 
         if os.path.isfile(wheelhouse_archive):
             os.remove(wheelhouse_archive)
         os.chdir(cwd)
         logging.info('Done')
 
+    def _amazon_upload_throttle(self, connection):
+        """
+        boto reads file being uploaded internally, so upload is throttled from its progress callback.
+        :return: keyword arguments for boto set_contents_* methods
+        """
+        throttle = self.governor.throttle('https://%s' % connection.server_name())
+        if throttle is None:
+            return {}
+        transmitted = [0]
+
+        def progress(bytes_transmitted, total):
+            throttle(bytes_transmitted - transmitted[0])
+            transmitted[0] = bytes_transmitted
+        # boto calls back after every chunk when num_cb is negative
+        return {'cb': progress, 'num_cb': -1}
+
     def upload_cache_to_amazon(self, filename, bucket_name, key, secret, public):
         if filename is None or bucket_name is None or key is None or secret is None:
             raise RobustusException('In order to upload to amazon S3 you should specify filename,'
@@ -823,7 +1278,8 @@ class Robustus(object):
             # create a key to keep track of our file in the storage
             k = Key(bucket)
             k.key = filename
-            k.set_contents_from_filename(filename)
+            with self.governor.slot():
+                k.set_contents_from_filename(filename, **self._amazon_upload_throttle(conn))
             if public:
                 k.make_public()
         except ImportError:
@@ -835,27 +1291,53 @@ class Robustus(object):
         cwd = os.getcwd()
         os.chdir(self.cache)
 
-        # compress cache
+        # compress cache, compiler cache is local to the machine
+        compiler_cache_store = os.path.relpath(self.compiler_cache.store, self.cache)
         cache_archive = os.path.basename(args.url)
         cache_archive_lowercase = cache_archive.lower()
         if cache_archive_lowercase.endswith('.tar.gz'):
-            subprocess.call(['tar', '-zcvf', cache_archive] + os.listdir(os.getcwd()))
+            run_shell(['tar', '-zcvf', cache_archive, '--exclude=' + compiler_cache_store] + os.listdir(os.getcwd()),
+                      verbose=self.settings['verbosity'] >= 1)
         elif cache_archive_lowercase.endswith('.tar.bz'):
-            subprocess.call(['tar', '-jcvf', cache_archive] + os.listdir(os.getcwd()))
+            run_shell(['tar', '-jcvf', cache_archive, '--exclude=' + compiler_cache_store] + os.listdir(os.getcwd()),
+                      verbose=self.settings['verbosity'] >= 1)
         elif cache_archive_lowercase.endswith('.zip'):
-            subprocess.call(['zip', cache_archive] + os.listdir(os.getcwd()))
+            run_shell(['zip', cache_archive] + os.listdir(os.getcwd()) + ['-x', compiler_cache_store + '/*'],
+                      verbose=self.settings['verbosity'] >= 1)
 
         try:
             if args.bucket is not None:
                 self.upload_cache_to_amazon(cache_archive, args.bucket, args.key, args.secret, args.public)
             else:
                 for file in glob.iglob('*'):
-                    subprocess.call(['rsync', '-r', '-l', file, args.url])
+                    with self.governor.slot():
+                        run_shell(self.governor.command(['rsync', '-r', '-l', file, args.url], args.url),
+                                  verbose=self.settings['verbosity'] >= 1)
         finally:
             if os.path.isfile(cache_archive):
                 os.remove(cache_archive)
             os.chdir(cwd)
 
+    @staticmethod
+    def _add_resolution_arguments(parser):
+        parser.add_argument('-r', '--requirement',
+                            action='append',
+                            help='resolve all the packages listed in the given requirements file, '
+                                 'this option can be used multiple times.')
+        parser.add_argument('-c', '--constraint',
+                            action='append',
+                            help='constrain versions of resolved packages using the given constraints file, '
+                                 'this option can be used multiple times.')
+        parser.add_argument('-e', '--editable',
+                            action='append',
+                            help='editable package to resolve')
+        parser.add_argument('--tag',
+                            action='store',
+                            help='resolve editables using tag or branch')
+        parser.add_argument('--ignore-missing-refs',
+                            action='store_true',
+                            help='Warn only but no error if a tag is missing (use with --tag)')
+
     @staticmethod
     def _create_args_parser():
         parser = argparse.ArgumentParser(description='Tool to make and configure python virtualenv,'
@@ -872,6 +1354,58 @@ class Robustus(object):
         parser.add_argument('--debug',
                             action='store_true',
                             help="Take actions to assist with debugging such as not deleting packages which fail to build.")
+        parser.add_argument('--bwlimit',
+                            type=float,
+                            help='limit bandwidth of downloads and cache transfers, KBytes per second')
+        parser.add_argument('--host-bwlimit',
+                            action='append',
+                            metavar='HOST=KBPS',
+                            help='limit bandwidth of transfers from/to given host, KBytes per second, '
+                                 'can be used multiple times')
+        parser.add_argument('--max-transfers',
+                            type=int,
+                            help='max number of concurrent downloads and cache transfers')
+        parser.add_argument('--background',
+                            action='store_true',
+                            help='transfer with low CPU and IO priority, one transfer at a time')
+        parser.add_argument('--offline',
+                            action='store_true',
+                            help='never access network, install only from robustus cache, local git mirrors '
+                                 'and editable requirements already cloned')
+        parser.add_argument('--step-timeout',
+                            action='store',
+                            type=float,
+                            help='seconds every shell command (build step, git, rosdep, apt-get, ...) may run, '
+                                 'command is killed with all its children when the time is out')
+        parser.add_argument('--timeout',
+                            action='store',
+                            type=float,
+                            help='seconds all shell commands run by robustus have to finish in')
+        parser.add_argument('--keep-builds',
+                            action='store',
+                            type=int,
+                            help='number of build directories of native packages kept for retries and rebuilds '
+                                 '(default 3, 1 on tmpfs), 0 removes build directory after every build')
+        parser.add_argument('--scratch',
+                            action='store',
+                            help='directory native packages are unpacked and built in, by default tmpfs is used '
+                                 'if it has enough free space, <env>/%s otherwise' % Robustus.build_dirs_path)
+        parser.add_argument('--no-ninja',
+                            action='store_true',
+                            help='build cmake packages with make even if ninja is installed')
+        parser.add_argument('-j', '--jobs',
+                            action='store',
+                            type=int,
+                            help='number of parallel build jobs of all packages robustus builds together, '
+                                 'by default jobserver of make running robustus is joined if there is one, '
+                                 'otherwise half of CPUs are used')
+        parser.add_argument('--no-compiler-cache',
+                            action='store_true',
+                            help='don\'t run compilers of native builds through ccache')
+        parser.add_argument('--compiler-cache-size',
+                            action='store',
+                            help='maximal size of compiler cache in <cache>/.robustus/ccache, e.g. 500M or 10G '
+                                 '(default %s)' % DEFAULT_CACHE_SIZE)
 
         subparsers = parser.add_subparsers(help='robustus commands')
 
@@ -895,6 +1429,10 @@ class Robustus(object):
                                     action='append',
                                     help='install all the packages listed in the given'
                                          'requirements file, this option can be used multiple times.')
+        install_parser.add_argument('-c', '--constraint',
+                                    action='append',
+                                    help='constrain versions of installed packages using the given constraints '
+                                         'file, this option can be used multiple times.')
         install_parser.add_argument('packages',
                                     nargs='*',
                                     help='packages to install in format <package name>==version')
@@ -917,9 +1455,37 @@ class Robustus(object):
         install_parser.add_argument('--ignore-missing-refs',
                                     action='store_true',
                                     help='Warn only but no error if a tag is missing (use with --tag)')
+        install_parser.add_argument('--fail-on-conflict',
+                                    action='store_true',
+                                    help='abort before installing anything if requirements files pin different '
+                                         'versions of the same package')
+        install_parser.add_argument('-i', '--index-url',
+                                    default=DEFAULT_INDEX_URL,
+                                    help='base URL of python package index (default %s)' % DEFAULT_INDEX_URL)
+        install_parser.add_argument('--no-pypi-proxy',
+                                    action='store_true',
+                                    help='let pip access package index directly instead of through '
+                                         'caching proxy run by robustus')
         install_parser.add_argument('--no-remote-cache',
                                     action='store_true',
                                     help='Do not use remote cache for downloading of wheels')
+        install_parser.add_argument('--race-mirrors',
+                                    action='store',
+                                    type=int,
+                                    default=1,
+                                    help='request package archives from that many healthiest mirrors at once '
+                                         'and download from the fastest one')
+        install_parser.add_argument('--mirror-timeout',
+                                    action='store',
+                                    type=float,
+                                    default=60,
+                                    help='seconds to wait for response of a remote cache mirror')
+        install_parser.add_argument('--negative-cache-ttl',
+                                    action='store',
+                                    type=float,
+                                    default=24,
+                                    help='hours to remember that package archive or wheel is missing on a remote '
+                                         'cache, 0 disables negative caching')
         install_parser.add_argument('--attempts',
                                     action='store',
                                     type=int,
@@ -964,6 +1530,38 @@ class Robustus(object):
         freeze_parser = subparsers.add_parser('freeze', help='list cached binary packages')
         freeze_parser.set_defaults(func=Robustus.freeze)
 
+        graph_parser = subparsers.add_parser('graph',
+                                             help='print graph of requirements inclusion, of the last install '
+                                                  'unless requirements are given')
+        graph_parser.add_argument('--format',
+                                  choices=['dot', 'json'],
+                                  default='dot',
+                                  help='graphviz dot or json')
+        Robustus._add_resolution_arguments(graph_parser)
+        graph_parser.set_defaults(func=Robustus.graph)
+
+        why_parser = subparsers.add_parser('why',
+                                           help='show versions of package and every way it was included, '
+                                                'in the last install unless requirements are given')
+        why_parser.add_argument('package', help='package name')
+        Robustus._add_resolution_arguments(why_parser)
+        why_parser.set_defaults(func=Robustus.why)
+
+        verify_parser = subparsers.add_parser('verify',
+                                              help='check that requirements of the last install (unless '
+                                                   'requirements are given) are installed and importable')
+        Robustus._add_resolution_arguments(verify_parser)
+        verify_parser.set_defaults(func=Robustus.verify)
+
+        forget_missing_parser = subparsers.add_parser('forget-missing',
+                                                      help='forget remembered failed lookups of remote caches, '
+                                                           'so that missing packages are requested again')
+        forget_missing_parser.add_argument('patterns',
+                                           nargs='*',
+                                           help='shell-style patterns of archive names, e.g. "OpenCV-*" '
+                                                '(all lookups are forgotten by default)')
+        forget_missing_parser.set_defaults(func=Robustus.forget_missing)
+
         download_cache_parser = subparsers.add_parser('download-cache', help='download cache fom server or path,'
                                                                              'if robustus cache is not empty,'
                                                                              'cached packages will be added to existing ones')
@@ -1014,9 +1612,14 @@ def execute(argv):
         else:
             robustus = Robustus(args)
             args.func(robustus, args)
-    except (RobustusException, RequirementException) as exc:
+    except (RobustusException, RequirementException, CommandTimeout) as exc:
         logging.critical(exc.message)
         exit(1)
+    except KeyboardInterrupt:
+        # commands run by background threads aren't interrupted by Ctrl-C
+        terminate_shell_commands()
+        logging.critical('Interrupted')
+        exit(130)
     except NameError as exc:
         # Handle name errors specially since otherwise the way python does
         # bin scripts it results in robustus being executed twice (which can
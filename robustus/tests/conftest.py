@@ -0,0 +1,40 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+import pytest
+from robustus.robustus import Robustus
+
+
+@pytest.fixture
+def make_robustus(tmpdir):
+    """
+    Factory of Robustus objects for a fake environment in tmpdir, set up as if freeze command was run.
+    Environment has settings file and empty python, pip and easy_install executables, calling factory
+    again reuses the environment.
+    Factory takes extra command line options and keyword arguments:
+    find_links - remote caches in settings of environment
+    python - interpreter bin/python links to instead of an empty file
+    root - directory to make environment in, tmpdir by default
+    scratch - directory builds run in, tmpdir/scratch by default, None for the default of robustus
+    """
+    def make(*args, **kwargs):
+        root = kwargs.get('root', tmpdir)
+        env = root.join('env')
+        if not env.check():
+            env.ensure('.robustus').write(str({'cache': 'wheelhouse', 'find_links': kwargs.get('find_links', [])}))
+            if kwargs.get('python') is not None:
+                env.ensure('bin', dir=True).join('python').mksymlinkto(kwargs['python'])
+            else:
+                env.ensure('bin', 'python')
+            for executable in ['pip', 'easy_install']:
+                env.ensure('bin', executable)
+        options = ['--env', str(env)]
+        scratch = kwargs.get('scratch', str(tmpdir.join('scratch')))
+        if scratch is not None:
+            options += ['--scratch', scratch]
+        robustus = Robustus(Robustus._create_args_parser().parse_args(options + list(args) + ['freeze']))
+        robustus.settings['mirror_timeout'] = 5
+        return robustus
+    return make
@@ -0,0 +1,54 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+import doctest
+import gzip
+import logging
+import os
+import pytest
+import robustus
+import sys
+from robustus.detail import build_log
+from robustus.detail.utility import run_shell
+
+
+def test_build_log_rotation(tmpdir):
+    log_dir = str(tmpdir.join('logs'))
+    for i in range(4):
+        with build_log.build_log(log_dir, 'numpy__1_7_2', keep=3) as log:
+            log.write('build %d\n' % i)
+    assert sorted(os.listdir(log_dir)) == ['numpy__1_7_2.1.log.gz', 'numpy__1_7_2.2.log.gz', 'numpy__1_7_2.log.gz']
+    assert gzip.open(os.path.join(log_dir, 'numpy__1_7_2.log.gz')).read() == 'build 3\n'
+    assert gzip.open(os.path.join(log_dir, 'numpy__1_7_2.2.log.gz')).read() == 'build 1\n'
+
+
+def test_run_shell_writes_build_log(tmpdir, caplog):
+    log_dir = str(tmpdir.join('logs'))
+    with build_log.build_log(log_dir, 'outer'):
+        with build_log.build_log(log_dir, 'inner') as inner:
+            # output much larger than kept in memory
+            command = [sys.executable, '-c', 'import sys; sys.stdout.write("robustus\\n" * 20000); sys.exit(1)']
+            assert run_shell(command) == 1
+        assert build_log.current().path.endswith('outer.log.gz')
+        run_shell(['echo', 'outer'])
+    assert build_log.current() is None
+
+    output = gzip.open(os.path.join(log_dir, 'inner.log.gz')).read()
+    assert output == '$ %s\n' % ' '.join(command) + 'robustus\n' * 20000
+    assert gzip.open(os.path.join(log_dir, 'outer.log.gz')).read() == '$ echo outer\nouter\n'
+
+    # only the tail is printed on failure
+    failure = [r.getMessage() for r in caplog.records if r.levelno == logging.ERROR][-1]
+    assert failure.startswith('Failed with output (last %d bytes, full output in %s):\n' %
+                              (build_log.TAIL_SIZE, inner.path))
+    assert len(failure) < build_log.TAIL_SIZE + 200
+
+
+def test_doc_tests():
+    doctest.testmod(robustus.detail.build_log, raise_on_error=True)
+
+
+if __name__ == '__main__':
+    pytest.main('-s %s -n0' % __file__)
@@ -0,0 +1,129 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+import hashlib
+import mimetools
+import os
+import pytest
+import StringIO
+import urllib
+from robustus.detail import RequirementException, RequirementSpecifier
+from robustus.detail.cache_catalog import CacheCatalog
+from robustus.detail.remote_index import Manifest
+from robustus.detail.utility import download, file_sha256, DownloadError
+
+
+# pip stand-in "downloading" wheel and recording its calls
+FAKE_PIP = '''#!/bin/sh
+echo "$@" >> %(log)s
+for arg in "$@"; do
+    case "$arg" in --download=*) cp %(wheel)s "${arg#--download=}";; esac
+done
+'''
+
+
+def _response(data, content_length):
+    headers = mimetools.Message(StringIO.StringIO('Content-Length: %d\n\n' % content_length))
+    return urllib.addinfourl(StringIO.StringIO(data), headers, 'http://mirror/archive.tar.gz')
+
+
+def test_download_digest(tmpdir):
+    filename = os.path.join(str(tmpdir), 'archive.tar.gz')
+    digest = hashlib.sha256('archive').hexdigest()
+    assert download('http://mirror/archive.tar.gz', filename, response=_response('archive', 7),
+                    return_digest=True) == (filename, digest)
+    assert open(filename).read() == 'archive'
+
+    os.remove(filename)
+    download('http://mirror/archive.tar.gz', filename, response=_response('archive', 7), expected_digest=digest)
+    assert open(filename).read() == 'archive'
+
+
+def test_download_corrupt(tmpdir):
+    filename = os.path.join(str(tmpdir), 'archive.tar.gz')
+    with pytest.raises(DownloadError):
+        download('http://mirror/archive.tar.gz', filename, response=_response('archive', 7),
+                 expected_digest=hashlib.sha256('other').hexdigest())
+    # nothing is left behind
+    assert os.listdir(str(tmpdir)) == []
+
+    with pytest.raises(DownloadError):
+        download('http://mirror/archive.tar.gz', filename, response=_response('arch', 7))
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_cache_catalog(tmpdir):
+    cache_dir = str(tmpdir.mkdir('wheelhouse'))
+    catalog_file = os.path.join(cache_dir, '.robustus', 'catalog.json')
+    catalog = CacheCatalog(cache_dir, catalog_file)
+    wheel = os.path.join(cache_dir, 'pep8-1.4.6-py27-none-any.whl')
+    with open(wheel, 'w') as f:
+        f.write('wheel')
+    digest = hashlib.sha256('wheel').hexdigest()
+
+    # files outside of cache are not cataloged
+    outside = os.path.join(str(tmpdir), 'archive.tar.gz')
+    with open(outside, 'w') as f:
+        f.write('archive')
+    catalog.record(outside, hashlib.sha256('archive').hexdigest())
+    assert catalog.digest(outside) is None
+    assert not catalog.contains(outside)
+    assert catalog.contains(wheel)
+
+    catalog.record(wheel, digest, 'http://mirror/python-wheels/pep8-1.4.6-py27-none-any.whl')
+    catalog = CacheCatalog(cache_dir, catalog_file)
+    assert catalog.digest(wheel) == digest
+    assert catalog.is_intact(wheel)
+
+    # touched file with the same content is rehashed and trusted again
+    os.utime(wheel, (0, 0))
+    assert catalog.digest(wheel) is None
+    assert catalog.is_intact(wheel)
+    assert catalog.digest(wheel) == digest
+
+    with open(wheel, 'w') as f:
+        f.write('truncated')
+    assert not catalog.is_intact(wheel)
+
+    # removed files are forgotten
+    os.remove(wheel)
+    assert len(CacheCatalog(cache_dir, catalog_file).entries) == 0
+
+
+def test_remote_wheel_is_verified_before_install(tmpdir, make_robustus, monkeypatch):
+    robustus = make_robustus()
+    robustus.settings['find_links'] = ['http://localhost:1']
+    wheel = tmpdir.join('pep8-1.4.6-py27-none-any.whl')
+    wheel.write('wheel')
+    pip_calls = tmpdir.join('pip_calls')
+    pip = tmpdir.join('env', 'bin', 'pip')
+    pip.write(FAKE_PIP % {'log': pip_calls, 'wheel': wheel})
+    pip.chmod(0755)
+    manifest = Manifest('http://localhost:1', {'artifacts': [
+        {'kind': 'wheel', 'filename': wheel.basename, 'name': 'pep8', 'version': '1.4.6', 'platform': 'any',
+         'sha256': hashlib.sha256('corrupt').hexdigest(), 'url': 'python-wheels/' + wheel.basename}]})
+    monkeypatch.setattr(robustus.remote_index, 'manifest', lambda find_link: manifest)
+    requirement = RequirementSpecifier(name='pep8', version='1.4.6')
+
+    with pytest.raises(RequirementException):
+        robustus.install_satisfactory_requirement_from_remote(requirement)
+    # corrupt wheel was downloaded, but neither installed nor cached
+    assert len(pip_calls.read().splitlines()) == 1
+    assert not os.path.exists(os.path.join(robustus.cache, wheel.basename))
+
+    manifest.artifacts[0]['sha256'] = hashlib.sha256('wheel').hexdigest()
+    hashed = []
+    monkeypatch.setattr('robustus.robustus.file_sha256', lambda path: hashed.append(path) or file_sha256(path))
+    assert robustus.install_satisfactory_requirement_from_remote(requirement)
+    cached = os.path.join(robustus.cache, wheel.basename)
+    assert robustus.cache_catalog.digest(cached) == hashlib.sha256('wheel').hexdigest()
+    # digest computed for verification is recorded
+    assert len(hashed) == 1
+    assert pip_calls.read().splitlines()[-1] == 'install --no-index --use-wheel --find-links=%s pep8==1.4.6' \
+        % robustus.cache
+
+
+if __name__ == '__main__':
+    pytest.main('-s %s -n0' % __file__)
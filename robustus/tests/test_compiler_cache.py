@@ -0,0 +1,111 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+import os
+import pytest
+from robustus.detail import RequirementSpecifier, compiler_cache
+from robustus.detail.recipe import Recipe, Archive, Make, Stage
+from robustus.detail.utility import run_shell
+from robustus.tests.test_recipe import _make_archive
+
+
+# ccache stand-in recording compilers run through it, every compilation is a miss
+FAKE_CCACHE = '''#!/bin/sh
+log=%s
+if [ "$(basename "$0")" = ccache ]; then
+    [ "$1" = --print-stats ] || exit 1
+    echo "direct_cache_hit\t0"
+    echo "preprocessed_cache_hit\t0"
+    echo "cache_miss\t$(cat $log 2>/dev/null | wc -l)"
+    exit 0
+fi
+mkdir -p "$CCACHE_DIR"
+echo "$(basename "$0") $CCACHE_DIR $CCACHE_MAXSIZE $CCACHE_BASEDIR $PWD" >> $log
+PATH=${PATH#*:} exec "$(basename "$0")" "$@"
+'''
+
+CCACHE3_STATS = '''cache directory                     /home/user/.ccache
+primary config                      /home/user/.ccache/ccache.conf
+cache hit (direct)                    12
+cache hit (preprocessed)               3
+cache miss                             5
+files in cache                        40
+'''
+
+CCACHE4_STATS = '''autoconf_test\t0
+cache_miss\t7
+direct_cache_hit\t20
+preprocessed_cache_hit\t1
+stats_updated_timestamp\t1600000000
+'''
+
+
+def _install_fake_ccache(robustus, log):
+    ccache = os.path.join(robustus.env, 'bin', 'ccache')
+    with open(ccache, 'w') as f:
+        f.write(FAKE_CCACHE % log)
+    os.chmod(ccache, 0755)
+
+
+def test_parse_stats():
+    assert compiler_cache.parse_stats(CCACHE3_STATS) == (15, 5)
+    assert compiler_cache.parse_stats(CCACHE4_STATS) == (21, 7)
+    assert compiler_cache.parse_stats('') == (0, 0)
+
+
+@pytest.mark.skipif(run_shell('which cc', shell=True) != 0, reason='requires C compiler')
+def test_recipe_compiles_through_cache(tmpdir, make_robustus, monkeypatch):
+    robustus = make_robustus('--compiler-cache-size', '100M')
+    _install_fake_ccache(robustus, tmpdir.join('compilations'))
+    messages = []
+    monkeypatch.setattr(compiler_cache.logging, 'info', messages.append)
+    archive = _make_archive(tmpdir.mkdir('remote'), 'hello-1.0', {
+        'hello.c': 'int main(void) { return 0; }\n',
+        'Makefile': 'hello: hello.c\n\tcc -o hello hello.c\n'})
+    recipe = Recipe('hello', source=Archive(url='file://' + archive), build=Make(),
+                    stage=[Stage('hello', 'bin')], outputs=['bin/hello'])
+    prefix = recipe.install(robustus, RequirementSpecifier(name='hello', version='1.0'), False)
+    assert run_shell([os.path.join(prefix, 'bin/hello')]) == 0
+
+    store = os.path.join(robustus.cache, '.robustus', 'ccache')
+    compiler, ccache_dir, max_size, base_dir, cwd = tmpdir.join('compilations').read().split()
+    assert (compiler, ccache_dir, max_size, base_dir) == ('cc', store, '100M', robustus.build_root)
+    # paths of sources are rewritten relative to build directory
+    assert cwd.startswith(base_dir + '/')
+    assert 'Compiler cache of hello build: 0 hits, 1 misses (0% hit rate)' in messages
+
+
+def test_disabled_compiler_cache(tmpdir, make_robustus):
+    robustus = make_robustus('--no-compiler-cache')
+    _install_fake_ccache(robustus, tmpdir.join('compilations'))
+    env = {'PATH': '/usr/bin:/bin'}
+    with robustus.compiler_cache.build('hello', env) as build_env:
+        assert build_env == env
+    assert not os.path.exists(robustus.compiler_cache.masquerade_dir)
+
+
+def test_compiler_cache_install(tmpdir, make_robustus, monkeypatch):
+    robustus = make_robustus()
+    installed = []
+    monkeypatch.setattr(robustus, 'install_requirement', lambda requirement, **kwargs: installed.append(requirement))
+    monkeypatch.setattr(compiler_cache.distutils.spawn, 'find_executable', lambda name: None)
+    # builds of wheels don't install ccache
+    with robustus.compiler_cache.build('pep8', {'PATH': '/usr/bin:/bin'}, install=False) as env:
+        assert env == {'PATH': '/usr/bin:/bin'}
+    assert installed == []
+    with robustus.compiler_cache.build('hello', {'PATH': '/usr/bin:/bin'}):
+        pass
+    assert [r.freeze() for r in installed] == ['ccache==%s' % compiler_cache.CCACHE_VERSION]
+
+    # nothing is installed in offline mode
+    robustus = make_robustus('--offline')
+    monkeypatch.setattr(robustus, 'install_requirement', lambda requirement, **kwargs: installed.append(requirement))
+    with robustus.compiler_cache.build('hello', {'PATH': '/usr/bin:/bin'}) as env:
+        assert env == {'PATH': '/usr/bin:/bin'}
+    assert len(installed) == 1
+
+
+if __name__ == '__main__':
+    pytest.main('-s %s -n0' % __file__)
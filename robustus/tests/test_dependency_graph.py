@@ -0,0 +1,169 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+import doctest
+import json
+import os
+import pytest
+import robustus
+from collections import OrderedDict
+from robustus.robustus import Robustus
+from robustus.detail.dependency_graph import DependencyGraph, COMMAND_LINE
+from robustus.detail.requirement import RequirementSpecifier
+
+
+def _visited_sites():
+    visited_sites = OrderedDict()
+    visited_sites['requirements.txt'] = ['numpy==1.7.2\n',
+                                         '-e git+https://github.com/company/vision@master#egg=vision\n',
+                                         '-e git+https://github.com/company/control@master#egg=control\n']
+    visited_sites['-e git+https://github.com/company/vision@master#egg=vision'] = ['numpy==1.8.0', 'opencv==2.4.8']
+    visited_sites['-e git+https://github.com/company/control@master#egg=control'] = [
+        '# comment', '-e git+https://github.com/company/vision@master#egg=vision']
+    return visited_sites
+
+
+def test_why():
+    graph = DependencyGraph.from_visited(_visited_sites(), ['scipy==0.13.3'],
+                                         [RequirementSpecifier(specifier='numpy==1.8.0')])
+    assert graph.roots() == [COMMAND_LINE, 'requirements.txt']
+    assert graph.find('NumPy') == ['numpy==1.7.2', 'numpy==1.8.0']
+    # the shortest path from every root
+    assert graph.paths_to('numpy==1.8.0') == [
+        ['requirements.txt', '-e git+https://github.com/company/vision@master#egg=vision', 'numpy==1.8.0']]
+    assert graph.why('numpy') == ('numpy==1.7.2\n'
+                                  '    requirements.txt -> numpy==1.7.2\n'
+                                  'numpy==1.8.0 [to be installed]\n'
+                                  '    requirements.txt -> -e git+https://github.com/company/vision@master#egg=vision'
+                                  ' -> numpy==1.8.0\n')
+    assert graph.why('scipy') == 'scipy==0.13.3\n    <command line> -> scipy==0.13.3\n'
+    assert graph.why('pep8') == 'pep8 is not required\n'
+
+
+def test_cyclic_includes():
+    graph = DependencyGraph.from_visited({'-e git+https://github.com/company/a#egg=a':
+                                          ['-e git+https://github.com/company/b#egg=b'],
+                                          '-e git+https://github.com/company/b#egg=b':
+                                          ['-e git+https://github.com/company/a#egg=a']},
+                                         ['-e git+https://github.com/company/a#egg=a'])
+    assert graph.paths_to('-e git+https://github.com/company/b#egg=b') == [
+        [COMMAND_LINE, '-e git+https://github.com/company/a#egg=a', '-e git+https://github.com/company/b#egg=b']]
+
+
+def test_diamond_includes():
+    # every file includes both files of the next level, there are 2^40 paths to the last one
+    visited = OrderedDict()
+    for level in range(40):
+        for f in ['a%d.txt' % level, 'b%d.txt' % level]:
+            visited[f] = ['-r a%d.txt' % (level + 1), '-r b%d.txt' % (level + 1)]
+    visited['a40.txt'] = ['py_serial==2.7']
+    graph = DependencyGraph.from_visited(visited)
+    paths = graph.paths_to('py_serial==2.7')
+    assert [len(p) for p in paths] == [42]
+    assert paths[0][0] == 'a0.txt'
+    # names are compared the way pip does it
+    assert graph.find('Py.Serial') == ['py_serial==2.7']
+
+
+def test_same_pin_in_two_files():
+    graph = DependencyGraph.from_visited(OrderedDict([('requirements.txt', ['-r vision.txt', '-r control.txt']),
+                                                      ('vision.txt', ['numpy==1.8.0']),
+                                                      ('control.txt', ['-r vision.txt', 'numpy==1.8.0'])]))
+    # every file pinning numpy is listed
+    assert graph.paths_to('numpy==1.8.0') == [['requirements.txt', 'vision.txt', 'numpy==1.8.0'],
+                                              ['requirements.txt', 'control.txt', 'numpy==1.8.0']]
+
+
+def test_included_files():
+    graph = DependencyGraph.from_visited(OrderedDict([('requirements.txt', ['-r common.txt', '-c pins.txt', 'pep8']),
+                                                      ('common.txt', ['numpy==1.7.2']),
+                                                      ('pins.txt', ['numpy==1.8.0'])]))
+    assert graph.paths_to('numpy==1.7.2') == [['requirements.txt', 'common.txt', 'numpy==1.7.2']]
+    assert graph.children['pins.txt'] == []
+    assert graph.find('numpy') == ['numpy==1.7.2']
+
+
+def test_json_round_trip():
+    graph = DependencyGraph.from_visited(_visited_sites(), [], [RequirementSpecifier(specifier='numpy==1.8.0')],
+                                         {'numpy': RequirementSpecifier(specifier='numpy==1.8.0')})
+    loaded = DependencyGraph.from_json(graph.to_json())
+    assert loaded.nodes == graph.nodes
+    assert loaded.children == graph.children
+    assert loaded.parents == graph.parents
+    assert loaded.selected == graph.selected
+    assert loaded.constraints == graph.constraints
+
+
+def test_graph_commands(tmpdir, make_robustus, capsys):
+    robustus_obj = make_robustus()
+    requirements_file = tmpdir.join('requirements.txt')
+    requirements_file.write('numpy==1.7.2\nscipy==0.13.3\n')
+
+    with pytest.raises(robustus.robustus.RobustusException):
+        robustus_obj.execute(['why', 'numpy'])
+
+    robustus_obj.execute(['graph', '--format', 'json', '-r', str(requirements_file)])
+    graph = json.loads(capsys.readouterr()[0])
+    assert [n['id'] for n in graph['nodes']] == [str(requirements_file), 'numpy==1.7.2', 'scipy==0.13.3']
+    assert all(n['selected'] for n in graph['nodes'][1:])
+
+    robustus_obj.execute(['why', 'scipy', '-r', str(requirements_file)])
+    assert capsys.readouterr()[0] == 'scipy==0.13.3 [to be installed]\n    %s -> scipy==0.13.3\n' % requirements_file
+
+    # graph of the last install is used if no requirements are given
+    with open(os.path.join(robustus_obj.env, Robustus.graph_file_path), 'w') as f:
+        f.write(robustus_obj.dependency_graph.to_json())
+    robustus_obj.execute(['graph'])
+    assert capsys.readouterr()[0].startswith('digraph requirements {')
+
+
+def test_conflicts():
+    graph = DependencyGraph.from_visited(_visited_sites(), ['opencv'])
+    assert graph.conflicts() == OrderedDict([('numpy', ['numpy==1.7.2', 'numpy==1.8.0'])])
+    assert graph.describe_conflicts() == ('numpy is required in different versions:\n'
+                                          '    numpy==1.7.2, included from:\n'
+                                          '        requirements.txt\n'
+                                          '    numpy==1.8.0, included from:\n'
+                                          '        -e git+https://github.com/company/vision@master#egg=vision\n')
+
+    # different branches of the same editable package
+    graph = DependencyGraph.from_visited({'a.txt': ['-e git+https://github.com/company/vision@master#egg=vision'],
+                                          'b.txt': ['-e git+https://github.com/company/vision@release#egg=vision']})
+    assert graph.conflicts().keys() == ['vision']
+
+
+def test_constrained_conflicts(tmpdir, make_robustus):
+    robustus_obj = make_robustus()
+    robustus_obj.settings['ignore_missing_refs'] = False
+    requirements_file = tmpdir.join('requirements.txt')
+    requirements_file.write('numpy==1.7.2\nscipy==0.13.3\n')
+    constraints_file = tmpdir.join('pins.txt')
+    constraints_file.write('NumPy==1.8.1\nscipy\n')
+    requirements, _ = robustus_obj._resolve_requirements(['numpy==1.8.0', 'scipy==0.14.0'], [str(requirements_file)],
+                                                         None, None, [str(constraints_file)])
+    # every numpy pin is replaced by the constraint, scipy constraint doesn't pin a version
+    assert [r.freeze() for r in requirements] == ['NumPy==1.8.1', 'scipy==0.13.3']
+    graph = robustus_obj.dependency_graph
+    assert graph.constraints == OrderedDict([('numpy', 'NumPy==1.8.1')])
+    assert graph.conflicts().keys() == ['scipy']
+
+
+def test_install_fail_on_conflict(tmpdir, make_robustus):
+    robustus_obj = make_robustus()
+    requirements_file = tmpdir.join('requirements.txt')
+    requirements_file.write('numpy==1.7.2\n')
+    # install would fail on fake pip if it started
+    with pytest.raises(robustus.robustus.RobustusException) as exc_info:
+        robustus_obj.execute(['install', '--fail-on-conflict', '-r', str(requirements_file), 'numpy==1.8.0'])
+    assert 'numpy==1.7.2' in str(exc_info.value)
+    assert 'numpy==1.8.0' in str(exc_info.value)
+
+
+def test_doc_tests():
+    doctest.testmod(robustus.detail.dependency_graph, raise_on_error=True)
+
+
+if __name__ == '__main__':
+    pytest.main('-s %s -n0' % __file__)
@@ -0,0 +1,145 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+import os
+import pytest
+import subprocess
+import sys
+from robustus.detail import elf
+from robustus.detail.utility import fix_rpaths, run_shell
+
+
+def _have_tools():
+    with open(os.devnull, 'w') as devnull:
+        return all(subprocess.call(['which', tool], stdout=devnull) == 0 for tool in ['gcc', 'readelf'])
+
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux') or not _have_tools(),
+                                reason='requires linux with gcc and readelf')
+
+PLACEHOLDER = '/placeholder/for/a/long/install/directory'
+
+
+def _build(directory, name, rpath=None, new_dtags=True, libs=(), executable=False):
+    source = directory.join('%s.c' % name)
+    if executable:
+        source.write('int main(void) { return 0; }\n')
+        output = str(directory.join(name))
+        command = ['gcc', '-o', output, str(source)]
+    else:
+        # call functions of libraries it is linked with, so that linker doesn't drop them
+        calls = [os.path.basename(lib)[3:-3] for lib in libs]
+        source.write(''.join('int robustus_%s(void);\n' % c for c in calls) +
+                     'int robustus_%s(void) { return 1%s; }\n' % (name, ''.join(' + robustus_%s()' % c for c in calls)))
+        output = str(directory.join('lib%s.so' % name))
+        command = ['gcc', '-shared', '-fPIC', '-o', output, str(source)]
+    for lib in libs:
+        command += ['-L%s' % os.path.dirname(lib), '-l%s' % os.path.basename(lib)[3:-3]]
+    if rpath is not None:
+        command.append('-Wl,-rpath,%s' % rpath)
+        command.append('-Wl,--enable-new-dtags' if new_dtags else '-Wl,--disable-new-dtags')
+    assert run_shell(command) == 0
+    return output
+
+
+def _readelf_rpath(path):
+    for line in subprocess.check_output(['readelf', '-d', path]).splitlines():
+        if '(RPATH)' in line or '(RUNPATH)' in line:
+            return line[line.index('[') + 1:line.rindex(']')]
+    return None
+
+
+def _loads(library):
+    env = dict(os.environ)
+    env.pop('LD_LIBRARY_PATH', None)
+    return subprocess.call([sys.executable, '-c', 'import ctypes; ctypes.CDLL("%s")' % library], env=env) == 0
+
+
+def test_set_rpath_in_place(tmpdir):
+    for new_dtags, tag in [(True, elf.DT_RUNPATH), (False, elf.DT_RPATH)]:
+        library = _build(tmpdir, 'dtags%d' % new_dtags, PLACEHOLDER, new_dtags)
+        f = elf.ElfFile(library)
+        assert f.rpath() == PLACEHOLDER
+        assert f.rpath_entry()[0] == tag
+
+        size = os.path.getsize(library)
+        f.set_rpath('/usr/lib')
+        assert os.path.getsize(library) == size
+        assert _readelf_rpath(library) == '/usr/lib'
+        assert elf.ElfFile(library).rpath() == '/usr/lib'
+        assert _loads(library)
+
+
+def test_set_rpath_growing(tmpdir):
+    # rpath is longer than the old one
+    library = _build(tmpdir, 'short', '/a')
+    assert not elf.add_rpath(library, PLACEHOLDER)
+    assert elf.add_rpath(library, PLACEHOLDER, grow=True)
+    assert _readelf_rpath(library) == '/a:' + PLACEHOLDER
+    assert elf.ElfFile(library).rpath_entry()[0] == elf.DT_RUNPATH
+    assert _loads(library)
+    # directory already in rpath
+    size = os.path.getsize(library)
+    assert elf.add_rpath(library, PLACEHOLDER)
+    assert os.path.getsize(library) == size
+
+    # library without rpath finds its dependency after rpath is added
+    dep_dir = tmpdir.mkdir('dep')
+    dep = _build(dep_dir, 'dep')
+    main_dir = tmpdir.mkdir('main')
+    main = _build(main_dir, 'main', libs=[dep])
+    assert elf.ElfFile(main).rpath() == ''
+    assert not _loads(main)
+    assert elf.add_rpath(main, str(dep_dir), grow=True)
+    assert elf.add_rpath(main, str(main_dir), grow=True)
+    assert _readelf_rpath(main) == '%s:%s' % (dep_dir, main_dir)
+    assert elf.ElfFile(main).needed()[0] == 'libdep.so'
+    assert _loads(main)
+
+
+def test_rpath_of_executable_is_not_grown(tmpdir):
+    executable = _build(tmpdir, 'program', '/a', executable=True)
+    assert not elf.add_rpath(executable, PLACEHOLDER, grow=True)
+    assert _readelf_rpath(executable) == '/a'
+    assert elf.add_rpath(executable, '/a')
+
+    not_elf = tmpdir.join('script.sh')
+    not_elf.write('#!/bin/sh\n')
+    with pytest.raises(elf.ElfError):
+        elf.ElfFile(str(not_elf))
+
+
+def test_fix_rpaths(tmpdir):
+    env = tmpdir.mkdir('env')
+    # patchelf stand-in recording files it was asked to change
+    calls = env.join('patchelf_calls')
+    patchelf = env.mkdir('bin').join('patchelf')
+    patchelf.write('#!/bin/sh\nif [ "$1" = "--print-rpath" ]; then echo; else echo "$@" >> %s; fi\n' % calls)
+    patchelf.chmod(0755)
+
+    libraries = [_build(tmpdir, 'lib%d' % i, PLACEHOLDER if i % 2 else None) for i in range(8)]
+    executable = _build(tmpdir, 'program', executable=True)
+    # rpaths which have to grow are set by patchelf
+    assert fix_rpaths(None, str(env), libraries + [executable], '/opt/lib') == 0
+    assert calls.read().splitlines() == ['--set-rpath /opt/lib %s' % f for f in libraries + [executable]]
+    calls.remove()
+
+    for jobs in [1, None]:
+        assert fix_rpaths(None, str(env), libraries + [executable], '/opt/lib%s' % jobs, jobs=jobs, grow=True) == 0
+    for i, library in enumerate(libraries):
+        expected = [PLACEHOLDER] if i % 2 else []
+        assert _readelf_rpath(library) == ':'.join(expected + ['/opt/lib1', '/opt/libNone'])
+        assert _loads(library)
+    # only the executable needed patchelf
+    assert calls.read().splitlines() == ['--set-rpath /opt/lib1 %s' % executable,
+                                         '--set-rpath /opt/libNone %s' % executable]
+    # files which rpath contains the directory are skipped
+    calls.remove()
+    assert fix_rpaths(None, str(env), libraries, '/opt/lib1') == 0
+    assert not calls.exists()
+
+
+if __name__ == '__main__':
+    pytest.main('-s %s -n0' % __file__)
@@ -0,0 +1,213 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+import BaseHTTPServer
+import hashlib
+import os
+import pytest
+import subprocess
+import threading
+from robustus.detail import RequirementException
+from robustus.detail.utility import download
+
+
+def test_fetch_url(tmpdir, make_robustus):
+    robustus = make_robustus()
+    source = tmpdir.join('pkg-1.0.tar.gz')
+    source.write('pkg source')
+    digest = hashlib.sha256('pkg source').hexdigest()
+
+    path = robustus.fetcher.fetch_url('file://' + str(source), sha256=digest)
+    assert path == os.path.join(robustus.cache, 'downloads', 'pkg-1.0.tar.gz')
+    assert open(path).read() == 'pkg source'
+
+    # cached file is used
+    source.remove()
+    assert robustus.fetcher.fetch_url('file://' + str(source), sha256=digest) == path
+
+    # but not if it was corrupted
+    with open(path, 'w') as f:
+        f.write('corrupted')
+    with pytest.raises(RequirementException):
+        robustus.fetcher.fetch_url('file://' + str(source), sha256=digest)
+    assert not os.path.exists(path)
+
+
+def test_fetch_url_checksum_mismatch(tmpdir, make_robustus):
+    robustus = make_robustus()
+    source = tmpdir.join('pkg-1.0.tar.gz')
+    source.write('pkg source')
+    with pytest.raises(RequirementException):
+        robustus.fetcher.fetch_url('file://' + str(source), sha256=hashlib.sha256('other').hexdigest())
+    assert os.listdir(os.path.join(robustus.cache, 'downloads')) == []
+
+
+def test_fetch_url_offline(tmpdir, make_robustus):
+    robustus = make_robustus()
+    source = tmpdir.join('pkg-1.0.tar.gz')
+    source.write('pkg source')
+    robustus.settings['offline'] = True
+    with pytest.raises(RequirementException):
+        robustus.fetcher.fetch_url('file://' + str(source))
+
+
+class _RangeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    content = 'x' * 1000 + 'y' * 1000
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        start = 0
+        if 'Range' in self.headers:
+            start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(self.content) - start))
+        self.end_headers()
+        self.wfile.write(self.content[start:])
+
+
+def test_download_resume(tmpdir):
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _RangeHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        filename = str(tmpdir.join('archive.tar.gz'))
+        with open(filename + '.part', 'w') as f:
+            f.write('x' * 1000)
+        url = 'http://127.0.0.1:%d/archive.tar.gz' % server.server_address[1]
+        assert download(url, filename, resume=True, return_digest=True) == \
+            (filename, hashlib.sha256(_RangeHandler.content).hexdigest())
+        assert open(filename).read() == _RangeHandler.content
+        assert not os.path.exists(filename + '.part')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_clone(tmpdir, make_robustus):
+    robustus = make_robustus()
+    repo = str(tmpdir.mkdir('repo'))
+    git = ['git', '-c', 'user.name=test', '-c', 'user.email=test@test']
+    subprocess.check_call(['git', 'init', '-q', repo])
+    with open(os.path.join(repo, 'README'), 'w') as f:
+        f.write('master')
+    subprocess.check_call(git + ['add', 'README'], cwd=repo)
+    subprocess.check_call(git + ['commit', '-q', '-m', 'master'], cwd=repo)
+    subprocess.check_call(git + ['checkout', '-q', '-b', 'release'], cwd=repo)
+    with open(os.path.join(repo, 'README'), 'w') as f:
+        f.write('release')
+    subprocess.check_call(git + ['commit', '-q', '-a', '-m', 'release'], cwd=repo)
+
+    dest = str(tmpdir.join('clone'))
+    robustus.fetcher.clone(repo, dest, branch='release')
+    assert open(os.path.join(dest, 'README')).read() == 'release'
+    assert subprocess.check_output(['git', 'config', 'remote.origin.url'], cwd=dest).strip() == repo
+    assert robustus.fetcher.git_mirrors.has(repo)
+
+    # repository is cloned from local mirror when it's unreachable
+    os.rename(repo, repo + '_moved')
+    fetcher = make_robustus(root=tmpdir.mkdir('second')).fetcher
+    fetcher.git_mirrors = robustus.fetcher.git_mirrors
+    fetcher.git_mirrors._fetched.clear()
+    dest = str(tmpdir.join('clone2'))
+    fetcher.clone(repo, dest, branch='release')
+    assert open(os.path.join(dest, 'README')).read() == 'release'
+
+
+def _commit_files(path, files, message='commit'):
+    git = ['git', '-c', 'user.name=test', '-c', 'user.email=test@test']
+    if not os.path.isdir(os.path.join(path, '.git')):
+        subprocess.check_call(['git', 'init', '-q', path])
+    for name, content in files.items():
+        if not os.path.isdir(os.path.dirname(os.path.join(path, name))):
+            os.makedirs(os.path.dirname(os.path.join(path, name)))
+        with open(os.path.join(path, name), 'w') as f:
+            f.write(content)
+        subprocess.check_call(git + ['add', name], cwd=path)
+    subprocess.check_call(git + ['commit', '-q', '-m', message], cwd=path)
+
+
+def test_clone_sparse(tmpdir, make_robustus):
+    robustus = make_robustus()
+    repo = str(tmpdir.join('repo'))
+    _commit_files(repo, {'README': 'readme', 'pkg_a/package.xml': 'a', 'pkg_b/package.xml': 'b'})
+    dest = str(tmpdir.join('clone'))
+    robustus.fetcher.clone(repo, dest, paths=['pkg_a'])
+    assert sorted(os.listdir(dest)) == ['.git', 'pkg_a']
+    assert open(os.path.join(dest, 'pkg_a', 'package.xml')).read() == 'a'
+
+
+def test_mirror_fetches_requested_refs(tmpdir, make_robustus):
+    robustus = make_robustus()
+    repo = str(tmpdir.join('repo'))
+    _commit_files(repo, {'README': 'master'})
+    git = ['git', '-c', 'user.name=test', '-c', 'user.email=test@test']
+    subprocess.check_call(git + ['checkout', '-q', '-b', 'release'], cwd=repo)
+    _commit_files(repo, {'README': 'release'}, 'release')
+    release = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=repo).strip()
+    subprocess.check_call(git + ['update-ref', 'refs/pull/1/head', 'HEAD'], cwd=repo)
+    subprocess.check_call(git + ['checkout', '-q', 'master'], cwd=repo)
+    # server lets clients fetch file contents on demand
+    subprocess.check_call(['git', 'config', 'uploadpack.allowFilter', 'true'], cwd=repo)
+    url = 'file://' + repo
+
+    def mirror_refs():
+        return subprocess.check_output(['git', '--git-dir', mirrors.path(url), 'for-each-ref',
+                                        '--format=%(refname)']).split()
+
+    mirrors = robustus.fetcher.git_mirrors
+    mirrors.update(url)
+    assert mirror_refs() == ['refs/heads/master']
+    assert mirrors.is_partial(url)
+    mirrors.update(url, 'release')
+    assert mirror_refs() == ['refs/heads/master', 'refs/heads/release']
+
+    # files are fetched when needed
+    assert '?' in subprocess.check_output(['git', '--git-dir', mirrors.path(url), 'rev-list', '--objects',
+                                           '--missing=print', '--no-walk', 'release'])
+
+    # working copy is checked out from the mirror with files fetched at once
+    dest = str(tmpdir.join('clone'))
+    robustus.fetcher.clone(url, dest, branch='release')
+    assert open(os.path.join(dest, 'README')).read() == 'release'
+    assert mirrors.fetch_blobs(url, 'release')
+    # files of other commits are fetched from origin
+    assert subprocess.check_output(['git', 'show', 'origin/master:README'], cwd=dest) == 'master'
+
+    # commit which is not a branch or tag is fetched without fetching pull requests
+    mirrors = make_robustus(root=tmpdir.mkdir('second')).fetcher.git_mirrors
+    mirrors.update(url, release)
+    assert 'refs/pull/1/head' not in mirror_refs()
+    assert subprocess.check_output(['git', '--git-dir', mirrors.path(url), 'rev-parse', release + '^{commit}'],
+                                   ).strip() == release
+
+
+def test_clone_submodules_from_mirror(tmpdir, make_robustus):
+    robustus = make_robustus()
+    submodule = str(tmpdir.join('submodule'))
+    _commit_files(submodule, {'lib.c': 'lib'})
+    repo = str(tmpdir.join('repo'))
+    _commit_files(repo, {'README': 'readme'})
+    subprocess.check_call(['git', '-c', 'protocol.file.allow=always', 'submodule', 'add', '-q',
+                           'file://' + submodule, 'lib'], cwd=repo)
+    subprocess.check_call(['git', '-c', 'user.name=test', '-c', 'user.email=test@test',
+                           'commit', '-q', '-m', 'submodule'], cwd=repo)
+
+    robustus.fetcher.clone(repo, str(tmpdir.join('clone')), submodules=True)
+    assert open(str(tmpdir.join('clone', 'lib', 'lib.c'))).read() == 'lib'
+    assert robustus.fetcher.git_mirrors.has('file://' + submodule)
+
+    # submodule is served from its local mirror when it's unreachable
+    os.rename(submodule, submodule + '_moved')
+    robustus.fetcher.clone(repo, str(tmpdir.join('clone2')), submodules=True)
+    assert open(str(tmpdir.join('clone2', 'lib', 'lib.c'))).read() == 'lib'
+
+
+if __name__ == '__main__':
+    pytest.main('-s %s -n0' % __file__)
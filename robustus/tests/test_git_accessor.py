@@ -3,8 +3,11 @@
 # License under MIT license (see LICENSE file)
 # =============================================================================
 
+import os
 import pytest
+import subprocess
 from robustus.detail.git_accessor import GitAccessor
+from robustus.detail.git_mirror import GitMirrorStore
 from subprocess import CalledProcessError
 
 
@@ -23,7 +26,37 @@ def test_git_accessor():
     except CalledProcessError:
         exception_occured = True
     assert(exception_occured)
-    
+
+
+def test_git_accessor_mirror(tmpdir):
+    repo = str(tmpdir.join('repo'))
+    git = ['git', '-c', 'user.name=test', '-c', 'user.email=test@test']
+    subprocess.check_call(['git', 'init', '-q', repo])
+    with open(os.path.join(repo, 'requirements.txt'), 'w') as f:
+        f.write('pep8==1.4.6\n')
+    subprocess.check_call(git + ['add', 'requirements.txt'], cwd=repo)
+    subprocess.check_call(git + ['commit', '-q', '-m', 'master'], cwd=repo)
+    subprocess.check_call(git + ['tag', 'v1'], cwd=repo)
+    with open(os.path.join(repo, 'requirements.txt'), 'w') as f:
+        f.write('pep8==1.5.7\n')
+    subprocess.check_call(git + ['commit', '-q', '-a', '-m', 'update'], cwd=repo)
+
+    mirrors = GitMirrorStore(str(tmpdir.join('mirrors')))
+    accessor = GitAccessor(mirrors)
+    assert accessor.access(repo, None, 'requirements.txt') == ['pep8==1.5.7\n']
+    assert accessor.access(repo, 'v1', 'requirements.txt') == ['pep8==1.4.6\n']
+    assert mirrors.has(repo)
+    assert accessor.access(repo, 'missing', 'requirements.txt', ignore_missing_refs=True) == ['pep8==1.5.7\n']
+    with pytest.raises(CalledProcessError):
+        accessor.access(repo, 'missing', 'requirements.txt')
+    with pytest.raises(IOError):
+        accessor.access(repo, None, 'setup.py')
+
+    # mirror is fetched once per run and read without network afterwards
+    os.rename(repo, repo + '_moved')
+    assert accessor.access(repo, 'v1', 'requirements.txt') == ['pep8==1.4.6\n']
+    assert GitAccessor(mirrors).access(repo, 'v1', 'requirements.txt') == ['pep8==1.4.6\n']
+
 
 if __name__ == '__main__':
     pytest.main('-s %s -n0' % __file__)
@@ -0,0 +1,83 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+import doctest
+import os
+import pytest
+import robustus
+import threading
+import time
+from robustus.detail.governor import Governor, TokenBucket
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=100000, burst=10000)
+    start = time.time()
+    for i in range(5):
+        bucket.consume(10000)
+    # burst is free, then 40000 bytes at 100000 bytes per second
+    assert 0.35 < time.time() - start < 1.
+
+
+def test_throttle():
+    governor = Governor(host_bwlimits={'mirror.lan': 100})
+    assert governor.throttle('http://other.net/archive.tar.gz') is None
+    assert governor.throttle('http://mirror.lan/archive.tar.gz') is not None
+    assert governor.host_bwlimit('http://mirror.lan/archive.tar.gz') == 100
+
+    governor = Governor(bwlimit=50, host_bwlimits={'mirror.lan': 100})
+    assert governor.throttle('http://other.net/archive.tar.gz') is not None
+    assert governor.host_bwlimit('http://mirror.lan/archive.tar.gz') == 50
+
+
+def test_command():
+    assert Governor().command(['rsync', '-r', 'server:/cache', '.']) == ['rsync', '-r', 'server:/cache', '.']
+    governor = Governor(bwlimit=1000, host_bwlimits={'server': 200.5})
+    assert governor.command(['rsync', '-r', 'server:/cache', '.'], 'server:/cache') == \
+        ['rsync', '--bwlimit=200', '-r', 'server:/cache', '.']
+    assert governor.command(['rsync', '-r', 'other:/cache', '.'], 'other:/cache') == \
+        ['rsync', '--bwlimit=1000', '-r', 'other:/cache', '.']
+
+    cmd = Governor(background=True).command(['rsync', '-r', 'server:/cache', '.'])
+    assert cmd[:3] == ['nice', '-n', '19']
+    assert cmd[-4:] == ['rsync', '-r', 'server:/cache', '.']
+
+
+def test_max_transfers():
+    governor = Governor(max_transfers=2)
+    lock = threading.Lock()
+    active = [0]
+    max_active = [0]
+
+    def transfer():
+        with governor.slot():
+            with lock:
+                active[0] += 1
+                max_active[0] = max(max_active[0], active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+
+    threads = [threading.Thread(target=transfer) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert max_active[0] == 2
+
+    assert Governor(background=True).max_transfers == 1
+    # priority of robustus itself is left alone, only external tools run with low priority
+    niceness = os.nice(0)
+    with Governor(background=True).slot():
+        pass
+    assert os.nice(0) == niceness
+
+
+def test_doc_tests():
+    doctest.testmod(robustus.detail.governor, raise_on_error=True)
+
+
+if __name__ == '__main__':
+    pytest.main('-s %s -n0' % __file__)
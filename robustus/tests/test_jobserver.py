@@ -0,0 +1,71 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+import doctest
+import pytest
+import robustus
+import threading
+import time
+from robustus.detail.jobserver import JobServer
+from robustus.detail.utility import run_shell
+
+
+# every job records number of jobs running at the time it started
+MAKEFILE = '''all: a b c d
+a b c d:
+\t@touch running/$@; ls running | wc -l >> counts; sleep 0.3; rm running/$@
+'''
+
+
+def test_slots():
+    jobserver = JobServer(3)
+    taken = []
+
+    def take_slot():
+        with jobserver.slots():
+            taken.append(True)
+
+    with jobserver.slots(5) as slots:
+        assert slots == 3
+        thread = threading.Thread(target=take_slot)
+        thread.daemon = True
+        thread.start()
+        time.sleep(0.2)
+        # no slot is free
+        assert taken == []
+    thread.join(5)
+    assert taken == [True]
+
+    with JobServer(1).slots(4) as slots:
+        assert slots == 1
+
+
+def _max_parallel_jobs(tmpdir, jobserver):
+    build_dir = tmpdir.mkdir('build%d' % jobserver.jobs)
+    build_dir.join('Makefile').write(MAKEFILE)
+    build_dir.mkdir('running')
+    with jobserver.slots():
+        assert run_shell(['make', '-C', str(build_dir)], env=jobserver.environ()) == 0
+    return max(int(c) for c in build_dir.join('counts').read().split())
+
+
+@pytest.mark.skipif(run_shell('which make', shell=True) != 0, reason='requires make')
+def test_make_uses_jobserver(tmpdir):
+    assert _max_parallel_jobs(tmpdir, JobServer(1)) == 1
+    assert _max_parallel_jobs(tmpdir, JobServer(2)) == 2
+
+    # make running in parallel with a command holding all other slots runs jobs one by one
+    jobserver = JobServer(3)
+    with jobserver.slots(2) as slots:
+        assert slots == 2
+        assert _max_parallel_jobs(tmpdir, jobserver) == 1
+
+
+def test_doc_tests():
+    doctest.testmod(robustus.detail.jobserver, raise_on_error=True)
+
+
+if __name__ == '__main__':
+    pytest.main('-s %s -n0' % __file__)
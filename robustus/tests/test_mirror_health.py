@@ -0,0 +1,74 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+import os
+import pytest
+import time
+import urllib2
+from robustus.detail.mirror_health import MirrorHealth
+
+
+def test_mirrors_ordered_by_health(tmpdir):
+    filename = os.path.join(str(tmpdir), 'mirror_health.json')
+    health = MirrorHealth(filename)
+    mirrors = ['http://slow', 'http://fast', 'http://new']
+    health.record_success('http://slow', 2.)
+    health.record_success('http://fast', 0.1)
+    assert health.order(mirrors) == ['http://new', 'http://fast', 'http://slow']
+
+    health.record_failure('http://new')
+    assert health.order(mirrors) == ['http://fast', 'http://slow', 'http://new']
+
+    # health persists between runs
+    assert MirrorHealth(filename).order(mirrors) == ['http://fast', 'http://slow', 'http://new']
+
+
+def test_circuit_breaker(tmpdir):
+    health = MirrorHealth(os.path.join(str(tmpdir), 'mirror_health.json'))
+    mirrors = ['http://dead', 'http://alive']
+    for i in range(MirrorHealth.failure_threshold):
+        assert not health.is_tripped('http://dead')
+        health.record_failure('http://dead')
+    assert health.is_tripped('http://dead')
+    assert health.order(mirrors) == ['http://alive']
+
+    # total outage doesn't block anything
+    for i in range(MirrorHealth.failure_threshold):
+        health.record_failure('http://alive')
+    assert health.order(mirrors) == mirrors
+
+    # mirror gets a trial after cooldown
+    health.stats['http://dead']['last_failure'] = time.time() - MirrorHealth.cooldown - 1
+    assert not health.is_tripped('http://dead')
+
+
+def test_connection_errors_count_as_failures(tmpdir):
+    health = MirrorHealth(os.path.join(str(tmpdir), 'mirror_health.json'))
+    with pytest.raises(urllib2.URLError):
+        health.open_url('http://127.0.0.1:1', 'http://127.0.0.1:1/archive.tar.gz', timeout=5)
+    assert health.stats['http://127.0.0.1:1']['consecutive_failures'] == 1
+
+
+def test_race(tmpdir):
+    health = MirrorHealth(os.path.join(str(tmpdir), 'mirror_health.json'))
+    mirror1 = str(tmpdir.mkdir('mirror1'))
+    mirror2 = str(tmpdir.mkdir('mirror2'))
+    with open(os.path.join(mirror2, 'archive.tar.gz'), 'w') as f:
+        f.write('archive')
+
+    candidates = [('file://' + mirror1, 'file://' + mirror1 + '/archive.tar.gz'),
+                  ('file://' + mirror2, 'file://' + mirror2 + '/archive.tar.gz')]
+    mirror, url, response = health.race(candidates)
+    assert mirror == 'file://' + mirror2
+    assert response.read() == 'archive'
+    # missing files don't make mirror unhealthy
+    assert health.stats['file://' + mirror1]['consecutive_failures'] == 0
+
+    with pytest.raises(urllib2.URLError):
+        health.race(candidates[:1])
+
+
+if __name__ == '__main__':
+    pytest.main('-s %s -n0' % __file__)
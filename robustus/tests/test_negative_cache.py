@@ -0,0 +1,90 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+import os
+import pytest
+import time
+import urllib2
+from robustus.detail import RequirementSpecifier
+from robustus.detail.mirror_health import MirrorHealth, MirrorsFailed, is_missing_error
+from robustus.detail.negative_cache import NegativeCache
+
+
+def test_negative_cache(tmpdir):
+    filename = os.path.join(str(tmpdir), 'negative_cache.json')
+    cache = NegativeCache(filename)
+    assert not cache.is_missing('http://mirror', 'OpenCV-2.4.8.tar.gz')
+    cache.add('http://mirror', 'OpenCV-2.4.8.tar.gz')
+    cache.add('http://mirror', 'wheel:numpy==1.7.1')
+    assert cache.is_missing('http://mirror', 'OpenCV-2.4.8.tar.gz')
+    assert not cache.is_missing('http://other_mirror', 'OpenCV-2.4.8.tar.gz')
+
+    # failed lookups persist between runs
+    cache = NegativeCache(filename)
+    assert cache.is_missing('http://mirror', 'OpenCV-2.4.8.tar.gz')
+
+    # entries expire
+    cache.entries['http://mirror OpenCV-2.4.8.tar.gz'] = time.time() - cache.ttl - 1
+    assert not cache.is_missing('http://mirror', 'OpenCV-2.4.8.tar.gz')
+
+
+def test_negative_cache_invalidate(tmpdir):
+    cache = NegativeCache(os.path.join(str(tmpdir), 'negative_cache.json'))
+    cache.add('http://mirror', 'OpenCV-2.4.8.tar.gz')
+    cache.add('http://mirror', 'bullet-2.81.tar.gz')
+    cache.add('http://mirror', 'wheel:numpy==1.7.1')
+    assert cache.invalidate(['OpenCV-*', 'numpy*']) == 2
+    assert not cache.is_missing('http://mirror', 'OpenCV-2.4.8.tar.gz')
+    assert not cache.is_missing('http://mirror', 'wheel:numpy==1.7.1')
+    assert cache.is_missing('http://mirror', 'bullet-2.81.tar.gz')
+    assert cache.invalidate() == 1
+    assert len(cache.entries) == 0
+
+
+def test_disabled_negative_cache(tmpdir):
+    cache = NegativeCache(os.path.join(str(tmpdir), 'negative_cache.json'), ttl=0)
+    cache.add('http://mirror', 'OpenCV-2.4.8.tar.gz')
+    assert not cache.is_missing('http://mirror', 'OpenCV-2.4.8.tar.gz')
+
+
+def test_missing_errors(tmpdir):
+    health = MirrorHealth(os.path.join(str(tmpdir), 'mirror_health.json'))
+    mirror = 'file://' + str(tmpdir)
+    with pytest.raises(MirrorsFailed) as e:
+        health.race([(mirror, mirror + '/archive.tar.gz')])
+    assert len(e.value.errors) == 1
+    _, url, error = e.value.errors[0]
+    assert is_missing_error(url, error)
+
+    not_found = urllib2.HTTPError('http://mirror/a.tar.gz', 404, 'Not Found', None, None)
+    assert is_missing_error('http://mirror/a.tar.gz', not_found)
+    server_error = urllib2.HTTPError('http://mirror/a.tar.gz', 503, 'Unavailable', None, None)
+    assert not is_missing_error('http://mirror/a.tar.gz', server_error)
+    assert not is_missing_error('http://mirror/a.tar.gz', urllib2.URLError('timed out'))
+
+
+def test_remote_wheel_missing(tmpdir, make_robustus):
+    robustus = make_robustus()
+    find_link = 'file://' + str(tmpdir.mkdir('remote'))
+    find_links_url = find_link + '/python-wheels/index.html'
+    numpy = RequirementSpecifier(name='numpy', version='1.7.1')
+    # no wheels page
+    assert robustus._remote_wheel_missing(find_link, find_links_url, numpy)
+
+    tmpdir.join('remote', 'python-wheels', 'index.html').ensure().write(
+        '<a href="numpy-1.8.0-cp27-none-linux_x86_64.whl">numpy-1.8.0-cp27-none-linux_x86_64.whl</a>')
+    assert robustus._remote_wheel_missing(find_link, find_links_url, numpy)
+    tmpdir.join('remote', 'python-wheels', 'index.html').write(
+        '<a href="numpy-1.7.1-cp27-none-linux_x86_64.whl">numpy-1.7.1-cp27-none-linux_x86_64.whl</a>')
+    # pip failed for another reason, e.g. dependency of the wheel is missing
+    assert not robustus._remote_wheel_missing(find_link, find_links_url, numpy)
+
+    # unavailable mirror
+    assert not robustus._remote_wheel_missing('http://localhost:1', 'http://localhost:1/python-wheels/index.html',
+                                              numpy)
+
+
+if __name__ == '__main__':
+    pytest.main('-s %s -n0' % __file__)
@@ -0,0 +1,87 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+import os
+import pytest
+import subprocess
+from robustus.robustus import RobustusException
+from robustus.detail.git_accessor import OfflineGitAccessor
+from robustus.detail.git_mirror import GitMirrorStore
+
+
+def _make_repo(path):
+    """
+    Repository with different requirements.txt on master and release branches.
+    """
+    git = ['git', '-c', 'user.name=test', '-c', 'user.email=test@test']
+    subprocess.check_call(['git', 'init', '-q', path])
+    with open(os.path.join(path, 'requirements.txt'), 'w') as f:
+        f.write('pep8==1.4.6\n')
+    subprocess.check_call(git + ['add', 'requirements.txt'], cwd=path)
+    subprocess.check_call(git + ['commit', '-q', '-m', 'master'], cwd=path)
+    subprocess.check_call(git + ['checkout', '-q', '-b', 'release'], cwd=path)
+    with open(os.path.join(path, 'requirements.txt'), 'w') as f:
+        f.write('pep8==1.5.7\n')
+    subprocess.check_call(git + ['commit', '-q', '-a', '-m', 'release'], cwd=path)
+    subprocess.check_call(git + ['checkout', '-q', 'master'], cwd=path)
+    return path
+
+
+def test_offline_git_accessor(tmpdir):
+    repo = _make_repo(str(tmpdir.join('repo')))
+    mirrors = GitMirrorStore(str(tmpdir.join('mirrors')))
+    mirrors.update(repo)
+    mirrors.update(repo, 'release')
+    accessor = OfflineGitAccessor(mirrors, str(tmpdir.join('src')))
+    assert accessor.access(repo, None, 'requirements.txt') == ['pep8==1.4.6\n']
+    assert accessor.access(repo, 'release', 'requirements.txt') == ['pep8==1.5.7\n']
+    assert accessor.access(repo, 'missing', 'requirements.txt', ignore_missing_refs=True) == ['pep8==1.4.6\n']
+    assert accessor.missing == []
+
+    assert accessor.access(repo, 'missing', 'requirements.txt') == []
+    assert accessor.access('https://github.com/company/unknown', None, 'requirements.txt') == []
+    assert len(accessor.missing) == 2
+
+
+def test_offline_git_accessor_working_copy(tmpdir):
+    repo = _make_repo(str(tmpdir.join('repo')))
+    src = tmpdir.mkdir('src')
+    subprocess.check_call(['git', 'clone', '-q', repo, str(src.join('package'))])
+    accessor = OfflineGitAccessor(GitMirrorStore(str(tmpdir.join('mirrors'))), str(src))
+    # remote branches of working copy are used too
+    assert accessor.access(repo, 'release', 'requirements.txt') == ['pep8==1.5.7\n']
+    assert accessor.missing == []
+
+
+def test_offline_skips_remote_caches(tmpdir, make_robustus):
+    robustus = make_robustus('--offline', find_links=['http://localhost:1'])
+    assert robustus.find_links() == []
+    assert robustus.download_compiled_archive('OpenCV', '2.4.8') is None
+
+
+def test_offline_install_lists_missing(tmpdir, make_robustus):
+    robustus = make_robustus('--offline', find_links=['http://localhost:1'])
+    open(os.path.join(robustus.cache, 'pep8__1_4_6.rob'), 'w').close()
+    robustus.cached_packages = []
+    robustus = make_robustus('--offline')
+    repo = 'file://' + _make_repo(str(tmpdir.join('repo')))
+    robustus.fetcher.git_mirrors.update(repo, 'release')
+
+    with pytest.raises(RobustusException) as exc_info:
+        robustus.execute(['install', 'pep8==1.4.6', 'numpy==1.7.2',
+                          '-e', 'git+%s@release#egg=package' % repo,
+                          '-e', 'git+https://github.com/company/unknown#egg=unknown'])
+    message = str(exc_info.value)
+    assert 'numpy==1.7.2' in message
+    assert 'https://github.com/company/unknown' in message
+    # available in cache or local mirror
+    assert 'pep8==1.4.6' not in message
+    assert 'egg=package' not in message
+    # requirements of package on release branch were read from the mirror
+    assert 'pep8==1.5.7' in message
+
+
+if __name__ == '__main__':
+    pytest.main('-s %s -n0' % __file__)
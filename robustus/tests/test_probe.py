@@ -0,0 +1,111 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+import os
+import pkg_resources
+import pytest
+import robustus
+from robustus.detail.probe import PythonProbe
+import sys
+
+
+def test_probe_queries(tmpdir, make_robustus):
+    make_robustus(python=sys.executable)
+    env = tmpdir.join('env')
+    with PythonProbe(str(env)) as probe:
+        results = probe.query([('import', 'os'),
+                               ('import', 'module_which_does_not_exist'),
+                               ('file', str(env.join('.robustus'))),
+                               ('file', str(env.join('missing'))),
+                               ('exec', 'import sys; print "to stderr"'),
+                               ('distribution', 'pytest')])
+        assert results[0] == (None, None)
+        assert results[1][0].startswith('ImportError')
+        assert results[2] == (None, None)
+        assert results[3][0].startswith('IOError')
+        assert results[4] == (None, None)
+        assert results[5][0] is None
+        assert 'pytest' in results[5][1]['top_level']
+
+        # worker is reused between batches
+        pid = probe._process.pid
+        assert probe.query([('import', 'json')]) == [(None, None)]
+        assert probe._process.pid == pid
+
+        # query crashing interpreter doesn't affect other queries of the batch
+        results = probe.query([('import', 'os'), ('exec', 'import os; os._exit(1)'), ('import', 'json')])
+        assert results == [(None, None), ('python probe crashed', None), (None, None)]
+
+        # modules installed after worker started are found
+        site_packages = [p for p in sys.path if p.endswith('site-packages')][0]
+        module = os.path.join(site_packages, 'robustus_probe_test_module.py')
+        if os.access(site_packages, os.W_OK):
+            assert probe.query([('import', 'robustus_probe_test_module')])[0][0] is not None
+            try:
+                open(module, 'w').close()
+                assert probe.query([('import', 'robustus_probe_test_module')]) == [(None, None)]
+            finally:
+                os.remove(module)
+                if os.path.isfile(module + 'c'):
+                    os.remove(module + 'c')
+
+
+def test_probe_forgets_imports(tmpdir, make_robustus, monkeypatch):
+    make_robustus(python=sys.executable)
+    path = tmpdir.mkdir('path')
+    monkeypatch.setenv('PYTHONPATH', str(path))
+    package = path.mkdir('robustus_probe_test_package')
+    package.join('__init__.py').write('')
+    package.join('sub.py').write('raise ImportError("broken")\n')
+    with PythonProbe(str(tmpdir.join('env'))) as probe:
+        assert probe.query([('import', 'robustus_probe_test_package')]) == [(None, None)]
+        # parent package stays imported after import of its module fails
+        assert probe.query([('import', 'robustus_probe_test_package.sub')])[0][0] is not None
+
+        # package is removed during install
+        package.remove()
+        assert probe.query([('import', 'robustus_probe_test_package')])[0][0].startswith('ImportError')
+        assert probe.query([('import', 'robustus_probe_test_package.sub')])[0][0].startswith('ImportError')
+
+
+@pytest.mark.skipif(not os.access([p for p in sys.path if p.endswith('site-packages')][0], os.W_OK),
+                    reason='requires writable site-packages')
+def test_probe_processes_pth_files_once(tmpdir, make_robustus):
+    make_robustus(python=sys.executable)
+    site_packages = [p for p in sys.path if p.endswith('site-packages')][0]
+    pth_file = os.path.join(site_packages, 'robustus_probe_test.pth')
+    count_runs = 'import sys; sys.robustus_pth_runs = getattr(sys, "robustus_pth_runs", 0) + 1\n'
+    with PythonProbe(str(tmpdir.join('env'))) as probe:
+        try:
+            with open(pth_file, 'w') as f:
+                f.write(count_runs)
+            for i in range(3):
+                assert probe.query([('exec', 'import sys; assert sys.robustus_pth_runs == 1')]) == [(None, None)]
+        finally:
+            os.remove(pth_file)
+
+
+def test_verify(tmpdir, make_robustus, capsys):
+    robustus_obj = make_robustus(python=sys.executable)
+    pytest_version = pkg_resources.get_distribution('pytest').version
+
+    requirements_file = tmpdir.join('requirements.txt')
+    requirements_file.write('pytest==%s\nOpenCV==2.4.8\n' % pytest_version)
+    robustus_obj.execute(['verify', '-r', str(requirements_file)])
+    out = capsys.readouterr()[0]
+    assert 'pytest==%s: ok\n' % pytest_version in out
+    assert 'OpenCV==2.4.8: not checked (installed by robustus script)\n' in out
+
+    requirements_file.write('pytest==0.0.1\npackage-which-does-not-exist==1.0\n')
+    with pytest.raises(robustus.robustus.RobustusException) as exc_info:
+        robustus_obj.execute(['verify', '-r', str(requirements_file)])
+    assert '2 of 2' in str(exc_info.value)
+    out = capsys.readouterr()[0]
+    assert 'pytest==0.0.1: version %s is installed\n' % pytest_version in out
+    assert 'package-which-does-not-exist==1.0: DistributionNotFound' in out
+
+
+if __name__ == '__main__':
+    pytest.main('-s %s -n0' % __file__)
@@ -0,0 +1,145 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+import BaseHTTPServer
+import doctest
+import hashlib
+import os
+import pytest
+import re
+import robustus
+import SimpleHTTPServer
+import threading
+import urllib2
+import urlparse
+from robustus.detail.cache_catalog import CacheCatalog
+from robustus.detail.pypi_proxy import PypiProxy
+
+
+class _QuietHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def upstream(tmpdir, monkeypatch):
+    """
+    Simple index with pep8 package served over http.
+    """
+    root = tmpdir.mkdir('upstream')
+    root.mkdir('packages').join('pep8-1.4.6.tar.gz').write('pep8 source')
+    digest = hashlib.sha256('pep8 source').hexdigest()
+    root.mkdir('simple').mkdir('pep8').join('index.html').write(
+        '<html><body><a href="../../packages/pep8-1.4.6.tar.gz#sha256=%s">pep8-1.4.6.tar.gz</a>'
+        '<a href="../../packages/pep8-1.4.5.tar.gz#sha256=%s">pep8-1.4.5.tar.gz</a></body></html>'
+        % (digest, digest))
+    monkeypatch.chdir(str(root))
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:%d' % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+class _UnreachableNetwork(object):
+    HTTPError = urllib2.HTTPError
+    URLError = urllib2.URLError
+
+    @staticmethod
+    def urlopen(*args, **kwargs):
+        raise urllib2.URLError('unreachable')
+
+
+class _FailingServer(_UnreachableNetwork):
+    @staticmethod
+    def urlopen(url, *args, **kwargs):
+        raise urllib2.HTTPError(url, 503, 'Service Unavailable', None, None)
+
+
+def _links(proxy, page_url):
+    html = urllib2.urlopen(page_url).read()
+    return [urlparse.urljoin(page_url, href.replace('&amp;', '&')) for href in re.findall(r'href="([^"]*)"', html)]
+
+
+def test_pypi_proxy(tmpdir, upstream):
+    wheelhouse = str(tmpdir.mkdir('wheelhouse'))
+    pages_dir = os.path.join(wheelhouse, '.robustus', 'pypi_proxy')
+    catalog = CacheCatalog(wheelhouse, os.path.join(wheelhouse, '.robustus', 'catalog.json'))
+    with open(os.path.join(wheelhouse, 'pep8-1.4.4-py27-none-any.whl'), 'w') as f:
+        f.write('pep8 wheel')
+
+    with PypiProxy(wheelhouse, pages_dir, index_url=upstream + '/simple', catalog=catalog) as proxy:
+        links = _links(proxy, proxy.index_url + 'PEP8/')
+        assert len(links) == 3
+        assert links[0] == proxy.url + '/files/pep8-1.4.4-py27-none-any.whl'
+        assert all(l.startswith(proxy.url + '/files/') for l in links)
+        assert urllib2.urlopen(links[0]).read() == 'pep8 wheel'
+
+        # miss is downloaded into wheelhouse
+        assert urllib2.urlopen(links[1]).read() == 'pep8 source'
+        source = os.path.join(wheelhouse, 'pep8-1.4.6.tar.gz')
+        assert open(source).read() == 'pep8 source'
+        assert catalog.digest(source) == hashlib.sha256('pep8 source').hexdigest()
+
+        # upstream file doesn't exist
+        with pytest.raises(urllib2.HTTPError):
+            urllib2.urlopen(links[2])
+
+        with pytest.raises(urllib2.HTTPError):
+            urllib2.urlopen(proxy.index_url + 'unknown/')
+
+    # files in wheelhouse are served when upstream index is down
+    with PypiProxy(wheelhouse, pages_dir, index_url='http://127.0.0.1:1/simple', timeout=5) as proxy:
+        links = _links(proxy, proxy.index_url + 'pep8/')
+        assert links == [proxy.url + '/files/pep8-1.4.4-py27-none-any.whl',
+                         proxy.url + '/files/pep8-1.4.6.tar.gz']
+        assert urllib2.urlopen(links[1]).read() == 'pep8 source'
+
+
+def test_pypi_proxy_uses_saved_pages(tmpdir, upstream, monkeypatch):
+    wheelhouse = str(tmpdir.mkdir('wheelhouse'))
+    pages_dir = os.path.join(wheelhouse, '.robustus', 'pypi_proxy')
+    with PypiProxy(wheelhouse, pages_dir, index_url=upstream + '/simple') as proxy:
+        link = _links(proxy, proxy.index_url + 'pep8/')[0]
+        assert urllib2.urlopen(link).read() == 'pep8 source'
+
+    # upstream is unreachable, last fetched page is used
+    monkeypatch.setattr(robustus.detail.pypi_proxy, 'urllib2', _UnreachableNetwork)
+    with PypiProxy(wheelhouse, pages_dir, index_url=upstream + '/simple') as proxy:
+        assert len(_links(proxy, proxy.index_url + 'pep8/')) == 2
+    # server error doesn't drop saved page
+    monkeypatch.setattr(robustus.detail.pypi_proxy, 'urllib2', _FailingServer)
+    with PypiProxy(wheelhouse, pages_dir, index_url=upstream + '/simple') as proxy:
+        assert len(_links(proxy, proxy.index_url + 'pep8/')) == 2
+    monkeypatch.setattr(robustus.detail.pypi_proxy, 'urllib2', urllib2)
+
+    # project was removed from upstream
+    os.rename('simple', 'simple_moved')
+    with PypiProxy(wheelhouse, pages_dir, index_url=upstream + '/simple') as proxy:
+        assert _links(proxy, proxy.index_url + 'pep8/') == [proxy.url + '/files/pep8-1.4.6.tar.gz']
+
+
+def test_pypi_proxy_find_links(tmpdir, upstream):
+    wheelhouse = str(tmpdir.mkdir('wheelhouse'))
+    with PypiProxy(wheelhouse, os.path.join(wheelhouse, '.robustus', 'pypi_proxy'),
+                   index_url=upstream + '/simple') as proxy:
+        # digest from remote index doesn't match the file
+        links_url = proxy.find_links_url(upstream + '/packages/', {'pep8-1.4.6.tar.gz': 'bad digest'})
+        page = urllib2.urlopen(links_url).read()
+        assert 'sha256=bad+digest' in page
+        link = [l for l in _links(proxy, links_url) if 'pep8-1.4.6.tar.gz' in l][0]
+        with pytest.raises(urllib2.HTTPError):
+            urllib2.urlopen(link)
+        assert 'pep8-1.4.6.tar.gz' not in os.listdir(wheelhouse)
+
+
+def test_doc_tests():
+    doctest.testmod(robustus.detail.pypi_proxy, raise_on_error=True)
+
+
+if __name__ == '__main__':
+    pytest.main('-s %s -n0' % __file__)
@@ -0,0 +1,256 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+import fcntl
+import os
+import platform
+import pytest
+import shutil
+import tarfile
+import tempfile
+import time
+from robustus.robustus import Robustus
+from robustus.detail import RequirementException, RequirementSpecifier, scratch
+from robustus.detail.recipe import Recipe, BuildContext, Archive, Autotools, CMake, Make, Stage, Copy, CopyTree, Link, \
+    prune_build_dirs, BUILDS_DIR
+from robustus.detail.utility import run_shell
+
+
+# configure script and makefile of fake autotools package
+CONFIGURE = '''#!/bin/sh
+prefix=${1#--prefix=}
+sed "s|@prefix@|$prefix|" Makefile.in > Makefile
+'''
+MAKEFILE = '''prefix = @prefix@
+hello:
+\techo "#!/bin/sh" > hello
+\techo "echo $(GREETING)" >> hello
+\tchmod +x hello
+install: hello
+\tmkdir -p $(DESTDIR)$(prefix)/bin
+\tcp hello $(DESTDIR)$(prefix)/bin/hello
+'''
+
+
+# ccache isn't installed in test environment
+NO_COMPILER_CACHE = '--no-compiler-cache'
+
+
+def _make_archive(directory, name, files):
+    """
+    :param files: dict path inside archive root folder -> content
+    """
+    root = directory.mkdir(name)
+    for path, content in files.items():
+        f = root.join(path)
+        f.dirpath().ensure(dir=True)
+        f.write(content)
+        f.chmod(0755)
+    archive = str(directory.join(name + '.tar.gz'))
+    with tarfile.open(archive, 'w:gz') as tar:
+        tar.add(str(root), name)
+    root.remove()
+    return archive
+
+
+def _hello_recipe(url, greeting='hello'):
+    return Recipe('hello',
+                  source=Archive(url=url),
+                  build=Autotools(make_args=['GREETING=%s' % greeting]),
+                  outputs=['bin/hello'],
+                  runtime=[Link('bin/hello', 'bin/hello')])
+
+
+def test_autotools_recipe(tmpdir, make_robustus):
+    robustus = make_robustus(NO_COMPILER_CACHE)
+    archive = _make_archive(tmpdir.mkdir('remote'), 'hello-1.0', {'configure': CONFIGURE, 'Makefile.in': MAKEFILE})
+    requirement = RequirementSpecifier(name='hello', version='1.0')
+    recipe = _hello_recipe('file://' + archive)
+
+    prefix = recipe.install(robustus, requirement, False)
+    assert prefix == os.path.join(robustus.cache, 'hello-1.0')
+    assert recipe.in_cache(robustus, requirement)
+    hello = os.path.join(robustus.env, 'bin/hello')
+    assert os.path.realpath(hello) == os.path.join(prefix, 'bin/hello')
+    assert run_shell([hello], return_output=True) == (0, 'hello\n')
+    # nothing but the package is left in the cache, build directory is kept in scratch area
+    assert sorted(os.listdir(robustus.cache)) == ['.robustus', 'downloads', 'hello-1.0']
+    assert len(os.listdir(os.path.join(robustus.build_root, BUILDS_DIR))) == 1
+    assert robustus.build_root.startswith(str(tmpdir.join('scratch')))
+
+    # package in cache isn't built again
+    os.remove(archive)
+    os.remove(os.path.join(robustus.cache, 'downloads', 'hello-1.0.tar.gz'))
+    os.remove(hello)
+    assert recipe.install(robustus, requirement, False) == prefix
+    assert os.path.islink(hello)
+
+
+def test_failed_build_leaves_no_package(tmpdir, make_robustus):
+    robustus = make_robustus(NO_COMPILER_CACHE)
+    archive = _make_archive(tmpdir.mkdir('remote'), 'hello-1.0', {'configure': CONFIGURE,
+                                                                  'Makefile.in': 'hello:\n\tfalse\n'})
+    requirement = RequirementSpecifier(name='hello', version='1.0')
+    with pytest.raises(RequirementException) as exc_info:
+        _hello_recipe('file://' + archive).install(robustus, requirement, False)
+    assert 'hello build failed' in str(exc_info.value)
+    assert sorted(os.listdir(robustus.cache)) == ['.robustus', 'downloads']
+
+    # nothing is built if index is ignored
+    with pytest.raises(RequirementException) as exc_info:
+        _hello_recipe('file://' + archive).install(robustus, requirement, True)
+    assert 'can\'t find hello-1.0 in robustus cache' in str(exc_info.value)
+
+
+def test_failed_build_is_resumed(tmpdir, make_robustus):
+    robustus = make_robustus(NO_COMPILER_CACHE)
+    compiled = tmpdir.join('compiled')
+    allowed = tmpdir.join('allowed')
+    archive = _make_archive(tmpdir.mkdir('remote'), 'tool-1.0', {
+        'Makefile': 'all: out/tool\n'
+                    'obj:\n\techo obj >> %s && echo obj > obj\n'
+                    'out/tool: obj\n\ttest -f %s && mkdir -p out && cp obj out/tool\n' % (compiled, allowed)})
+    recipe = Recipe('tool', source=Archive(url='file://' + archive), build=Make(),
+                    stage=[Stage('out/tool', 'bin')], outputs=['bin/tool'])
+    requirement = RequirementSpecifier(name='tool', version='1.0')
+    with pytest.raises(RequirementException):
+        recipe.install(robustus, requirement, False)
+    assert compiled.read() == 'obj\n'
+
+    # retry doesn't fetch sources again and builds only what is missing
+    os.remove(archive)
+    os.remove(os.path.join(robustus.cache, 'downloads', 'tool-1.0.tar.gz'))
+    allowed.write('')
+    prefix = recipe.install(robustus, requirement, False)
+    assert open(os.path.join(prefix, 'bin/tool')).read() == 'obj\n'
+    assert compiled.read() == 'obj\n'
+
+
+def test_build_dirs_are_pruned(tmpdir, make_robustus):
+    robustus = make_robustus(NO_COMPILER_CACHE)
+    remote = tmpdir.mkdir('remote')
+    robustus.settings['find_links'] = ['file://' + str(remote)]
+    builds = os.path.join(robustus.build_root, BUILDS_DIR)
+    recipe = Recipe('tool', source=Archive(), build=Make(), stage=[Stage('tool')], outputs=['tool'])
+    robustus.settings['keep_builds'] = 2
+    for version in ['1', '2', '3']:
+        _make_archive(remote, 'tool-%s' % version, {'Makefile': 'all:\n\techo %s > tool\n' % version})
+        recipe.install(robustus, RequirementSpecifier(name='tool', version=version), False)
+        time.sleep(0.01)
+    assert sorted(d.split('-')[1] for d in os.listdir(builds)) == ['2', '3']
+
+    robustus.settings['keep_builds'] = 0
+    _make_archive(remote, 'tool-4', {'Makefile': 'all:\n\techo 4 > tool\n'})
+    recipe.install(robustus, RequirementSpecifier(name='tool', version='4'), False)
+    assert os.listdir(builds) == []
+
+    # directory of running build is never removed, nor is directory made by other builder
+    root = tmpdir.mkdir('builds')
+    with open(str(root.mkdir('build0').join('.lock')), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        for i in range(3):
+            root.ensure('build%d' % i, '.lock')
+            root.join('build%d' % i).setmtime(1000 + i)
+        root.ensure_dir('ros-src-hydro').setmtime(900)
+        prune_build_dirs(str(root), 1)
+    assert sorted(os.listdir(str(root))) == ['build0', 'build2', 'ros-src-hydro']
+    assert not root.join('ros-src-hydro', '.lock').exists()
+
+
+def test_ninja_is_used_if_installed(tmpdir, make_robustus, monkeypatch):
+    robustus = make_robustus(NO_COMPILER_CACHE)
+    ctx = BuildContext(robustus, Recipe('data'), RequirementSpecifier(name='data', version='0.1'))
+    bin_dir = tmpdir.mkdir('bin')
+    monkeypatch.setenv('PATH', str(bin_dir))
+    assert CMake().key(ctx) == 'CMake'
+
+    bin_dir.ensure('ninja').chmod(0755)
+    assert CMake().key(ctx) == 'CMake-Ninja'
+    # generator chosen by recipe or by user
+    assert CMake(['-G', 'Unix Makefiles']).key(ctx) == 'CMake'
+    assert CMake(ninja=False).key(ctx) == 'CMake'
+    robustus.settings['ninja'] = False
+    assert CMake().key(ctx) == 'CMake'
+
+
+def test_default_scratch(tmpdir, make_robustus, monkeypatch):
+    if scratch.tmpfs_dir() is not None:
+        assert make_robustus(scratch=None).build_root.startswith(scratch.TMPFS + '/robustus-')
+    # tmpfs without enough free space isn't used
+    monkeypatch.setattr(scratch, 'MIN_TMPFS_SPACE', 1 << 62)
+    assert make_robustus(scratch=None).build_root == str(tmpdir.join('env', Robustus.build_dirs_path))
+
+
+@pytest.mark.skipif(scratch.tmpfs_dir() is None, reason='requires tmpfs')
+def test_build_in_tmpfs(tmpdir, make_robustus):
+    tmpfs_scratch = tempfile.mkdtemp(dir=scratch.TMPFS)
+    try:
+        robustus = make_robustus(NO_COMPILER_CACHE, scratch=tmpfs_scratch)
+        archive = _make_archive(tmpdir.mkdir('remote'), 'hello-1.0', {'configure': CONFIGURE,
+                                                                      'Makefile.in': MAKEFILE})
+        prefix = _hello_recipe('file://' + archive).install(robustus, RequirementSpecifier(name='hello',
+                                                                                           version='1.0'), False)
+        # package is copied from tmpfs into the cache, build directory is left in tmpfs
+        assert not scratch.is_tmpfs(prefix)
+        assert run_shell([os.path.join(prefix, 'bin/hello')], return_output=True) == (0, 'hello\n')
+        assert sorted(os.listdir(robustus.cache)) == ['.robustus', 'downloads', 'hello-1.0']
+        assert len(os.listdir(os.path.join(robustus.build_root, BUILDS_DIR))) == 1
+    finally:
+        shutil.rmtree(tmpfs_scratch)
+
+
+def test_make_and_stage(tmpdir, make_robustus):
+    tmpdir.chdir()
+    robustus = make_robustus(NO_COMPILER_CACHE)
+    remote = tmpdir.mkdir('remote')
+    robustus.settings['find_links'] = ['file://' + str(remote)]
+    _make_archive(remote, 'tool-2.0', {'Makefile': 'all:\n\tmkdir -p out && echo built > out/tool\n',
+                                       'include/tool.h': '// header\n'})
+    recipe = Recipe('tool',
+                    source=Archive(),
+                    build=Make(),
+                    stage=[Stage('out/tool', 'bin'), Stage('include', root='source')],
+                    outputs=['bin/tool', 'include/tool.h'],
+                    runtime=[Copy('bin/*', 'bin'), CopyTree('tool')])
+    recipe.install(robustus, RequirementSpecifier(name='tool', version='2.0'), False)
+    assert open(os.path.join(robustus.env, 'bin/tool')).read() == 'built\n'
+    assert os.path.isfile(os.path.join(robustus.env, 'tool/include/tool.h'))
+    # archive from remote cache is removed after build
+    assert not tmpdir.join('tool-2.0.tar.gz').exists()
+
+
+def test_compiled_archive(tmpdir, make_robustus):
+    tmpdir.chdir()
+    robustus = make_robustus(NO_COMPILER_CACHE)
+    remote = tmpdir.mkdir('remote')
+    robustus.settings['find_links'] = ['file://' + str(remote)]
+    robustus.settings['no_remote_cache'] = False
+    _make_archive(remote, 'hello-1.0-%s.compiled' % platform.machine(), {'bin/hello': '#!/bin/sh\necho compiled\n'})
+    # source archive doesn't exist, compiled archive is used instead of building
+    recipe = Recipe('hello', source=Archive(), build=Autotools(), outputs=['bin/hello'], compiled_archive=True)
+    prefix = recipe.install(robustus, RequirementSpecifier(name='hello', version='1.0'), False)
+    assert run_shell([os.path.join(prefix, 'bin/hello')], return_output=True) == (0, 'compiled\n')
+    assert tmpdir.listdir(lambda p: p.basename.endswith('.tar.gz')) == []
+
+
+@pytest.mark.skipif(run_shell('which cmake', shell=True) != 0, reason='requires cmake')
+def test_cmake_recipe(tmpdir, make_robustus):
+    robustus = make_robustus(NO_COMPILER_CACHE)
+    archive = _make_archive(tmpdir.mkdir('remote'), 'data-0.1', {
+        'CMakeLists.txt': 'cmake_minimum_required(VERSION 2.8)\n'
+                          'project(data NONE)\n'
+                          'install(FILES data.txt DESTINATION share/${GREETING})\n',
+        'data.txt': 'data\n'})
+    recipe = Recipe('data',
+                    source=Archive(url='file://' + archive),
+                    build=CMake(['-DGREETING=%(name)s-%(version)s']),
+                    outputs=['share/data-0.1/data.txt'],
+                    runtime=[CopyTree()])
+    recipe.install(robustus, RequirementSpecifier(name='data', version='0.1'), False)
+    assert os.path.isfile(os.path.join(robustus.env, 'share/data-0.1/data.txt'))
+
+
+if __name__ == '__main__':
+    pytest.main('-s %s -n0' % __file__)
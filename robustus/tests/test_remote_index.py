@@ -0,0 +1,66 @@
+# =============================================================================
+# COPYRIGHT 2014 Brain Corporation.
+# License under MIT license (see LICENSE file)
+# =============================================================================
+
+import doctest
+import os
+import pytest
+import robustus
+from robustus.detail.remote_index import RemoteIndex, update_manifest, current_wheel_platform
+
+
+def _make_remote_cache(root_dir):
+    wheels_dir = os.path.join(root_dir, 'python-wheels')
+    os.makedirs(wheels_dir)
+    for filename in ['pep8-1.4.6-py27-none-any.whl',
+                     'scipy-0.13.3-cp27-none-%s.whl' % current_wheel_platform(),
+                     'numpy-1.7.1-cp27-none-some_other_platform.whl']:
+        with open(os.path.join(wheels_dir, filename), 'w') as f:
+            f.write(filename)
+    with open(os.path.join(root_dir, 'OpenCV-2.4.8-x86_64.compiled.tar.gz'), 'w') as f:
+        f.write('compiled opencv')
+
+
+def test_remote_index(tmpdir):
+    root_dir = os.path.join(str(tmpdir), 'remote')
+    _make_remote_cache(root_dir)
+    find_link = 'file://' + root_dir
+
+    index = RemoteIndex(os.path.join(str(tmpdir), 'index_cache'))
+    assert index.manifest(find_link) is None
+
+    update_manifest(root_dir)
+    # manifest is fetched only once per run
+    assert index.manifest(find_link) is None
+    manifest = RemoteIndex(os.path.join(str(tmpdir), 'index_cache')).manifest(find_link)
+    assert len(manifest) == 4
+
+    assert manifest.find_wheel('pep8', '1.4.6')['filename'] == 'pep8-1.4.6-py27-none-any.whl'
+    assert manifest.find_wheel('PEP8')['filename'] == 'pep8-1.4.6-py27-none-any.whl'
+    assert manifest.find_wheel('pep8', '1.3.3') is None
+    assert manifest.find_wheel('scipy', '0.13.3') is not None
+    assert manifest.find_wheel('numpy', '1.7.1') is None
+
+    entry = manifest.find_file('OpenCV-2.4.8-x86_64.compiled.tar.gz')
+    assert manifest.url(entry) == find_link + '/OpenCV-2.4.8-x86_64.compiled.tar.gz'
+    assert manifest.find_file('OpenCV-2.4.8-x86_64.compiled.zip') is None
+
+
+def test_remote_index_uses_cached_copy_when_unreachable(tmpdir):
+    root_dir = os.path.join(str(tmpdir), 'remote')
+    _make_remote_cache(root_dir)
+    update_manifest(root_dir)
+    cache_dir = os.path.join(str(tmpdir), 'index_cache')
+    assert len(RemoteIndex(cache_dir).manifest('file://' + root_dir)) == 4
+
+    os.rename(root_dir, root_dir + '_moved')
+    assert len(RemoteIndex(cache_dir).manifest('file://' + root_dir)) == 4
+
+
+def test_doc_tests():
+    doctest.testmod(robustus.detail.remote_index, raise_on_error=True)
+
+
+if __name__ == '__main__':
+    pytest.main('-s %s -n0' % __file__)
@@ -20,6 +20,7 @@ remove_duplicate_requirements = robustus.detail.requirement.remove_duplicate_req
 expand_requirements_specifiers = robustus.detail.requirement.expand_requirements_specifiers
 generate_dependency_list = robustus.detail.requirement.generate_dependency_list
 _filter_requirements_lines = robustus.detail.requirement._filter_requirements_lines
+read_requirement_file = robustus.detail.requirement.read_requirement_file
 
 
 def test_requirement_recursion_single_item():
@@ -200,6 +201,94 @@ def test_requirement_recursion_do_not_fetch_twice():
     assert(mock_git._traverse_to_internal_count == 1)
 
 
+def test_requirement_recursion_concurrent_fetch(monkeypatch):
+    import threading
+    import time
+
+    class MockGit(object):
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.running = 0
+            self.max_running = 0
+            self.calls = []
+
+        def access(self, link, branch, path, ignore_missing_refs = False):
+            with self.lock:
+                self.calls.append(link)
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            time.sleep(0.1)
+            with self.lock:
+                self.running -= 1
+            name = link.split('/')[-1]
+            if name == 'top':
+                return ['-e git+https://github.com/company/p%d@master#egg=p%d' % (i, i) for i in range(6)]
+            elif name == 'p0':
+                return ['numpy==1', '-e git+https://github.com/company/common@master#egg=common']
+            elif name == 'common':
+                return ['numpy==2', 'scipy==1']
+            return ['-e git+https://github.com/company/common@master#egg=common', 'opencv==%s' % name[1]]
+
+    specifiers = ['-e git+https://github.com/company/top@master#egg=top', 'numpy==3']
+    mock_git = MockGit()
+    reqs = expand_requirements_specifiers(specifiers, mock_git)
+    assert(mock_git.max_running > 1)
+    # every requirements file is fetched once
+    assert(len(mock_git.calls) == len(set(mock_git.calls)) == 8)
+
+    # same result as serial depth first recursion
+    monkeypatch.setattr(robustus.detail.requirement, 'prefetch_requirements_files', lambda *args, **kwargs: None)
+    serial_git = MockGit()
+    serial_reqs = expand_requirements_specifiers(specifiers, serial_git)
+    assert(serial_git.max_running == 1)
+    assert([r.freeze() for r in reqs] == [r.freeze() for r in serial_reqs])
+    assert([r.freeze() for r in reqs if r.name == 'numpy'] == ['numpy==3'])
+
+
+def test_expand_large_requirements_set(monkeypatch):
+    from collections import OrderedDict
+
+    def reference_dedup(requirements):
+        # original implementation of remove_duplicate_requirements
+        result = OrderedDict()
+        ros_overlay_counter = 0
+        for r in requirements:
+            name = r.base_name()
+            if name == 'ros_overlay':
+                name += str(ros_overlay_counter)
+                ros_overlay_counter += 1
+            result[name] = r
+        return result.values()
+
+    lines = []
+    for i in range(1500):
+        lines.append('package%d==1.%d' % (i % 500, i))
+        if i % 100 == 0:
+            lines.append('ros_overlay==git@github.com:company/ros_package%d.git' % (i % 300))
+            lines.append('http://some_url/archive%d.tar.gz' % (i % 200))
+
+    # every resolved requirement is compared with the ones resolved before on hashed key, not one by one
+    base_name = RequirementSpecifier.base_name
+    base_name_calls = []
+
+    def counting_base_name(self):
+        base_name_calls.append(self)
+        return base_name(self)
+    monkeypatch.setattr(RequirementSpecifier, 'base_name', counting_base_name)
+    reqs = expand_requirements_specifiers(lines, mock.MagicMock())
+    assert(len(base_name_calls) < 2 * len(lines))
+    monkeypatch.undo()
+
+    expected = []
+    for line in lines:
+        r = RequirementSpecifier(specifier=line)
+        if r.freeze() not in [ritem.freeze() for ritem in expected]:
+            expected = reference_dedup(expected + [r])
+    assert([req.freeze() for req in reqs] == [req.freeze() for req in expected])
+    assert([req.freeze() for req in remove_duplicate_requirements(reqs + reqs)] ==
+           [req.freeze() for req in reference_dedup(reqs + reqs)])
+
+
 def test_dependency_list_generator():
     from collections import OrderedDict
 
@@ -335,6 +424,60 @@ def test_multiline_requirements_parsing(tmpdir):
     assert(reqs[4].freeze() == '-e ' + temp_folder)
 
 
+def test_nested_includes_and_constraints(tmpdir):
+    tmpdir.join('common', 'base.txt').write('numpy==1.7.2\nscipy==0.13.3\n', ensure=True)
+    tmpdir.join('common', 'vision.txt').write('-r base.txt\nopencv==2.4.8\n')
+    tmpdir.join('pins.txt').write('numpy==1.8.0\nunused==1.0\n')
+    tmpdir.join('requirements.txt').write('-r common/vision.txt\n--requirement=common/base.txt\n'
+                                          '-c pins.txt\npep8\n')
+    requirements_file = str(tmpdir.join('requirements.txt'))
+    visited_sites = {}
+    reqs = read_requirement_file(requirements_file, None, visited_sites=visited_sites)
+    assert [r.freeze() for r in reqs] == ['numpy==1.8.0', 'scipy==0.13.3', 'opencv==2.4.8', 'pep8']
+    # includes are recorded with resolved paths for the dependency graph
+    assert visited_sites[requirements_file] == ['-r ' + str(tmpdir.join('common', 'vision.txt')),
+                                                '-r ' + str(tmpdir.join('common', 'base.txt')),
+                                                '-c ' + str(tmpdir.join('pins.txt')),
+                                                'pep8']
+    assert visited_sites[str(tmpdir.join('common', 'base.txt'))] == ['numpy==1.7.2\n', 'scipy==0.13.3\n']
+
+
+def test_constraint_names_are_normalized(tmpdir):
+    tmpdir.join('pins.txt').write('py-serial==2.7\nFoo_Bar==1.1\n')
+    tmpdir.join('requirements.txt').write('-c pins.txt\nPy_Serial==2.6\nfoo-bar==1.0\n')
+    reqs = read_requirement_file(str(tmpdir.join('requirements.txt')), None)
+    assert [r.freeze() for r in reqs] == ['py-serial==2.7', 'Foo_Bar==1.1']
+
+
+def test_include_cycle(tmpdir):
+    tmpdir.join('a.txt').write('numpy==1.7.2\n-r b.txt\n')
+    tmpdir.join('b.txt').write('-r a.txt\n')
+    with pytest.raises(RequirementException) as exc_info:
+        read_requirement_file(str(tmpdir.join('a.txt')), None)
+    assert str(exc_info.value) == 'Requirements files include each other: %s -> %s -> %s' % (
+        tmpdir.join('a.txt'), tmpdir.join('b.txt'), tmpdir.join('a.txt'))
+
+
+def test_includes_in_remote_package():
+    files = {'requirements.txt': ['-r requirements/base.txt\n', '-c requirements/pins.txt\n'],
+             'requirements/base.txt': ['numpy==1.7.2\n', '-r ../requirements/extra.txt\n'],
+             'requirements/extra.txt': ['scipy\n'],
+             'requirements/pins.txt': ['scipy==0.13.3\n']}
+    mock_git = mock.MagicMock()
+    mock_git.access.side_effect = lambda link, tag, path, ignore_missing_refs: files[path]
+    reqs = do_requirement_recursion(mock_git, RequirementSpecifier(
+        specifier='-e git+https://github.com/company/my_package@branch_name#egg=my_package'))
+    assert [r.freeze() for r in reqs] == ['numpy==1.7.2', 'scipy==0.13.3',
+                                          '-e git+https://github.com/company/my_package@branch_name#egg=my_package']
+    # included files are read at the same branch
+    assert set(call[0][1] for call in mock_git.access.call_args_list) == set(['branch_name'])
+
+    files['requirements.txt'] = ['-r ../outside.txt\n']
+    with pytest.raises(RequirementException):
+        do_requirement_recursion(mock_git, RequirementSpecifier(
+            specifier='-e git+https://github.com/company/other_package#egg=other_package'))
+
+
 def test_doc_tests():
     result = doctest.testmod(robustus.detail.requirement)
     if result[0]>0:
@@ -9,10 +9,14 @@ import os
 import pytest
 import robustus
 from robustus.detail import check_module_available
-from robustus.detail.utility import run_shell, check_run_shell
+from robustus.detail.utility import run_shell, check_run_shell, set_shell_timeouts, terminate_shell_commands
+from robustus.detail.utility import CommandTimeout
 import shutil
 import subprocess
+import sys
 import tempfile
+import threading
+import time
 
 
 def test_doc_tests():
@@ -39,6 +43,60 @@ def test_run_shell():
     check('echo robustus && exit 1', 1, 'robustus\n', verbose=False)
  
  
+def test_run_shell_capture():
+    for verbose in [True, False]:
+        assert run_shell('echo robustus; echo error >&2; exit 3', shell=True, verbose=verbose,
+                         return_output=True) == (3, 'robustus\nerror\n')
+    # large output doesn't block the command
+    ret_code, output = run_shell([sys.executable, '-c', 'print "x" * 1000000'], return_output=True)
+    assert (ret_code, len(output)) == (0, 1000001)
+    # background child keeping output open doesn't delay return
+    start = time.time()
+    assert run_shell('sleep 5 & echo started', shell=True, return_output=True) == (0, 'started\n')
+    assert time.time() - start < 3
+
+
+def test_run_shell_idle_cpu():
+    start = os.times()
+    assert run_shell(['sleep', '1']) == 0
+    end = os.times()
+    assert (end[0] - start[0]) + (end[1] - start[1]) < 0.2
+
+
+def test_run_shell_timeout(tmpdir):
+    pid_file = str(tmpdir.join('pid'))
+    start = time.time()
+    # grandchild is killed together with the command
+    with pytest.raises(CommandTimeout):
+        run_shell('sleep 30 & echo $! > %s; wait' % pid_file, shell=True, timeout=1)
+    assert time.time() - start < 10
+    time.sleep(0.5)
+    with pytest.raises(OSError):
+        os.kill(int(open(pid_file).read()), 0)
+
+    try:
+        set_shell_timeouts(step_timeout=1)
+        with pytest.raises(CommandTimeout):
+            run_shell(['sleep', '30'])
+        assert run_shell(['sleep', '2'], timeout=5) == 0
+        # overall deadline limits even commands with own timeout
+        set_shell_timeouts(overall_timeout=1)
+        with pytest.raises(CommandTimeout):
+            run_shell(['sleep', '30'], timeout=10)
+    finally:
+        set_shell_timeouts()
+
+
+def test_terminate_shell_commands():
+    result = []
+    thread = threading.Thread(target=lambda: result.append(run_shell(['sleep', '30'])))
+    thread.start()
+    time.sleep(1)
+    terminate_shell_commands()
+    thread.join(10)
+    assert result == [-15]
+
+
 def test_robustus(tmpdir):
     tmpdir.chdir()
     test_env = 'test_env'